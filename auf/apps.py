@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AufConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'auf'
+
+    def ready(self):
+        # Drops cached users (auf.authentication) when their row changes
+        from auf import signals  # noqa: F401
@@ -0,0 +1,145 @@
+"""
+JWT authentication without a users-table query on every request.
+
+CachedJWTAuthentication keeps what authentication checks of a user (id,
+is_active and token version, never the password hash) in Django's cache for
+JWT_USER_CACHE_TIMEOUT seconds, keyed by user id. request.user is a User
+with only those fields loaded; any other field is read from the database
+when first used. Tokens carry a version claim derived from the user's
+password hash (like Django's session auth hash), so changing the password
+revokes tokens issued before it. The cached entry is dropped whenever the
+user row is saved or deleted (auf.signals): password changes and
+deactivation take effect on the next request. Queryset update() sends no
+signals, so code changing users that way must call invalidate_cached_user()
+for them, or they stay authenticated as before for up to
+JWT_USER_CACHE_TIMEOUT seconds.
+
+TokenUserAuthentication builds a stateless TokenUser from the token alone,
+for read-only views that only need request.user.id (TokenUserReadsMixin).
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+TOKEN_VERSION_CLAIM = 'ver'
+
+User = get_user_model()
+
+
+def token_version(user):
+    """Changes whenever the user's password does"""
+    return user.get_session_auth_hash()[:16]
+
+
+def _user_cache_key(user_id):
+    return f'jwt-user-auth:{user_id}'
+
+
+def invalidate_cached_user(*user_ids):
+    """
+    Drops cached users, now and again once the current transaction commits.
+    Needed after changing users with queryset update(), which auf.signals
+    doesn't see.
+    """
+    keys = [_user_cache_key(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    # A request reading the old row before the commit could have cached it again
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _auth_state(user):
+    """What authentication needs of a user, the cached value"""
+    return {'id': user.pk, 'is_active': user.is_active, 'version': token_version(user)}
+
+
+def _user_from_state(user_model, state):
+    """A User with only id and is_active loaded, the other fields deferred"""
+    field_names = [user_model._meta.pk.attname, 'is_active']
+    return user_model.from_db('default', field_names, [state['id'], state['is_active']])
+
+
+class VersionedRefreshToken(RefreshToken):
+    """Refresh token (and the access tokens made from it) carrying the user's token version"""
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token[TOKEN_VERSION_CLAIM] = token_version(user)
+        return token
+
+
+def _get_user_id(validated_token):
+    try:
+        return validated_token[api_settings.USER_ID_CLAIM]
+    except KeyError:
+        raise InvalidToken(_('Token contained no recognizable user identification'))
+
+
+def _check_state(state, validated_token):
+    if not state['is_active']:
+        raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+    # Tokens issued before versioning have no claim and stay valid until they expire
+    version = validated_token.get(TOKEN_VERSION_CLAIM)
+    if version is not None and version != state['version']:
+        raise AuthenticationFailed(_('Token has been revoked'), code='token_revoked')
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication reading the user from the cache, and the database only on a miss"""
+
+    def get_user(self, validated_token):
+        user_id = _get_user_id(validated_token)
+        key = _user_cache_key(user_id)
+        state = cache.get(key)
+        if state is None:
+            try:
+                user = self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_('User not found'), code='user_not_found')
+            state = _auth_state(user)
+            cache.set(key, state, timeout=settings.JWT_USER_CACHE_TIMEOUT)
+        _check_state(state, validated_token)
+        return _user_from_state(self.user_model, state)
+
+    async def aget_user(self, validated_token):
+        """get_user for async views, with the async cache and ORM APIs"""
+        user_id = _get_user_id(validated_token)
+        key = _user_cache_key(user_id)
+        state = await cache.aget(key)
+        if state is None:
+            try:
+                user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_('User not found'), code='user_not_found')
+            state = _auth_state(user)
+            await cache.aset(key, state, timeout=settings.JWT_USER_CACHE_TIMEOUT)
+        _check_state(state, validated_token)
+        return _user_from_state(self.user_model, state)
+
+
+class TokenUserAuthentication(JWTStatelessUserAuthentication):
+    """
+    request.user is a TokenUser built from the token: no cache or database
+    lookup, but also no check for deactivation or revocation before the
+    token expires.
+    """
+
+
+class TokenUserReadsMixin:
+    """
+    For APIViews whose GET/HEAD handlers only use request.user.id: with
+    JWT_TOKEN_USER_READS on, those requests authenticate statelessly.
+    """
+
+    def get_authenticators(self):
+        authenticators = super().get_authenticators()
+        if settings.JWT_TOKEN_USER_READS and self.request.method in SAFE_METHODS:
+            return [TokenUserAuthentication()] + authenticators
+        return authenticators
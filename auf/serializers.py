@@ -3,6 +3,8 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
+from .authentication import VersionedRefreshToken
+
 User = get_user_model()
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
@@ -35,6 +37,8 @@ class UserProfileSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'date_joined')
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = VersionedRefreshToken
+
     def validate(self, attrs):
         data = super().validate(attrs)
         data['user'] = UserProfileSerializer(self.user).data
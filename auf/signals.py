@@ -0,0 +1,20 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from auf.authentication import invalidate_cached_user
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_user_on_save(sender, instance, update_fields, **kwargs):
+    # Logins (UPDATE_LAST_LOGIN) only touch last_login, which authentication doesn't read
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_cached_user(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_cached_user_on_delete(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
@@ -1,3 +1,124 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
 
-# Create your tests here.
+from .authentication import TOKEN_VERSION_CLAIM, VersionedRefreshToken, invalidate_cached_user
+
+User = get_user_model()
+
+
+class CachedJWTAuthenticationTestCase(APITestCase):
+    """Test case for the cached user of JWT-authenticated requests"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='jwtuser',
+            email='jwtuser@test.com',
+            password='testpass123'
+        )
+        self.authorize(VersionedRefreshToken.for_user(self.user))
+
+    def authorize(self, refresh):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+
+    def test_login_tokens_carry_version(self):
+        response = self.client.post(reverse('auf:login'), {'username': 'jwtuser', 'password': 'testpass123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        refresh = VersionedRefreshToken(response.data['refresh'])
+        self.assertIn(TOKEN_VERSION_CLAIM, refresh)
+        self.assertIn(TOKEN_VERSION_CLAIM, refresh.access_token)
+
+    def user_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [query['sql'] for query in queries.captured_queries if 'auth_user' in query['sql']]
+
+    def test_cached_user_needs_no_query(self):
+        self.client.get(reverse('user-keyphotos'))
+        self.assertEqual(self.user_queries(reverse('user-keyphotos')), [])
+
+    def test_cache_holds_no_password(self):
+        self.client.get(reverse('user-keyphotos'))
+        cached = cache.get(f'jwt-user-auth:{self.user.pk}')
+        self.assertEqual(set(cached), {'id', 'is_active', 'version'})
+        self.assertNotIn(self.user.password, cached.values())
+
+    def test_profile_update_invalidates_cache(self):
+        self.client.get(reverse('auf:profile'))
+        response = self.client.patch(reverse('auf:profile'), {'first_name': 'Renamed'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get(reverse('auf:profile'))
+        self.assertEqual(response.data['first_name'], 'Renamed')
+
+    def test_deactivation_invalidates_cache(self):
+        self.client.get(reverse('auf:profile'))
+        self.user.is_active = False
+        self.user.save()
+
+        response = self.client.get(reverse('auf:profile'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_bulk_deactivation_needs_invalidation(self):
+        self.client.get(reverse('auf:profile'))
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        invalidate_cached_user(self.user.pk)
+
+        response = self.client.get(reverse('auf:profile'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_login_keeps_cache(self):
+        self.client.get(reverse('user-keyphotos'))
+        self.client.post(reverse('auf:login'), {'username': 'jwtuser', 'password': 'testpass123'})
+        self.assertEqual(self.user_queries(reverse('user-keyphotos')), [])
+
+    def test_profile_update_keeps_last_login(self):
+        self.client.get(reverse('auf:profile'))
+        self.client.post(reverse('auf:login'), {'username': 'jwtuser', 'password': 'testpass123'})
+        last_login = User.objects.get(pk=self.user.pk).last_login
+        self.assertIsNotNone(last_login)
+
+        response = self.client.patch(reverse('auf:profile'), {'first_name': 'Renamed'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(User.objects.get(pk=self.user.pk).last_login, last_login)
+
+    def test_password_change_revokes_old_tokens(self):
+        self.client.get(reverse('auf:profile'))
+        old_refresh = VersionedRefreshToken.for_user(self.user)
+        changed = self.client.post(reverse('auf:change_password'), {
+            'old_password': 'testpass123',
+            'new_password': 'N3w-passphrase!',
+            'new_password_confirm': 'N3w-passphrase!',
+        })
+        self.assertEqual(changed.status_code, status.HTTP_200_OK)
+
+        self.authorize(old_refresh)
+        response = self.client.get(reverse('auf:profile'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        # The tokens handed back with the response are valid
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {changed.data['access']}")
+        response = self.client.get(reverse('auf:profile'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_deleted_user_is_rejected(self):
+        self.client.get(reverse('auf:profile'))
+        self.user.delete()
+
+        response = self.client.get(reverse('auf:profile'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(JWT_TOKEN_USER_READS=True)
+    def test_token_user_reads(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('user-keyphotos'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(any('auf_user' in query['sql'] or 'auth_user' in query['sql']
+                             for query in queries.captured_queries))
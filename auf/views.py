@@ -3,6 +3,7 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from django.contrib.auth import get_user_model
+from .authentication import VersionedRefreshToken
 from .serializers import (
     UserRegistrationSerializer,
     UserProfileSerializer,
@@ -36,7 +37,8 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
-        return self.request.user
+        # request.user only has what authentication needs, updates work on the current row
+        return User.objects.get(pk=self.request.user.pk)
 
 class ChangePasswordView(APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -44,10 +46,16 @@ class ChangePasswordView(APIView):
     def post(self, request):
         serializer = ChangePasswordSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
-            user = request.user
+            user = User.objects.get(pk=request.user.pk)
             user.set_password(serializer.validated_data['new_password'])
-            user.save()
-            return Response({'message': 'Password changed successfully'}, status=status.HTTP_200_OK)
+            user.save(update_fields=['password'])
+            # Tokens issued before the change are revoked, hand out new ones
+            refresh = VersionedRefreshToken.for_user(user)
+            return Response({
+                'message': 'Password changed successfully',
+                'refresh': str(refresh),
+                'access': str(refresh.access_token),
+            }, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class LogoutView(APIView):
@@ -0,0 +1,16 @@
+"""
+Celery app for gymguru project.
+
+Start a worker with:
+    celery -A gymguru worker -l info
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gymguru.settings')
+
+app = Celery('gymguru')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -0,0 +1,236 @@
+"""
+Read-replica routing.
+
+Replicas are the DATABASE_REPLICAS aliases. Only reads of requests that
+can't be affected by replication lag go to them: safe-method (GET/HEAD)
+requests to views with `replica_reads = True`, by a client that hasn't
+written anything in the last DATABASE_STICKY_SECONDS. Everything else
+(writes, unsafe methods, other views, Celery tasks, management commands)
+uses the primary.
+
+ReplicaRoutingMiddleware keeps the routing state of the current request in
+a ContextVar. Once anything is written during a request, its remaining
+reads go to the primary too, and the client is marked in the cache as
+sticky, so the photo they just uploaded shows up in the next list. Changes
+made outside requests, e.g. by Celery tasks, mark the owner sticky when
+they bump a collection version (timelines.versioning). Clients are
+identified by the user id of their access token (or session), without
+authenticating them again.
+
+Each process checks the replicas' lag at most every
+DATABASE_REPLICA_CHECK_INTERVAL seconds and leaves out the ones more than
+DATABASE_REPLICA_MAX_LAG behind or not answering, falling back to the
+primary when none is left.
+"""
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+from prometheus_client import Gauge
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+REPLICA_LAG = Gauge(
+    'gymguru_db_replica_lag_seconds', 'Replication lag of a read replica at the last check',
+    ['alias'], multiprocess_mode='max',
+)
+REPLICA_HEALTHY = Gauge(
+    'gymguru_db_replica_healthy', '1 while a read replica is used, 0 while it is left out',
+    ['alias'], multiprocess_mode='min',
+)
+
+# Seconds since the last replayed transaction, 0 when the replica has replayed everything it received
+POSTGRES_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+def sticky_cache_key(user_id):
+    return f'db-sticky:{user_id}'
+
+
+def _client_user_id(request):
+    """User id of the request's access token or session, None for anonymous or invalid ones"""
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header else None
+    if raw_token is not None:
+        try:
+            return AccessToken(raw_token).get(jwt_settings.USER_ID_CLAIM)
+        except TokenError:
+            return None
+    session = getattr(request, 'session', None)
+    return session.get(SESSION_KEY) if session is not None else None
+
+
+class RoutingState:
+    """Where the reads of one request go"""
+    _unknown = object()
+
+    def __init__(self, request):
+        self.request = request
+        self.replica_reads = False
+        self.wrote = False
+        self._user_id = self._unknown
+        self._replica = None
+
+    @property
+    def user_id(self):
+        if self._user_id is self._unknown:
+            self._user_id = _client_user_id(self.request)
+        return self._user_id
+
+    def replica(self):
+        """The replica for this request's reads, the same one for all of them, or None"""
+        if not self.replica_reads or self.wrote:
+            return None
+        if self._replica is None:
+            user_id = self.user_id
+            if user_id is not None and cache.get(sticky_cache_key(user_id)):
+                self.replica_reads = False
+                return None
+            healthy = replica_health.healthy_replicas()
+            if not healthy:
+                return None
+            self._replica = random.choice(healthy)
+        return self._replica
+
+
+_current_state = ContextVar('db_routing_state', default=None)
+
+
+class ReplicaHealth:
+    """Per-process replica lag checks, run by whichever request finds the last one too old"""
+
+    def __init__(self):
+        self._healthy = {}
+        self._checked_at = {}
+        self._lock = threading.Lock()
+
+    def healthy_replicas(self):
+        now = time.monotonic()
+        replicas = settings.DATABASE_REPLICAS
+        if any(now - self._checked_at.get(alias, float('-inf')) >= settings.DATABASE_REPLICA_CHECK_INTERVAL
+               for alias in replicas):
+            # One thread checks, the others go on with the last results
+            if self._lock.acquire(blocking=False):
+                try:
+                    self.check(now)
+                finally:
+                    self._lock.release()
+        return [alias for alias in replicas if self._healthy.get(alias)]
+
+    def check(self, now=None):
+        now = time.monotonic() if now is None else now
+        for alias in settings.DATABASE_REPLICAS:
+            try:
+                lag = self.measure_lag(alias)
+            except DatabaseError:
+                lag = None
+            healthy = lag is not None and lag <= settings.DATABASE_REPLICA_MAX_LAG
+            if lag is not None:
+                REPLICA_LAG.labels(alias).set(lag)
+            REPLICA_HEALTHY.labels(alias).set(int(healthy))
+            self._healthy[alias] = healthy
+            self._checked_at[alias] = now
+
+    @staticmethod
+    def measure_lag(alias):
+        """Seconds `alias` is behind the primary; raises DatabaseError when it doesn't answer"""
+        connection = connections[alias]
+        with connection.cursor() as cursor:
+            if connection.vendor != 'postgresql':
+                cursor.execute('SELECT 1')
+                return 0.0
+            cursor.execute(POSTGRES_LAG_SQL)
+            return float(cursor.fetchone()[0])
+
+    def reset(self):
+        self._healthy.clear()
+        self._checked_at.clear()
+
+
+replica_health = ReplicaHealth()
+
+
+class ReplicaRouter:
+    """Sends the reads of ReplicaRoutingMiddleware-approved requests to a healthy replica"""
+
+    def db_for_read(self, model, **hints):
+        state = _current_state.get()
+        return state.replica() if state is not None else None
+
+    def db_for_write(self, model, **hints):
+        state = _current_state.get()
+        if state is not None:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {'default', *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Replicas get their schema through replication
+        return False if db in settings.DATABASE_REPLICAS else None
+
+
+class ReplicaRoutingMiddleware:
+    """Lets safe-method requests to `replica_reads` views read from replicas"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RoutingState(request)
+        token = _current_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_state.reset(token)
+        self.finish(state)
+        return response
+
+    async def __acall__(self, request):
+        state = RoutingState(request)
+        token = _current_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_state.reset(token)
+        self.finish(state)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Sync process_view runs in another thread under ASGI: the state is changed, not replaced
+        state = _current_state.get()
+        view_class = getattr(view_func, 'view_class', None)
+        if state is not None and settings.DATABASE_REPLICAS and request.method in SAFE_METHODS:
+            state.replica_reads = getattr(view_class, 'replica_reads', False)
+        return None
+
+    @staticmethod
+    def finish(state):
+        if state.wrote and settings.DATABASE_REPLICAS and state.user_id is not None:
+            cache.set(sticky_cache_key(state.user_id), True, timeout=settings.DATABASE_STICKY_SECONDS)
@@ -0,0 +1,247 @@
+"""
+Request-level performance instrumentation.
+
+InstrumentationMiddleware collects, per request: wall time, SQL query count
+and time (connection.execute_wrapper on every database connection), S3 call count
+and latency (botocore before-call/after-call hooks on the shared client),
+multipart parsing and url signing time, and the response size. They are
+returned in a Server-Timing header and recorded in Prometheus histograms
+labelled by URL name, served by metrics_view to scrapers holding
+METRICS_TOKEN. SQL query time is also recorded by database alias, so
+replica and primary load can be compared.
+
+The middleware runs natively in both sync (WSGI) and async (ASGI) stacks.
+Under ASGI queries run in sync_to_async threads, each on its own connection,
+so the SQL wrapper is installed on every connection as it is created; the
+current request is found through a ContextVar, which those threads inherit.
+"""
+import hmac
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from rest_framework.parsers import MultiPartParser
+
+# Server-Timing names, in header order
+SPANS = ('parse', 'db', 's3', 'sign')
+
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+REQUEST_DURATION = Histogram(
+    'gymguru_request_duration_seconds', 'Wall time of a request',
+    ['view', 'method', 'status'],
+)
+SPAN_DURATION = Histogram(
+    'gymguru_request_span_duration_seconds', 'Time a request spent in parse / db / s3 / sign',
+    ['view', 'span'],
+)
+SPAN_CALLS = Histogram(
+    'gymguru_request_span_calls', 'SQL queries / S3 calls / urls signed per request',
+    ['view', 'span'], buckets=COUNT_BUCKETS,
+)
+RESPONSE_SIZE = Histogram(
+    'gymguru_response_size_bytes', 'Response body size',
+    ['view'], buckets=SIZE_BUCKETS,
+)
+QUERY_DURATION = Histogram(
+    'gymguru_db_query_duration_seconds', 'SQL query time by database alias (primary or replica)',
+    ['alias'],
+)
+
+
+class RequestStats:
+    """Counters of one request, shared with the threads working for it"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.calls = dict.fromkeys(SPANS, 0)
+        self.seconds = dict.fromkeys(SPANS, 0.0)
+        self._lock = threading.Lock()
+
+    def add(self, span, seconds):
+        with self._lock:
+            self.calls[span] += 1
+            self.seconds[span] += seconds
+
+    def server_timing(self, total):
+        entries = [f'app;dur={total * 1000:.1f}']
+        for span in SPANS:
+            if self.calls[span]:
+                entries.append(f'{span};dur={self.seconds[span] * 1000:.1f};desc="{self.calls[span]} calls"')
+        return ', '.join(entries)
+
+
+_current_stats = ContextVar('request_stats', default=None)
+# Spans timed explicitly in this context; nested hooks for the same span are ignored
+_open_spans = ContextVar('open_spans', default=frozenset())
+
+
+@contextmanager
+def timed(span):
+    """Counts the enclosed block as one `span` call of the current request"""
+    stats = _current_stats.get()
+    if stats is None or span in _open_spans.get():
+        yield
+        return
+    token = _open_spans.set(_open_spans.get() | {span})
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.add(span, time.perf_counter() - started)
+        _open_spans.reset(token)
+
+
+def bind_request_stats(fn):
+    """
+    Wraps `fn` so that calls from other threads (e.g. a ThreadPoolExecutor)
+    are counted towards the request that created the wrapper.
+    """
+    stats = _current_stats.get()
+
+    def wrapper(*args, **kwargs):
+        token = _current_stats.set(stats)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_stats.reset(token)
+    return wrapper
+
+
+def _record_sql(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        with timed('db'):
+            return execute(sql, params, many, context)
+    finally:
+        QUERY_DURATION.labels(context['connection'].alias).observe(time.perf_counter() - started)
+
+
+@receiver(connection_created)
+def _instrument_connection(sender, connection, **kwargs):
+    if _record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_sql)
+
+
+def _before_s3_call(context, **kwargs):
+    if _current_stats.get() is not None and 's3' not in _open_spans.get():
+        context['instrumentation_started'] = time.perf_counter()
+
+
+def _after_s3_call(context, **kwargs):
+    started = context.pop('instrumentation_started', None)
+    stats = _current_stats.get()
+    if started is not None and stats is not None:
+        stats.add('s3', time.perf_counter() - started)
+
+
+def instrument_s3_client(client):
+    """
+    Times every API call of `client`. Managed transfers (upload_fileobj and
+    friends) run in s3transfer's own threads, so call sites wrap them in
+    timed('s3') instead.
+    """
+    client.meta.events.register('before-call.s3', _before_s3_call)
+    client.meta.events.register('after-call.s3', _after_s3_call)
+    return client
+
+
+class TimedMultiPartParser(MultiPartParser):
+    """MultiPartParser that reports its time as the `parse` span"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        with timed('parse'):
+            return super().parse(stream, media_type, parser_context)
+
+
+def _response_size(response):
+    if response.streaming:
+        return int(response.get('Content-Length') or 0) or None
+    return len(response.content)
+
+
+class InstrumentationMiddleware:
+    """Should come first in MIDDLEWARE so the wall time covers the whole stack"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    # Connections opened before the connection_created hook was installed
+                    if _record_sql not in connections[alias].execute_wrappers:
+                        stack.enter_context(connections[alias].execute_wrapper(_record_sql))
+                response = self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        return self.finish(request, response, stats)
+
+    def finish(self, request, response, stats):
+        # Streaming responses are timed up to the first byte
+        total = time.perf_counter() - stats.started
+
+        match = request.resolver_match
+        view = match.url_name if match and match.url_name else 'unmatched'
+        REQUEST_DURATION.labels(view, request.method, response.status_code).observe(total)
+        for span in SPANS:
+            SPAN_CALLS.labels(view, span).observe(stats.calls[span])
+            if stats.calls[span]:
+                SPAN_DURATION.labels(view, span).observe(stats.seconds[span])
+        size = _response_size(response)
+        if size is not None:
+            RESPONSE_SIZE.labels(view).observe(size)
+
+        if settings.SERVER_TIMING_HEADER:
+            response['Server-Timing'] = stats.server_timing(total)
+        return response
+
+
+def metrics_view(request):
+    """Prometheus metrics, for scrapers sending METRICS_TOKEN as a bearer token"""
+    # Behind a reverse proxy every request comes from its address, so only the token counts
+    expected = f'Bearer {settings.METRICS_TOKEN}' if settings.METRICS_TOKEN else None
+    authorization = request.headers.get('Authorization', '')
+    if expected is None or not hmac.compare_digest(authorization.encode(), expected.encode()):
+        return HttpResponseForbidden()
+    registry = REGISTRY
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        # Several worker processes (gunicorn): merge the per-process files
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,41 @@
+"""
+JSON rendering with orjson.
+
+ORJSONRenderer is a drop-in replacement for DRF's JSONRenderer that
+produces the same bytes for the same data (compact separators, UTF-8,
+\\u2028/\\u2029 escaped, datetimes and other non-JSON types through DRF's
+JSONEncoder), several times faster on large list responses. Indented
+output (the browsable API, `Accept: application/json; indent=4`) and
+non-default UNICODE_JSON/COMPACT_JSON settings fall back to DRF.
+
+Floats are written in the shortest round-trip form like json.dumps, except
+for exponent notation (orjson writes 1e16 where json.dumps writes 1e+16),
+and NaN/Infinity become null instead of raising.
+"""
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSONRenderer serializing with orjson"""
+
+    def __init__(self):
+        self._encoder = self.encoder_class()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        renderer_context = renderer_context or {}
+        indent = self.get_indent(accepted_media_type, renderer_context)
+        if indent is not None or self.ensure_ascii or not self.compact or self.encoder_class is not JSONEncoder:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(data, default=self._encoder.default, option=_OPTIONS)
+        # Same strict javascript subset as JSONRenderer
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
@@ -0,0 +1,143 @@
+"""
+Prebuilt OpenAPI schema for swagger/ and redoc/.
+
+drf_yasg regenerates the schema on every spec request, walking all views
+and serializers. Instead `manage.py build_api_schema` writes it once at
+deploy time to API_SCHEMA_DIR as JSON and YAML, each with a gzipped copy
+and a version (hash of the JSON) used as ETag. SchemaView serves those
+files as they are, with 304s for revalidations and gzip when the client
+accepts it. Only with DEBUG on is the schema still generated live, so
+changes show up without a rebuild.
+"""
+import gzip
+import hashlib
+import os
+import re
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+from drf_yasg.views import get_schema_view
+from rest_framework import permissions, status
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+API_INFO = openapi.Info(
+    title="GymGuru API",
+    default_version='v1',
+    description="Documentation for REST API GymGuru",
+)
+
+# Artifact files in API_SCHEMA_DIR by drf_yasg renderer format
+_FILENAMES = {'openapi': 'openapi.json', 'json': 'openapi.json', 'yaml': 'openapi.yaml'}
+_VERSION_FILENAME = 'openapi.version'
+_CODECS = {'openapi.json': OpenAPICodecJson, 'openapi.yaml': OpenAPICodecYaml}
+
+_accepts_gzip = re.compile(r'\bgzip\b')
+
+_artifacts = {}
+_artifacts_lock = threading.Lock()
+
+LiveSchemaView = get_schema_view(
+    API_INFO,
+    public=True,
+    permission_classes=(permissions.AllowAny,),
+)
+
+
+def generate_schema(url=None):
+    """
+    The Swagger document of the whole API, as a public anonymous request to
+    swagger/ would see it. Without `url` the document has no host, and
+    clients use the one serving it.
+    """
+    request = APIView().initialize_request(APIRequestFactory().get('/swagger/?format=openapi'))
+    # A placeholder url keeps the generator from reading the mock request's host
+    generator = LiveSchemaView.generator_class(API_INFO, url=url or 'http://localhost/')
+    schema = generator.get_schema(request=request, public=True)
+    if url is None:
+        schema.pop('host', None)
+        schema.pop('schemes', None)
+    return schema
+
+
+def build_schema(directory, url=None):
+    """Writes the JSON/YAML artifact (and gzipped copies) to `directory`, returns its version"""
+    schema = generate_schema(url)
+    encoded = {filename: codec_class(validators=[]).encode(schema) for filename, codec_class in _CODECS.items()}
+    version = hashlib.sha256(encoded['openapi.json']).hexdigest()[:16]
+
+    os.makedirs(directory, exist_ok=True)
+    files = {}
+    for filename, content in encoded.items():
+        files[filename] = content
+        files[f'{filename}.gz'] = gzip.compress(content, mtime=0)
+    # Servers reload the artifact when the version file changes, so it goes last
+    files[_VERSION_FILENAME] = version.encode()
+    # Written under temporary names then renamed, so a running server never reads half a file
+    for filename, content in files.items():
+        path = os.path.join(directory, filename)
+        with open(f'{path}.tmp', 'wb') as f:
+            f.write(content)
+        os.replace(f'{path}.tmp', path)
+    return version
+
+
+def _load_artifact(filename):
+    """(version, content, gzipped content) of an artifact file, re-read only when rebuilt"""
+    directory = settings.API_SCHEMA_DIR
+    version_path = os.path.join(directory, _VERSION_FILENAME)
+    try:
+        mtime = os.stat(version_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    artifact = _artifacts.get(filename)
+    if artifact is not None and artifact[0] == (version_path, mtime):
+        return artifact[1]
+    with _artifacts_lock:
+        with open(version_path, 'rb') as f:
+            version = f.read().decode().strip()
+        with open(os.path.join(directory, filename), 'rb') as f:
+            content = f.read()
+        with open(os.path.join(directory, f'{filename}.gz'), 'rb') as f:
+            compressed = f.read()
+        loaded = (version, content, compressed)
+        _artifacts[filename] = ((version_path, mtime), loaded)
+    return loaded
+
+
+class SchemaView(LiveSchemaView):
+    """drf_yasg's schema view, answering spec requests from the prebuilt artifact"""
+
+    def get(self, request, version='', format=None):
+        # The UI pages are rendered without walking the views, only the spec is prebuilt
+        if settings.DEBUG or request.accepted_renderer.format not in _FILENAMES:
+            return super().get(request, version, format)
+
+        filename = _FILENAMES[request.accepted_renderer.format]
+        artifact = _load_artifact(filename)
+        if artifact is None:
+            return JsonResponse(
+                {'error': 'API schema has not been built, run manage.py build_api_schema'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        schema_version, content, compressed = artifact
+
+        # Weak: the plain and the gzipped body are the same document
+        etag = f'W/"{schema_version}-{filename}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            if _accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+                response = HttpResponse(compressed)
+                response['Content-Encoding'] = 'gzip'
+            else:
+                response = HttpResponse(content)
+            response['Content-Type'] = f'{request.accepted_media_type}; charset=utf-8'
+        response['ETag'] = etag
+        response['Cache-Control'] = f'public, max-age={settings.API_SCHEMA_MAX_AGE}'
+        patch_vary_headers(response, ['Accept-Encoding'])
+        return response
@@ -1,10 +1,12 @@
+import os
 import yaml
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-SECRETS_PATH = BASE_DIR / 'secrets.yml'
+# GYMGURU_SECRETS points at another secrets file, e.g. for benchmarks (see BENCHMARK.md)
+SECRETS_PATH = Path(os.environ.get('GYMGURU_SECRETS', BASE_DIR / 'secrets.yml'))
 
 # Load secrets from secrets.yml
 with open(SECRETS_PATH, 'r') as f:
@@ -16,14 +18,14 @@ DEBUG = secrets['django']['debug']
 
 ALLOWED_HOSTS = [
     '51.250.32.66',
-]
+] + secrets['django'].get('allowed_hosts', [])
 
 # AWS S3 Configuration
 AWS_ACCESS_KEY_ID = secrets['aws']['access_key_id']
 AWS_SECRET_ACCESS_KEY = secrets['aws']['secret_access_key']
 AWS_REGION = secrets['aws']['region']
-AWS_STORAGE_BUCKET_NAME = 'testguru-v2'
-AWS_S3_ENDPOINT_URL = 'https://storage.yandexcloud.net'  # Yandex Cloud S3 endpoint
+AWS_STORAGE_BUCKET_NAME = secrets['aws'].get('bucket', 'testguru-v2')
+AWS_S3_ENDPOINT_URL = secrets['aws'].get('endpoint_url', 'https://storage.yandexcloud.net')  # Yandex Cloud S3 endpoint
 AWS_S3_CUSTOM_DOMAIN = f'{AWS_STORAGE_BUCKET_NAME}.storage.yandexcloud.net'
 AWS_S3_OBJECT_PARAMETERS = {
     'CacheControl': 'max-age=86400',
@@ -32,6 +34,93 @@ AWS_DEFAULT_ACL = 'public-read'
 AWS_QUERYSTRING_AUTH = False
 AWS_S3_FILE_OVERWRITE = False
 
+# Shared S3 client (timelines.storage) connection pool
+AWS_S3_MAX_POOL_CONNECTIONS = 50
+AWS_S3_CONNECT_TIMEOUT = 5
+AWS_S3_READ_TIMEOUT = 60
+AWS_S3_TCP_KEEPALIVE = True
+AWS_S3_RETRY_MODE = 'adaptive'
+AWS_S3_MAX_ATTEMPTS = 5
+
+# Presigned GET urls for KeyPhotos (timelines.storage), cached shorter than they live
+KEYPHOTO_PRESIGNED_URL_EXPIRES = 3600
+KEYPHOTO_PRESIGNED_URL_CACHE_MARGIN = 300
+
+# Proxied KeyPhoto downloads
+KEYPHOTO_METADATA_CACHE_TIMEOUT = 24 * 3600  # cached HEAD results used for ETag/304
+KEYPHOTO_DOWNLOAD_CHUNK_SIZE = 256 * 1024
+KEYPHOTO_DOWNLOAD_MAX_AGE = 24 * 3600  # browser cache lifetime, objects never change
+
+# Local disk LRU cache of downloaded KeyPhotos (timelines.disk_cache), can be shared
+# by the worker processes of a host, e.g. BASE_DIR / 'keyphoto_cache'; None disables it
+KEYPHOTO_DISK_CACHE_DIR = None
+KEYPHOTO_DISK_CACHE_MAX_BYTES = 2 * 1024 ** 3
+KEYPHOTO_DISK_CACHE_MAX_OBJECT_SIZE = 32 * 1024 * 1024  # larger objects are streamed from S3
+
+# List endpoints (my-keyphotos/, my-timelines/) serialize .values() rows instead of
+# model instances (timelines.fast_serializers), same output
+FAST_LIST_SERIALIZATION = True
+
+# Native async versions of the upload, download and list views (timelines.async_views),
+# for ASGI servers (uvicorn gymguru.asgi:application) where they replace the DRF views
+ASYNC_S3_VIEWS = secrets['django'].get('async_s3_views', False)
+AWS_S3_ASYNC_MAX_CONNECTIONS = 200  # per event loop; transfers in flight don't hold a thread
+
+# KeyPhoto derivatives (timelines.tasks), stored next to the original
+KEYPHOTO_DERIVATIVE_SIZES = [128, 512, 1600]  # longest side in pixels
+KEYPHOTO_DERIVATIVE_FORMAT = 'WEBP'  # or 'JPEG'
+KEYPHOTO_DERIVATIVE_QUALITY = 80
+
+# Async KeyPhoto uploads (keyphoto/new/?async=1): files wait here until a Celery
+# worker pushes them to S3, so workers must share this directory with the web process
+KEYPHOTO_UPLOAD_SPOOL_DIR = BASE_DIR / 'upload_spool'
+KEYPHOTO_UPLOAD_MAX_RETRIES = 8
+
+# Normalisation of uploaded KeyPhotos before they are stored (timelines.ingest):
+# EXIF orientation applied, metadata stripped, downscaled and re-encoded
+KEYPHOTO_INGEST_ENABLED = True
+KEYPHOTO_INGEST_MAX_DIMENSION = 2560  # longest side in pixels, None keeps the original size
+KEYPHOTO_INGEST_FORMAT = 'JPEG'  # or 'WEBP'
+KEYPHOTO_INGEST_QUALITY = 85
+
+# Bulk KeyPhoto uploads (keyphoto/bulk/)
+KEYPHOTO_BULK_UPLOAD_MAX_FILES = 50
+KEYPHOTO_BULK_UPLOAD_CONCURRENCY = 8  # parallel S3 uploads per request
+
+# Direct-to-S3 KeyPhoto uploads (presigned PUT / multipart)
+KEYPHOTO_UPLOAD_URL_EXPIRES = 900  # seconds a presigned upload URL stays valid
+KEYPHOTO_UPLOAD_TOKEN_MAX_AGE = 24 * 3600  # seconds to finish an initiated upload
+KEYPHOTO_MAX_UPLOAD_SIZE = 100 * 1024 * 1024
+KEYPHOTO_MULTIPART_THRESHOLD = 16 * 1024 * 1024  # files above this use multipart
+KEYPHOTO_MULTIPART_PART_SIZE = 8 * 1024 * 1024  # S3 minimum is 5 MB
+
+# S3 lifecycle commands (purge_deleted_keyphotos, reconcile_s3_objects)
+KEYPHOTO_DELETED_RETENTION_DAYS = 30  # soft-deleted KeyPhotos are purged with their objects after this
+# Objects younger than this aren't orphans yet: direct uploads get their row on completion
+KEYPHOTO_ORPHAN_MIN_AGE = 2 * KEYPHOTO_UPLOAD_TOKEN_MAX_AGE
+
+# Bulk add/remove/reorder of a Timeline's KeyPhotos (timeline/<pk>/keyphotos/)
+TIMELINE_BULK_MAX_KEYPHOTOS = 1000
+
+# Timelapse rendering (timelines.timelapse)
+TIMELAPSE_FORMAT = 'webp'  # 'webp' (Pillow) or 'mp4' (needs the ffmpeg binary)
+TIMELAPSE_FFMPEG_BINARY = 'ffmpeg'
+TIMELAPSE_FRAME_SIZE = (720, 960)  # width, height; photos are letterboxed to it
+TIMELAPSE_FPS = 12
+TIMELAPSE_HOLD_FRAMES = 6  # frames each photo is shown for
+TIMELAPSE_CROSSFADE_FRAMES = 6  # frames blending one photo into the next
+TIMELAPSE_QUALITY = 75
+TIMELAPSE_MAX_PHOTOS = 500
+# Photos are decoded in a pool of this many workers. Celery prefork children
+# can't start processes: run the timelapse queue with --pool=solo/threads or
+# set the executor to 'thread' (Pillow releases the GIL while decoding).
+TIMELAPSE_RENDER_WORKERS = 4
+TIMELAPSE_RENDER_EXECUTOR = 'process'  # or 'thread'
+
+# Delta sync feed (sync/?since=<token>)
+SYNC_PAGE_SIZE = 500  # rows per collection per response
+SYNC_SETTLE_SECONDS = 5  # longest expected write transaction, changes this recent are re-sent
+
 
 # Application definition
 
@@ -51,15 +140,28 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'gymguru.instrumentation.InstrumentationMiddleware',  # first, so it times everything below
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'gymguru.db_router.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# OpenAPI schema for swagger/ and redoc/ (gymguru.schema), built at deploy time with
+# `manage.py build_api_schema`; generated on every request only with DEBUG on
+API_SCHEMA_DIR = BASE_DIR / 'schema'
+API_SCHEMA_MAX_AGE = 300  # seconds clients may use it before revalidating with the ETag
+
+# Request instrumentation (gymguru.instrumentation)
+# Per-request parse/db/s3/sign timings in responses; they show clients our internals, so off in production
+SERVER_TIMING_HEADER = secrets['django'].get('server_timing', DEBUG)
+# Scrapers send it as `Authorization: Bearer <token>`; without one /metrics is not served
+METRICS_TOKEN = (secrets.get('metrics') or {}).get('token')
+
 ROOT_URLCONF = 'gymguru.urls'
 
 TEMPLATES = [
@@ -87,14 +189,68 @@ WSGI_APPLICATION = 'gymguru.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'testguru',
+        'NAME': secrets['db'].get('db_name', 'testguru'),
         'USER': secrets['db']['db_user'],
         'PASSWORD': secrets['db']['db_password'],
         'HOST': 'localhost',
         'PORT': '5432',
+        # Persistent connections, checked before reuse. Under ASGI requests don't keep
+        # their threads: set db.conn_max_age to 0 there and pool in front of Postgres
+        'CONN_MAX_AGE': secrets['db'].get('conn_max_age', 60),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas (gymguru.db_router): db.replicas in secrets.yml, a list of
+# {host, port}, same database and credentials as the primary. GET requests to
+# views with `replica_reads = True` read from them
+DATABASE_REPLICAS = []
+for number, replica in enumerate(secrets['db'].get('replicas') or [], 1):
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': replica['host'],
+        'PORT': str(replica.get('port', 5432)),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['gymguru.db_router.ReplicaRouter']
+DATABASE_REPLICA_MAX_LAG = 5  # seconds behind the primary before a replica is left out
+DATABASE_REPLICA_CHECK_INTERVAL = 5  # seconds between lag checks, per process
+# A client's reads stay on the primary this long after they write; with more than one
+# process this needs the shared (Redis) cache
+DATABASE_STICKY_SECONDS = 10
+
+# Cache
+# Redis when configured in secrets.yml, otherwise per-process local memory
+
+REDIS_URL = (secrets.get('redis') or {}).get('url')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Celery
+# The broker comes from secrets.yml or Redis, required outside DEBUG (timelines/apps.py)
+
+CELERY_BROKER_URL = (secrets.get('celery') or {}).get('broker_url') or REDIS_URL
+# Runs tasks inline in the calling process: only for tests (gymguru/test_settings.py) and local development
+CELERY_TASK_ALWAYS_EAGER = (secrets.get('celery') or {}).get('task_always_eager', False)
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_ACCEPT_CONTENT = ['json']
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -159,18 +315,28 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'auf.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # Same bytes as DRF's JSONRenderer, faster (gymguru.renderers)
+    'DEFAULT_RENDERER_CLASSES': [
+        'gymguru.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
 }
 
 # JWT settings
 from datetime import timedelta
+# Authenticated users are cached between requests (auf.authentication)
+JWT_USER_CACHE_TIMEOUT = 300
+# Read-only views with TokenUserReadsMixin authenticate GETs from the token alone,
+# without noticing deactivation or password changes until the token expires
+JWT_TOKEN_USER_READS = False
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
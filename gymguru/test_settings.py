@@ -0,0 +1,9 @@
+"""
+Settings for the test suite:
+    python manage.py test --settings=gymguru.test_settings
+"""
+from .settings import *  # noqa: F401,F403
+
+# Tasks run inline, so tests see their results without a worker
+CELERY_BROKER_URL = 'memory://'
+CELERY_TASK_ALWAYS_EAGER = True
@@ -19,33 +19,25 @@ Including another URLconf
 
 from django.contrib import admin
 from django.urls import path, include
-from rest_framework import permissions
 
 from django.conf import settings
 from django.conf.urls.static import static
 
-# Импортируем drf-yasg
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
+from gymguru.instrumentation import metrics_view
 
-schema_view = get_schema_view(
-   openapi.Info(
-      title="GymGuru API",
-      default_version='v1',
-      description="Documentation for REST API GymGuru",
-   ),
-   public=True,
-   permission_classes=(permissions.AllowAny,),
-)
+# drf-yasg view serving the schema prebuilt by `manage.py build_api_schema`
+from gymguru.schema import SchemaView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/auth/', include('auf.urls')),
     path('api/', include('timelines.urls')),
+    # Prometheus scrape endpoint
+    path('metrics', metrics_view, name='metrics'),
     # Swagger UI:
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
+    path('swagger/', SchemaView.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     # Redoc (alternative documentation):
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    path('redoc/', SchemaView.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
 ]
 
 
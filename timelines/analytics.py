@@ -0,0 +1,66 @@
+"""
+Weight time-series built from WeightRollup rows.
+
+All derived values are computed with numpy over whole columns rather than
+per point, so a chart spanning years costs one indexed range query plus a
+few vectorized operations.
+"""
+import numpy as np
+
+from timelines.models import WeightRollup
+
+
+def weight_series(user, period, start=None, end=None, window=7):
+    """
+    Aggregates for `user` per `period` between `start` and `end` (inclusive):
+    min/max/avg per point, a trailing moving average over `window` points and
+    a linear trend of the average weight, weighted by photo count.
+    """
+    rollups = WeightRollup.objects.filter(user=user, period=period)
+    if start:
+        rollups = rollups.filter(period_start__gte=start)
+    if end:
+        rollups = rollups.filter(period_start__lte=end)
+    rows = list(
+        rollups.order_by('period_start').values_list(
+            'period_start', 'count', 'sum_centigrams', 'min_centigrams', 'max_centigrams'
+        )
+    )
+    if not rows:
+        return {'points': [], 'trend': None}
+
+    period_starts, counts, sums, minimums, maximums = zip(*rows)
+    counts = np.array(counts, dtype=np.float64)
+    averages = np.array(sums, dtype=np.float64) / counts
+
+    # Trailing moving average from a cumulative sum: O(n) for any window
+    cumulative = np.concatenate(([0.0], np.cumsum(averages)))
+    index = np.arange(len(averages))
+    window_start = np.maximum(index + 1 - window, 0)
+    moving_averages = (cumulative[index + 1] - cumulative[window_start]) / (index + 1 - window_start)
+
+    trend = None
+    if len(averages) >= 2:
+        days = np.array([day.toordinal() for day in period_starts], dtype=np.float64)
+        days -= days[0]
+        slope, intercept = np.polyfit(days, averages, 1, w=np.sqrt(counts))
+        trend = {
+            'slope_centigrams_per_day': round(float(slope), 3),
+            'intercept_centigrams': round(float(intercept), 2),
+        }
+
+    points = [
+        {
+            'period_start': day,
+            'count': int(count),
+            'min_centigrams': minimum,
+            'max_centigrams': maximum,
+            'avg_centigrams': avg,
+            'moving_avg_centigrams': moving_avg,
+        }
+        for day, count, minimum, maximum, avg, moving_avg in zip(
+            period_starts, counts.tolist(), minimums, maximums,
+            np.round(averages, 2).tolist(), np.round(moving_averages, 2).tolist(),
+        )
+    ]
+    return {'points': points, 'trend': trend}
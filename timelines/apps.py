@@ -1,6 +1,30 @@
+import logging
+
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
 
 
 class TimelinesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'timelines'
+
+    def ready(self):
+        # Keeps WeightRollup and collection versions in sync with model changes
+        from timelines import signals  # noqa: F401
+        self.check_celery_broker()
+
+    @staticmethod
+    def check_celery_broker():
+        """Uploads are processed by Celery tasks: without a broker they would never run"""
+        if settings.CELERY_BROKER_URL or settings.CELERY_TASK_ALWAYS_EAGER:
+            return
+        message = (
+            'No Celery broker configured: set celery.broker_url or redis.url in secrets.yml '
+            '(or celery.task_always_eager to run tasks inline)'
+        )
+        if not settings.DEBUG:
+            raise ImproperlyConfigured(message)
+        logger.warning('%s; queued tasks will fail', message)
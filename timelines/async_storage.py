@@ -0,0 +1,146 @@
+"""
+Async S3 transfers for the ASGI views (timelines.async_views).
+
+aiobotocore pins botocore releases that don't match ours, so every request
+is signed by the shared client from timelines.storage (signing is local CPU
+work, no round trip) and sent over an httpx.AsyncClient. A transfer waiting
+on S3 then costs a coroutine instead of a thread.
+
+httpx clients are bound to the event loop they were first used on, so one
+client (and connection pool) is kept per loop.
+"""
+import asyncio
+import os
+import re
+import weakref
+from email.utils import parsedate_to_datetime
+
+import httpx
+from asgiref.sync import sync_to_async
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from gymguru.instrumentation import timed
+from timelines.storage import get_s3_client, object_metadata_cache_key
+
+# Signed requests are sent right away, the signature only has to outlive retries
+SIGNATURE_EXPIRES = 300
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_http_client():
+    """httpx client shared by everything running on the current event loop"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=settings.AWS_S3_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.AWS_S3_ASYNC_MAX_CONNECTIONS,
+            ),
+            # Retries failed connection attempts only, S3 error responses are returned as they are
+            retries=settings.AWS_S3_MAX_ATTEMPTS - 1,
+        )
+        client = _clients[loop] = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(settings.AWS_S3_READ_TIMEOUT, connect=settings.AWS_S3_CONNECT_TIMEOUT),
+        )
+    return client
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(sender, setting, **kwargs):
+    if setting.startswith('AWS_'):
+        _clients.clear()
+
+
+def _sign(client_method, s3_path, **params):
+    return get_s3_client().generate_presigned_url(
+        client_method,
+        Params={'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Key': s3_path, **params},
+        ExpiresIn=SIGNATURE_EXPIRES,
+    )
+
+
+async def _raise_for_status(response, operation_name):
+    """Raises ClientError like botocore does, so callers handle both clients alike"""
+    if response.status_code < 300:
+        return
+    await response.aread()
+    match = re.search(r'<Code>([^<]+)</Code>', response.text)
+    raise ClientError({
+        'Error': {'Code': match.group(1) if match else str(response.status_code), 'Message': response.reason_phrase},
+        'ResponseMetadata': {'HTTPStatusCode': response.status_code},
+    }, operation_name)
+
+
+async def upload_fileobj(fileobj, s3_path, content_type):
+    """Uploads a seekable file object with a single PUT"""
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(0)
+
+    # Uploads larger than FILE_UPLOAD_MAX_MEMORY_SIZE are spooled to disk, read them in a thread
+    read = sync_to_async(fileobj.read, thread_sensitive=False)
+
+    async def body():
+        while True:
+            chunk = await read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+    url = _sign('put_object', s3_path, ContentType=content_type)
+    with timed('s3'):
+        response = await get_async_http_client().put(
+            url,
+            content=body(),
+            headers={'Content-Type': content_type, 'Content-Length': str(size)},
+        )
+    await _raise_for_status(response, 'PutObject')
+
+
+async def get_object_metadata(s3_path):
+    """Async timelines.storage.get_object_metadata, sharing its cache"""
+    key = object_metadata_cache_key(s3_path)
+    metadata = await cache.aget(key)
+    if metadata is None:
+        with timed('s3'):
+            response = await get_async_http_client().head(_sign('head_object', s3_path))
+        await _raise_for_status(response, 'HeadObject')
+        metadata = {
+            'etag': response.headers['ETag'],
+            'last_modified': int(parsedate_to_datetime(response.headers['Last-Modified']).timestamp()),
+            'content_length': int(response.headers['Content-Length']),
+            'content_type': response.headers.get('Content-Type'),
+        }
+        await cache.aset(key, metadata, timeout=settings.KEYPHOTO_METADATA_CACHE_TIMEOUT)
+    return metadata
+
+
+async def open_object(s3_path, byte_range=None):
+    """
+    Starts a GET of an object (or an inclusive byte range of it) and returns
+    the response with the body not yet read; pass it to iter_body().
+    """
+    client = get_async_http_client()
+    headers = {'Range': f'bytes={byte_range[0]}-{byte_range[1]}'} if byte_range else {}
+    request = client.build_request('GET', _sign('get_object', s3_path), headers=headers)
+    with timed('s3'):
+        response = await client.send(request, stream=True)
+    await _raise_for_status(response, 'GetObject')
+    return response
+
+
+async def iter_body(response, chunk_size):
+    """Yields the body of an open_object() response and closes it"""
+    try:
+        async for chunk in response.aiter_raw(chunk_size):
+            yield chunk
+    finally:
+        await response.aclose()
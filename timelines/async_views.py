@@ -0,0 +1,277 @@
+"""
+Native async versions of the S3-bound views, routed instead of the DRF ones
+when ASYNC_S3_VIEWS is on (see timelines/urls.py). Requests and responses
+are the same as the views they replace.
+
+Under ASGI a sync view holds a thread for as long as its S3 transfer takes.
+These await S3 through timelines.async_storage and look rows up with the
+async ORM (users through auf.authentication's cache), so a slow transfer or
+a slow client only costs a coroutine.
+CPU-bound steps (multipart parsing, hashing, normalisation) run in the
+default thread pool so they don't stall the event loop.
+"""
+import os
+import uuid
+
+from asgiref.sync import sync_to_async
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import method_decorator
+from django.utils.http import quote_etag
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.request import Request
+from rest_framework.views import exception_handler
+
+from auf.authentication import CachedJWTAuthentication, TokenUserAuthentication
+from gymguru.instrumentation import timed
+from gymguru.renderers import ORJSONRenderer
+from timelines import async_storage, views
+from timelines.ingest import normalize_image, with_extension
+from timelines.models import KeyPhoto
+from timelines.storage import get_presigned_url, sha256_file
+
+
+def _json_response(data, status_code=status.HTTP_200_OK):
+    """Rendered like DRF's Response, so both kinds of view answer byte for byte alike"""
+    return HttpResponse(ORJSONRenderer().render(data), status=status_code, content_type='application/json')
+
+
+def _session_user(request):
+    """DRF's SessionAuthentication (CSRF check included): the logged-in user, or None"""
+    result = SessionAuthentication().authenticate(Request(request))
+    return result[0] if result is not None else None
+
+
+async def authenticate(request, token_user=False):
+    """
+    The user of the request's JWT access token, or else of its session (like
+    DEFAULT_AUTHENTICATION_CLASSES), None when it has neither.
+    Async CachedJWTAuthentication.authenticate: the token is checked in the
+    event loop, the user comes from the cache or the async ORM. With
+    `token_user` it is a TokenUser built from the token alone.
+    """
+    authentication = TokenUserAuthentication() if token_user else CachedJWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header is not None else None
+    if raw_token is None:
+        # The session and its user are loaded with the sync ORM
+        return await sync_to_async(_session_user)(request)
+    validated_token = authentication.get_validated_token(raw_token)
+    if token_user:
+        return authentication.get_user(validated_token)
+    return await authentication.aget_user(validated_token)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAPIView(View):
+    """
+    Async counterpart of an APIView with JWT (or session) authentication and
+    the IsAuthenticated permission; API errors are answered like DRF does.
+    """
+    # Like TokenUserReadsMixin: GETs only need request.user.id
+    token_user_reads = False
+
+    async def dispatch(self, request, *args, **kwargs):
+        token_user = (
+            self.token_user_reads and settings.JWT_TOKEN_USER_READS and request.method in SAFE_METHODS
+        )
+        try:
+            request.user = await authenticate(request, token_user)
+            if request.user is None:
+                raise exceptions.NotAuthenticated()
+            return await super().dispatch(request, *args, **kwargs)
+        except (exceptions.APIException, Http404) as exc:
+            return self.handle_exception(exc)
+
+    def handle_exception(self, exc):
+        response = exception_handler(exc, {'view': self})
+        rendered = _json_response(response.data, response.status_code)
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            rendered.status_code = status.HTTP_401_UNAUTHORIZED
+            rendered['WWW-Authenticate'] = CachedJWTAuthentication().authenticate_header(self.request)
+        return rendered
+
+
+def _parse_form(request):
+    with timed('parse'):
+        return request.POST, request.FILES
+
+
+class KeyPhotoUploadView(AsyncAPIView):
+    """Async views.KeyPhotoUploadView"""
+
+    async def post(self, request):
+        try:
+            data, files = await sync_to_async(_parse_form, thread_sensitive=False)(request)
+            if 'photo' not in files:
+                return _json_response({'error': 'No photo in request'}, status.HTTP_400_BAD_REQUEST)
+            photo = files['photo']
+            file_size = photo.size
+
+            if not photo.content_type.startswith('image/'):
+                return _json_response({'error': 'File must be an image'}, status.HTTP_400_BAD_REQUEST)
+
+            photo_taken_at = data.get('photo_taken_at')
+            weight_centigrams = data.get('weight_centigrams')
+            if not photo_taken_at:
+                return _json_response({'error': 'photo_taken_at is required'}, status.HTTP_400_BAD_REQUEST)
+
+            # Skip the upload if the user already has this exact photo (e.g. a client retry)
+            content_hash = await sync_to_async(sha256_file, thread_sensitive=False)(photo)
+            duplicate = await sync_to_async(KeyPhoto.find_duplicate)(request.user, content_hash)
+            if duplicate is not None:
+                payload = await sync_to_async(views._duplicate_payload)(duplicate)
+                return _json_response(payload)
+
+            unique_filename = f"{uuid.uuid4()}{os.path.splitext(photo.name)[1]}"
+            # request.user.username is deferred (auf.authentication), loading it queries
+            s3_path = await sync_to_async(views._keyphoto_s3_path)(request.user, unique_filename)
+
+            # Spooled to disk for a Celery worker, nothing to await here
+            if views._wants_async_upload(request):
+                key_photo_data = views._key_photo_upload_data(
+                    unique_filename, s3_path, photo_taken_at, file_size, content_hash, weight_centigrams
+                )
+                payload, status_code = await sync_to_async(views._spool_keyphoto_upload)(
+                    request, photo, key_photo_data
+                )
+                return _json_response(payload, status_code)
+
+            upload_file, content_type = photo, photo.content_type
+            original_file_size = file_size
+            normalized = await sync_to_async(normalize_image, thread_sensitive=False)(photo)
+            if normalized is not None:
+                upload_file, content_type, file_size = normalized.file, normalized.content_type, normalized.size
+                unique_filename = with_extension(unique_filename, normalized.extension)
+                s3_path = with_extension(s3_path, normalized.extension)
+
+            try:
+                with upload_file:
+                    await async_storage.upload_fileobj(upload_file, s3_path, content_type)
+
+                key_photo_data = views._key_photo_upload_data(
+                    unique_filename, s3_path, photo_taken_at, file_size, content_hash, weight_centigrams
+                )
+                payload, status_code = await sync_to_async(self.save)(request, key_photo_data, original_file_size)
+                return _json_response(payload, status_code)
+            except ClientError as e:
+                return _json_response(
+                    {'error': f'Error uploading to S3 or saving to database: {str(e)}'},
+                    status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+        except Exception as e:
+            return _json_response({'error': f'Unexpected error: {str(e)}'}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @staticmethod
+    def save(request, key_photo_data, original_file_size):
+        presigned_url = get_presigned_url(key_photo_data['s3_path'])
+        return views._save_uploaded_keyphoto(request, key_photo_data, original_file_size, presigned_url)
+
+
+async def _aiter_file_range(cached_file, start, end, chunk_size):
+    # Local file reads are quick, it's the wait on the client we don't want to hold a thread for
+    for chunk in views._iter_file_range(cached_file, start, end, chunk_size):
+        yield chunk
+
+
+class KeyPhotoDownloadView(AsyncAPIView):
+    """
+    Async views.KeyPhotoDownloadView, streaming the object from S3 as it
+    arrives. It shares the local disk cache: a miss of a full GET is
+    downloaded into it in a worker thread (S3 to local disk, not held up by
+    the client), and every response from the cache is streamed from the file.
+    """
+
+    async def get(self, request, pk):
+        try:
+            try:
+                obj = await KeyPhoto.objects.aget(pk=pk, user=request.user)
+            except KeyPhoto.DoesNotExist:
+                raise Http404()
+            if obj.is_deleted:
+                return _json_response({'error': 'Photo deleted'}, status.HTTP_410_GONE)
+
+            s3_path = obj.get_s3_path(views._get_requested_size(request))
+            try:
+                metadata = await async_storage.get_object_metadata(s3_path)
+            except ClientError as e:
+                if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                    raise Http404()
+                raise
+
+            headers = views._download_headers(metadata)
+            conditional = views._download_conditional_response(request, metadata, headers)
+            if conditional is not None:
+                return conditional
+
+            try:
+                byte_range = views._download_byte_range(request, metadata)
+            except ValueError:
+                return views._range_not_satisfiable(metadata)
+
+            cached_file = await sync_to_async(views.KeyPhotoDownloadView.open_cached, thread_sensitive=False)(
+                s3_path, metadata, fill=not byte_range
+            )
+            if cached_file is not None:
+                start, end = byte_range or (0, metadata['content_length'] - 1)
+                return views._download_response(
+                    _aiter_file_range(cached_file, start, end, settings.KEYPHOTO_DOWNLOAD_CHUNK_SIZE),
+                    s3_path, metadata, headers, end - start + 1, byte_range
+                )
+
+            s3_response = await async_storage.open_object(s3_path, byte_range)
+            return views._download_response(
+                async_storage.iter_body(s3_response, settings.KEYPHOTO_DOWNLOAD_CHUNK_SIZE),
+                s3_path, metadata, headers, s3_response.headers['Content-Length'], byte_range
+            )
+        except (Http404, exceptions.ValidationError):
+            raise
+        except Exception as e:
+            return _json_response({'error': str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class AsyncListView(AsyncAPIView):
+    """
+    Async wrapper of one of the paginated DRF list views: the ETag check is
+    answered without a thread, the page itself is built by the DRF view
+    (cursor pagination, sparse fields) in a single sync_to_async call.
+    """
+    list_view_class = None
+    etag_func = None
+    token_user_reads = True
+    replica_reads = True
+
+    async def get(self, request, *args, **kwargs):
+        etag = quote_etag(await sync_to_async(type(self).etag_func)(request))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            data = await sync_to_async(self.list_page)(request, *args, **kwargs)
+            response = _json_response(data)
+        response['ETag'] = etag
+        return response
+
+    def list_page(self, request, *args, **kwargs):
+        view = self.list_view_class()
+        view.setup(request, *args, **kwargs)
+        view.request = Request(request, parsers=view.get_parsers())
+        view.request.user = request.user
+        view.format_kwarg = None
+        return view.list(view.request, *args, **kwargs).data
+
+
+class UserKeyPhotosView(AsyncListView):
+    """Async views.UserKeyPhotosView"""
+    list_view_class = views.UserKeyPhotosView
+    etag_func = views._keyphotos_etag
+
+
+class UserTimelinesView(AsyncListView):
+    """Async views.UserTimelinesView"""
+    list_view_class = views.UserTimelinesView
+    etag_func = views._timelines_etag
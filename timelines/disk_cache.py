@@ -0,0 +1,242 @@
+"""
+Local disk cache of KeyPhoto objects for the download proxy.
+
+KeyPhoto objects are written once under a unique key, so a local copy never
+goes stale. DownloadCache keeps up to KEYPHOTO_DISK_CACHE_MAX_BYTES of them
+in KEYPHOTO_DISK_CACHE_DIR and evicts the least recently used files; hits
+are answered from the local file (FileResponse, i.e. sendfile under
+gunicorn) instead of a GET to S3.
+
+Files are downloaded under a temporary name and renamed into place, so
+readers, including other worker processes sharing the directory, never see
+a partial object. Concurrent misses for the same object in a process are
+coalesced: one thread downloads it while the others wait for its file.
+Recency is the file's mtime, bumped on every hit, so the LRU order is shared
+by all processes using the directory. Each process keeps a running estimate
+of the directory size and rescans it to evict once the budget is exceeded.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from prometheus_client import Counter
+
+from .storage import get_s3_client
+
+EVENTS = ('hits', 'misses', 'coalesced', 'evictions', 'evicted_bytes', 'errors')
+
+CACHE_EVENTS = Counter(
+    'gymguru_download_cache_events', 'KeyPhoto disk cache hits / misses / coalesced waits / evictions',
+    ['event'],
+)
+
+# Eviction frees space down to this share of the budget, so it doesn't run on every miss
+_EVICT_TO = 0.9
+# Temporary files older than this were left behind by a crashed download
+_STALE_TMP_SECONDS = 3600
+_TMP_PREFIX = '.tmp-'
+
+
+class DownloadCache:
+    """Size-bounded LRU cache of S3 objects on local disk, keyed by s3_path"""
+
+    def __init__(self, directory, max_bytes, max_object_size):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.max_object_size = max_object_size
+        self.counters = dict.fromkeys(EVENTS, 0)
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._inflight = {}
+        # Bytes in the directory at the last scan plus what this process wrote since
+        self._size = None
+
+    def _count(self, event, amount=1):
+        with self._lock:
+            self.counters[event] += amount
+        CACHE_EVENTS.labels(event).inc(amount)
+
+    def path(self, s3_path):
+        digest = hashlib.sha256(f'{settings.AWS_STORAGE_BUCKET_NAME}/{s3_path}'.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def open_cached(self, s3_path):
+        """The cached object as an open binary file, or None"""
+        path = self.path(s3_path)
+        try:
+            cached_file = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            # Marks it recently used for every process sharing the directory
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # evicted meanwhile, the open file stays readable
+        return cached_file
+
+    def open(self, s3_path, size, fill=True):
+        """
+        The object as an open binary file, downloading it on a miss unless
+        `fill` is off. None when it is larger than the cache takes, not cached
+        and not to be filled, or was evicted before it could be opened, in
+        which case it should be streamed from S3.
+        """
+        if size > self.max_object_size:
+            return None
+        cached_file = self.open_cached(s3_path)
+        if cached_file is not None:
+            self._count('hits')
+            return cached_file
+        if not fill:
+            return None
+
+        path = self.path(s3_path)
+        with self._lock:
+            future = self._inflight.get(path)
+            leader = future is None
+            if leader:
+                future = self._inflight[path] = Future()
+
+        if not leader:
+            self._count('coalesced')
+            future.result()
+            return self.open_cached(s3_path)
+
+        try:
+            # Another thread may have finished the download after the first check
+            cached_file = self.open_cached(s3_path)
+            if cached_file is None:
+                self._count('misses')
+                self._download(s3_path, path)
+                cached_file = self.open_cached(s3_path)
+            future.set_result(path)
+        except BaseException as e:
+            self._count('errors')
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[path]
+        return cached_file
+
+    def _download(self, s3_path, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=_TMP_PREFIX)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                response = get_s3_client().get_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=s3_path)
+                body = response['Body']
+                try:
+                    for chunk in body.iter_chunks(settings.KEYPHOTO_DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                finally:
+                    body.close()
+                size = f.tell()
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+            over_budget = self._size is None or self._size > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def _scan(self):
+        """(mtime, size, path) of every cached file; removes stale temporary files"""
+        entries = []
+        try:
+            shards = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return entries
+        stale_before = time.time() - _STALE_TMP_SECONDS
+        for shard in shards:
+            if shard.name.startswith(_TMP_PREFIX):
+                try:
+                    if shard.stat().st_mtime < stale_before:
+                        os.unlink(shard.path)
+                except FileNotFoundError:
+                    pass
+                continue
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        """Deletes the least recently used files until the cache is back under budget"""
+        if not self._evict_lock.acquire(blocking=False):
+            return  # another thread is on it
+        try:
+            entries = self._scan()
+            total = sum(size for _, size, _ in entries)
+            if total > self.max_bytes:
+                target = self.max_bytes * _EVICT_TO
+                for _, size, path in sorted(entries):
+                    if total <= target:
+                        break
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        continue
+                    total -= size
+                    self._count('evictions')
+                    self._count('evicted_bytes', size)
+            with self._lock:
+                self._size = total
+        finally:
+            self._evict_lock.release()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['bytes'] = self._size
+        stats['max_bytes'] = self.max_bytes
+        lookups = stats['hits'] + stats['misses'] + stats['coalesced']
+        if lookups:
+            stats['hit_ratio'] = round((stats['hits'] + stats['coalesced']) / lookups, 3)
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_download_cache():
+    """The process-wide DownloadCache, or None when KEYPHOTO_DISK_CACHE_DIR is unset"""
+    global _cache
+    if settings.KEYPHOTO_DISK_CACHE_DIR is None:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DownloadCache(
+                    settings.KEYPHOTO_DISK_CACHE_DIR,
+                    settings.KEYPHOTO_DISK_CACHE_MAX_BYTES,
+                    settings.KEYPHOTO_DISK_CACHE_MAX_OBJECT_SIZE,
+                )
+    return _cache
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(sender, setting, **kwargs):
+    global _cache
+    if setting.startswith('KEYPHOTO_DISK_CACHE_'):
+        with _cache_lock:
+            _cache = None
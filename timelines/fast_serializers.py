@@ -0,0 +1,152 @@
+"""
+Read-only fast path for the list endpoints.
+
+A ModelSerializer with many=True loads a model instance per row, then
+walks bound field objects for every one of them. A ValuesSerializer works
+on .values() rows instead: the columns its serializer_class needs are
+worked out once per field subset, together with a transform of a row into
+exactly the dict the serializer would return (same keys, order, None
+handling and datetime format), so list views fetch only those columns and
+never build model instances.
+
+Field types with a known representation are copied or converted directly;
+any other field falls back to its own to_representation().
+"""
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+from .models import KeyPhoto
+from .serializers import KeyPhotoSerializer, NewTimelineSerializer
+from .storage import get_presigned_urls
+
+# Columns come out of the database already in their JSON representation
+_VERBATIM_FIELDS = (serializers.IntegerField, serializers.CharField, serializers.BooleanField)
+
+
+def _datetime(value, tz):
+    # DateTimeField.to_representation with the default ISO 8601 format
+    value = value.astimezone(tz).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def _compile_field(serializer, field):
+    """
+    (column, converter) of a field. Converters take the value and the current
+    timezone; None copies the column as is.
+    """
+    field_type = type(field)
+    if field_type is serializers.SerializerMethodField:
+        return None, field.method_name
+
+    model_field = serializer.Meta.model._meta.get_field(field.source)
+    if field_type is serializers.PrimaryKeyRelatedField and field.pk_field is None:
+        return model_field.attname, None
+    if field_type in _VERBATIM_FIELDS:
+        return model_field.attname, None
+    if field_type is serializers.JSONField and not field.binary:
+        return model_field.attname, None
+    if field_type is serializers.ChoiceField and all(isinstance(key, str) for key in field.choices):
+        return model_field.attname, None
+    if (field_type is serializers.DateTimeField and settings.USE_TZ and not hasattr(field, 'timezone')
+            and getattr(field, 'format', api_settings.DATETIME_FORMAT) == ISO_8601):
+        return model_field.attname, _datetime
+    if model_field.is_relation:
+        raise ImproperlyConfigured(f'{field.field_name} can only be serialized from a model instance')
+    return model_field.attname, lambda value, tz: field.to_representation(value)
+
+
+@lru_cache(maxsize=64)
+def _compile(values_serializer_class, fields):
+    """
+    Columns to fetch and the rows transform for a field subset (None: all
+    fields). `fields` is sorted and deduplicated, so every way of asking
+    for the same subset shares one entry.
+    """
+    serializer_class = values_serializer_class.serializer_class
+    serializer = serializer_class() if fields is None else serializer_class(fields=fields)
+
+    steps = []
+    columns = []
+    for field in serializer._readable_fields:
+        column, convert = _compile_field(serializer, field)
+        if column is None:
+            if not hasattr(values_serializer_class, convert):
+                raise ImproperlyConfigured(
+                    f'{values_serializer_class.__name__} needs a {convert}() for {field.field_name}'
+                )
+            columns.extend(values_serializer_class.method_columns.get(field.field_name, ()))
+        else:
+            columns.append(column)
+        steps.append((field.field_name, column, convert))
+
+    def transform(values_serializer, rows):
+        tz = timezone.get_current_timezone()
+        methods = {convert: getattr(values_serializer, convert) for _, column, convert in steps if column is None}
+        result = []
+        for row in rows:
+            data = {}
+            for name, column, convert in steps:
+                if column is None:
+                    data[name] = methods[convert](row)
+                    continue
+                value = row[column]
+                # Serializer.to_representation doesn't convert None either
+                data[name] = value if convert is None or value is None else convert(value, tz)
+            result.append(data)
+        return result
+
+    return tuple(dict.fromkeys(columns)), frozenset(name for name, _, _ in steps), transform
+
+
+class ValuesSerializer:
+    """
+    Read-only counterpart of `serializer_class` for .values() rows, with the
+    same `fields` and `context` arguments. SerializerMethodFields are
+    answered by the same get_<field>() method taking a row, reading the
+    columns listed for it in `method_columns`.
+    """
+    serializer_class = None
+    method_columns = {}
+
+    def __init__(self, fields=None, context=None):
+        self.context = context or {}
+        # Output follows the declared field order, whatever order `fields` comes in
+        self.columns, self.field_names, self._transform = _compile(
+            type(self), tuple(sorted(set(fields))) if fields is not None else None
+        )
+
+    def prepare(self, rows):
+        """Hook for work done once for the whole list, before any row is transformed"""
+
+    def to_representation(self, rows):
+        rows = list(rows)
+        self.prepare(rows)
+        return self._transform(self, rows)
+
+
+class KeyPhotoValuesSerializer(ValuesSerializer):
+    """KeyPhotoSerializer (with KeyPhotoListSerializer's batched url signing) for .values() rows"""
+    serializer_class = KeyPhotoSerializer
+    method_columns = {'presigned_url': ('s3_path', 'derivatives')}
+
+    def _s3_path(self, row):
+        return KeyPhoto.s3_path_for_size(row['s3_path'], row['derivatives'], self.context.get('size'))
+
+    def prepare(self, rows):
+        if 'presigned_url' in self.field_names:
+            self.presigned_urls = get_presigned_urls([self._s3_path(row) for row in rows])
+
+    def get_presigned_url(self, row):
+        return self.presigned_urls[self._s3_path(row)]
+
+
+class TimelineValuesSerializer(ValuesSerializer):
+    """NewTimelineSerializer for .values() rows"""
+    serializer_class = NewTimelineSerializer
@@ -0,0 +1,41 @@
+"""
+Frame preparation for timelapse rendering.
+
+Free of Django imports so it can run in worker processes: functions take and
+return plain bytes, tuples and strings.
+"""
+import io
+
+from PIL import Image, ImageDraw, ImageFont, ImageOps, UnidentifiedImageError
+
+BACKGROUND = (0, 0, 0)
+
+
+def prepare_frame(data, size, label):
+    """
+    Decodes one photo, letterboxes it to `size` and draws `label` along the
+    bottom. Returns raw RGB bytes, or None if the photo can't be decoded.
+    """
+    if data is None:
+        return None
+    try:
+        image = Image.open(io.BytesIO(data))
+        # Lets the JPEG decoder skip detail the frame can't show
+        image.draft('RGB', size)
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    except (UnidentifiedImageError, OSError):
+        return None
+    frame = ImageOps.pad(image, size, Image.Resampling.LANCZOS, color=BACKGROUND)
+    draw_label(frame, label)
+    return frame.tobytes()
+
+
+def draw_label(frame, label):
+    width, height = frame.size
+    font = ImageFont.load_default(size=max(height // 24, 10))
+    draw = ImageDraw.Draw(frame, 'RGBA')
+    left, top, right, bottom = draw.textbbox((0, 0), label, font=font)
+    padding = max(height // 64, 2)
+    box_top = height - (bottom - top) - 2 * padding
+    draw.rectangle((0, box_top, width, height), fill=(0, 0, 0, 160))
+    draw.text((padding, box_top + padding - top), label, font=font, fill=(255, 255, 255, 255))
@@ -0,0 +1,100 @@
+"""
+Normalisation of photos uploaded through the API before they reach S3.
+
+Phones send anything from 12 MP JPEGs with large EXIF blobs to PNG
+screenshots; every upload is decoded, rotated according to its EXIF
+orientation, downscaled to KEYPHOTO_INGEST_MAX_DIMENSION and re-encoded
+without metadata. Uploads that wouldn't get smaller, or that are already
+metadata-free in the target format and size, are stored unchanged. JPEGs
+are decoded at reduced scale (draft mode) and the output spills to disk
+above SPOOL_MAX_SIZE, so memory stays bounded for large uploads.
+"""
+import logging
+import os
+import tempfile
+from collections import namedtuple
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+try:
+    from pillow_heif import register_heif_opener
+except ImportError:  # HEIC uploads are then stored unchanged
+    pass
+else:
+    register_heif_opener()
+
+logger = logging.getLogger(__name__)
+
+# Encoded output up to this size is kept in memory, larger output spills to disk
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+INGEST_FORMATS = {
+    'JPEG': ('image/jpeg', '.jpg'),
+    'WEBP': ('image/webp', '.webp'),
+}
+
+NormalizedImage = namedtuple('NormalizedImage', ['file', 'content_type', 'extension', 'size', 'width', 'height'])
+
+
+def with_extension(path, extension):
+    return f"{os.path.splitext(path)[0]}{extension}"
+
+
+def normalize_image(fileobj):
+    """
+    Returns a NormalizedImage whose `file` is a temporary file positioned at
+    the start (the caller closes it), or None when the original should be
+    stored: ingest is disabled, the upload can't be decoded, it is already a
+    metadata-free image in the target format within the size limit, or
+    re-encoding wouldn't make it smaller.
+    """
+    if not settings.KEYPHOTO_INGEST_ENABLED:
+        return None
+    image_format = settings.KEYPHOTO_INGEST_FORMAT
+    content_type, extension = INGEST_FORMATS[image_format]
+    max_dimension = settings.KEYPHOTO_INGEST_MAX_DIMENSION
+
+    fileobj.seek(0, os.SEEK_END)
+    original_size = fileobj.tell()
+    fileobj.seek(0)
+    output = None
+    try:
+        image = Image.open(fileobj)
+        # EXIF (GPS, device, orientation, ...) is what must never be stored
+        has_metadata = bool(image.getexif()) or any(key in image.info for key in ('exif', 'xmp', 'XML:com.adobe.xmp'))
+        if (image.format == image_format and image.mode in ('RGB', 'L') and not has_metadata
+                and (not max_dimension or max(image.size) <= max_dimension)):
+            return None
+        icc_profile = image.info.get('icc_profile')
+        if max_dimension:
+            image.draft('RGB', (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(image)
+        if max_dimension:
+            image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        # Only the colour profile is carried over, EXIF (GPS, device, ...) is dropped
+        save_kwargs = {'quality': settings.KEYPHOTO_INGEST_QUALITY}
+        if icc_profile:
+            save_kwargs['icc_profile'] = icc_profile
+        if image_format == 'JPEG':
+            save_kwargs['optimize'] = True
+        image.save(output, format=image_format, **save_kwargs)
+    except Exception as e:
+        # Anything Pillow (or a plugin) raises on a bad upload must not fail the upload itself
+        logger.warning('Storing upload unchanged, could not normalize it: %s', e)
+        if output is not None:
+            output.close()
+        return None
+    finally:
+        fileobj.seek(0)
+
+    size = output.tell()
+    if size >= original_size and not has_metadata:
+        output.close()
+        return None
+    output.seek(0)
+    return NormalizedImage(output, content_type, extension, size, image.width, image.height)
@@ -0,0 +1,96 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+from timelines.ingest import normalize_image
+import io
+import os
+import random
+import time
+
+
+class Command(BaseCommand):
+    help = 'Measure bytes saved and CPU time of upload normalisation (timelines.ingest)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths',
+            nargs='*',
+            help='Image files or directories to normalise',
+        )
+        parser.add_argument(
+            '--generate',
+            type=int,
+            default=0,
+            help='Also benchmark this many synthetic 12 MP phone-like JPEGs',
+        )
+
+    def handle(self, *args, **options):
+        samples = list(self.iter_files(options['paths']))
+        for i in range(options['generate']):
+            samples.append((f'synthetic-{i}.jpg', self.synthetic_photo(seed=i)))
+        if not samples:
+            raise CommandError('Pass image paths or --generate N')
+
+        self.stdout.write(
+            f"Format {settings.KEYPHOTO_INGEST_FORMAT}, quality {settings.KEYPHOTO_INGEST_QUALITY}, "
+            f"max dimension {settings.KEYPHOTO_INGEST_MAX_DIMENSION}"
+        )
+        total_original = total_final = 0
+        total_cpu = 0.0
+        count = 0
+        for name, data in samples:
+            cpu_started = time.process_time()
+            normalized = normalize_image(io.BytesIO(data))
+            cpu = time.process_time() - cpu_started
+            if normalized is None:
+                self.stdout.write(self.style.WARNING(f'{name}: not normalised (undecodable)'))
+                continue
+            normalized.file.close()
+            count += 1
+            total_original += len(data)
+            total_final += normalized.size
+            total_cpu += cpu
+            self.stdout.write(
+                f'{name}: {len(data)} -> {normalized.size} bytes '
+                f'({self.saved(len(data), normalized.size)}), '
+                f'{normalized.width}x{normalized.height}, {cpu * 1000:.0f} ms CPU'
+            )
+
+        if count:
+            self.stdout.write(self.style.SUCCESS(
+                f'{count} images: {total_original} -> {total_final} bytes '
+                f'({self.saved(total_original, total_final)}), '
+                f'{total_cpu / count * 1000:.0f} ms CPU per image'
+            ))
+
+    @staticmethod
+    def saved(original, final):
+        return f'{(1 - final / original) * 100:.1f}% saved' if original else 'n/a'
+
+    @staticmethod
+    def iter_files(paths):
+        for path in paths:
+            if os.path.isdir(path):
+                names = sorted(os.listdir(path))
+                files = [os.path.join(path, name) for name in names]
+            else:
+                files = [path]
+            for file_path in files:
+                if os.path.isfile(file_path):
+                    with open(file_path, 'rb') as f:
+                        yield os.path.basename(file_path), f.read()
+
+    @staticmethod
+    def synthetic_photo(seed, size=(4032, 3024)):
+        """Noisy gradient with an EXIF block, roughly what a phone camera produces"""
+        rng = random.Random(seed)
+        gradient = Image.linear_gradient('L').resize(size)
+        noise = Image.effect_noise(size, 40 + rng.randint(0, 20))
+        image = Image.merge('RGB', (gradient, noise, gradient.rotate(180)))
+        exif = Image.Exif()
+        exif[0x0112] = rng.choice([1, 6, 8])  # orientation
+        exif[0x010F] = 'Phone'  # make
+        exif[0x9286] = 'x' * 32 * 1024  # user comment, stands in for maker notes
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=95, exif=exif)
+        return output.getvalue()
@@ -0,0 +1,106 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from gymguru.renderers import ORJSONRenderer
+from timelines import storage
+from timelines.fast_serializers import KeyPhotoValuesSerializer
+from timelines.models import KeyPhoto
+from timelines.serializers import KeyPhotoSerializer
+from datetime import timedelta
+from unittest import mock
+import random
+import time
+import uuid
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Measure rows/sec of KeyPhoto list serialization: ModelSerializer vs .values() fast path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Synthetic KeyPhotos to serialize')
+        parser.add_argument('--user', help='Serialize this user\'s KeyPhotos instead of synthetic ones')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per path, the best one is reported')
+        parser.add_argument('--fields', help='Comma-separated subset of fields, like the fields= parameter')
+
+    def handle(self, *args, **options):
+        # Both paths sign urls the same way (get_presigned_urls); a fixed signature keeps
+        # urls evicted from a small cache identical, so outputs can be compared
+        fake_sign = mock.patch.object(storage, '_sign_get_url', side_effect=lambda path: f'https://signed/{path}')
+        # Synthetic rows are rolled back afterwards
+        with fake_sign, transaction.atomic():
+            if options['user']:
+                user = User.objects.filter(username=options['user']).first()
+                if user is None:
+                    raise CommandError(f"No user {options['user']}")
+            else:
+                user = self.create_rows(options['rows'])
+            self.run(KeyPhoto.objects.filter(user=user, is_deleted=False).order_by('-created', 'id'), options)
+            transaction.set_rollback(True)
+
+    def run(self, queryset, options):
+        fields = options['fields'].split(',') if options['fields'] else None
+
+        def model_serializer():
+            data = KeyPhotoSerializer(list(queryset), many=True, fields=fields, context={'size': None}).data
+            return JSONRenderer().render(data)
+
+        def values(renderer_class):
+            def path():
+                serializer = KeyPhotoValuesSerializer(fields=fields, context={'size': None})
+                return renderer_class().render(serializer.to_representation(queryset.values(*serializer.columns)))
+            return path
+
+        paths = [
+            ('ModelSerializer + JSONRenderer', model_serializer),
+            ('values() + JSONRenderer', values(JSONRenderer)),
+            ('values() + ORJSONRenderer', values(ORJSONRenderer)),
+        ]
+        # Warms the presigned url cache, and checks every path answers the same
+        outputs = {path() for _, path in paths}
+        if len(outputs) != 1:
+            raise CommandError('Serialization paths produced different output')
+        rows = queryset.count()
+        if not rows:
+            raise CommandError('No KeyPhotos to serialize')
+
+        self.stdout.write(f"{rows} rows, best of {options['repeat']} runs (query, serialization and rendering)")
+        baseline = None
+        for name, path in paths:
+            best = min(self.timed(path) for _ in range(options['repeat']))
+            baseline = baseline or best
+            self.stdout.write(
+                f'{name:<32} {best * 1000:8.1f} ms {rows / best:10.0f} rows/s {baseline / best:6.1f}x'
+            )
+
+    @staticmethod
+    def timed(path):
+        started = time.perf_counter()
+        path()
+        return time.perf_counter() - started
+
+    @staticmethod
+    def create_rows(count):
+        rng = random.Random(1)
+        user = User.objects.create(username=f'serialization-bench-{uuid.uuid4().hex[:8]}')
+        started = timezone.now() - timedelta(days=count)
+        KeyPhoto.objects.bulk_create([
+            KeyPhoto(
+                user=user,
+                filename=f'photo{i}.jpg',
+                s3_path=f'users/{user.username}/keyphotos/photo{i}.jpg',
+                photo_taken_at=started + timedelta(days=i, microseconds=rng.randint(0, 999999)),
+                weight_centigrams=rng.randint(6000, 9000),
+                file_size=rng.randint(100000, 900000),
+                content_hash=f'{rng.getrandbits(256):064x}',
+                derivatives={
+                    str(size): {'s3_path': f'users/{user.username}/keyphotos/photo{i}_{size}.webp', 'width': size}
+                    for size in (128, 512)
+                },
+            )
+            for i in range(count)
+        ], batch_size=1000)
+        return user
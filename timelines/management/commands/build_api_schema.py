@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from gymguru.schema import build_schema
+
+
+class Command(BaseCommand):
+    help = 'Build the OpenAPI schema served by swagger/ and redoc/ (run on every deploy)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output-dir',
+            default=str(settings.API_SCHEMA_DIR),
+            help='Where to write the schema files (default: API_SCHEMA_DIR)',
+        )
+        parser.add_argument(
+            '--url',
+            help='Public base url of the API, e.g. https://api.example.com; by default the schema has no host',
+        )
+
+    def handle(self, *args, **options):
+        version = build_schema(options['output_dir'], options['url'])
+        self.stdout.write(self.style.SUCCESS(f"Built API schema {version} in {options['output_dir']}"))
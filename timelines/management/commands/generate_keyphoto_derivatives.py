@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from timelines.models import KeyPhoto
+from timelines.tasks import generate_keyphoto_derivatives
+
+
+class Command(BaseCommand):
+    help = 'Queue thumbnail/derivative generation for existing KeyPhotos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sync',
+            action='store_true',
+            help='Generate in this process instead of queueing Celery tasks',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate derivatives even for photos that already have them',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of rows fetched from the database at a time',
+        )
+
+    def handle(self, *args, **options):
+        sync = options['sync']
+        force = options['force']
+
+        key_photos = KeyPhoto.objects.filter(is_deleted=False).order_by('id')
+        if not force:
+            # Rows missing any of the configured sizes
+            missing = Q()
+            for size in settings.KEYPHOTO_DERIVATIVE_SIZES:
+                missing |= ~Q(derivatives__has_key=str(size))
+            key_photos = key_photos.filter(missing)
+
+        self.stdout.write(f'Found {key_photos.count()} KeyPhoto records to process')
+
+        processed_count = 0
+        error_count = 0
+        for key_photo_id in key_photos.values_list('id', flat=True).iterator(chunk_size=options['chunk_size']):
+            if sync:
+                try:
+                    generate_keyphoto_derivatives(key_photo_id, force=force)
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f'Error processing {key_photo_id}: {e}'))
+                    error_count += 1
+                    continue
+            else:
+                generate_keyphoto_derivatives.delay(key_photo_id, force=force)
+            processed_count += 1
+
+        verb = 'Generated' if sync else 'Queued'
+        self.stdout.write(
+            self.style.SUCCESS(f'{verb} derivatives for {processed_count} photos, {error_count} errors')
+        )
@@ -0,0 +1,263 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
+import os
+import random
+import re
+import threading
+import time
+
+import numpy as np
+import requests
+from urllib3 import encode_multipart_formdata
+
+SCENARIOS = ('login', 'list', 'upload', 'download')
+SERVER_TIMING_DB = re.compile(r'(?:^|,\s*)db;[^,]*desc="(\d+) calls"')
+
+
+class ThrottledBody:
+    """Request body sent no faster than `bytes_per_second`, with a known Content-Length"""
+
+    def __init__(self, data, bytes_per_second):
+        self.data = io.BytesIO(data)
+        self.size = len(data)
+        self.bytes_per_second = bytes_per_second
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size=-1):
+        chunk = self.data.read(size)
+        time.sleep(len(chunk) / self.bytes_per_second)
+        return chunk
+
+
+class Command(BaseCommand):
+    help = 'Run concurrent API scenarios against a running server and compare with a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='Server under test')
+        parser.add_argument('--users', type=int, default=20, help='Seeded users to log in as (see seed_benchmark)')
+        parser.add_argument('--prefix', default='bench', help='Usernames are <prefix><n>')
+        parser.add_argument('--password', default='benchpass123')
+        parser.add_argument('--concurrency', type=int, default=16, help='Concurrent clients')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run')
+        parser.add_argument(
+            '--mix',
+            default='login=1,list=6,upload=1,download=4',
+            help='Relative weight of each scenario (%s)' % ', '.join(SCENARIOS),
+        )
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for the scenario mix')
+        parser.add_argument('--photo-size', type=int, default=1200, help='Longest side of the uploaded JPEG')
+        parser.add_argument(
+            '--client-kbps',
+            type=int,
+            default=0,
+            help='Send uploads and read downloads at this many KB/s per client, like slow mobile connections (0 = unlimited)',
+        )
+        parser.add_argument('--baseline', default='benchmarks/baseline.json', help='Baseline to compare with')
+        parser.add_argument('--save-baseline', action='store_true', help='Store this run as the new baseline')
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.15,
+            help='Allowed relative p95, RPS or queries-per-request change before a scenario counts as a regression',
+        )
+
+    def handle(self, *args, **options):
+        self.base_url = options['base_url'].rstrip('/')
+        self.client_bytes_per_second = options['client_kbps'] * 1024
+        mix = self.parse_mix(options['mix'])
+        upload_photo = self.photo_bytes(options['photo_size'])
+        self.upload_counter = 0
+        self.counter_lock = threading.Lock()
+
+        self.stdout.write(f"Logging in {options['users']} users")
+        accounts = [self.prepare_account(f"{options['prefix']}{n}", options['password']) for n in range(options['users'])]
+
+        samples = []
+        samples_lock = threading.Lock()
+        deadline = time.monotonic() + options['duration']
+
+        def client(worker):
+            rng = random.Random(options['seed'] + worker)
+            session = requests.Session()
+            names, weights = zip(*mix.items())
+            local = []
+            while time.monotonic() < deadline:
+                account = accounts[rng.randrange(len(accounts))]
+                scenario = rng.choices(names, weights)[0]
+                local.append(self.run_scenario(session, scenario, account, rng, upload_photo))
+            with samples_lock:
+                samples.extend(local)
+
+        self.stdout.write(
+            f"Running {options['concurrency']} clients for {options['duration']:.0f}s against {self.base_url}"
+        )
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            list(pool.map(client, range(options['concurrency'])))
+        elapsed = time.monotonic() - started
+
+        results = self.summarize(samples, elapsed)
+        self.print_results(results)
+
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(options['baseline']) or '.', exist_ok=True)
+            with open(options['baseline'], 'w') as f:
+                json.dump({
+                    'created': timezone.now().isoformat(),
+                    'options': {key: options[key] for key in ('users', 'concurrency', 'duration', 'mix')},
+                    'results': results,
+                }, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {options['baseline']}"))
+        elif os.path.exists(options['baseline']):
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = self.compare(results, baseline['results'], options['tolerance'])
+            if regressions:
+                raise CommandError(f'{len(regressions)} regression(s) against {options["baseline"]}')
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['baseline']}"))
+
+    @staticmethod
+    def parse_mix(value):
+        mix = {}
+        for part in value.split(','):
+            name, _, weight = part.partition('=')
+            name = name.strip()
+            if name not in SCENARIOS:
+                raise CommandError(f'Unknown scenario {name!r}, choose from {", ".join(SCENARIOS)}')
+            mix[name] = float(weight or 1)
+        return {name: weight for name, weight in mix.items() if weight > 0}
+
+    @staticmethod
+    def photo_bytes(size):
+        image = Image.effect_noise((size * 3 // 4, size), 64).convert('RGB')
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=90)
+        return output.getvalue()
+
+    def url(self, path):
+        return f'{self.base_url}/api/{path}'
+
+    def login(self, session, username, password):
+        return session.post(self.url('auth/login/'), json={'username': username, 'password': password})
+
+    def prepare_account(self, username, password):
+        response = self.login(requests, username, password)
+        if response.status_code != 200:
+            raise CommandError(f'Could not log in as {username} ({response.status_code}), run seed_benchmark first')
+        headers = {'Authorization': f"Bearer {response.json()['access']}"}
+        response = requests.get(self.url('my-keyphotos/?fields=id&page_size=200'), headers=headers)
+        key_photo_ids = [item['id'] for item in response.json()['results']]
+        return {'username': username, 'password': password, 'headers': headers, 'key_photo_ids': key_photo_ids}
+
+    def run_scenario(self, session, scenario, account, rng, upload_photo):
+        started = time.perf_counter()
+        try:
+            if scenario == 'login':
+                response = self.login(session, account['username'], account['password'])
+            elif scenario == 'list':
+                response = session.get(self.url('my-keyphotos/?page_size=50'), headers=account['headers'])
+            elif scenario == 'upload':
+                with self.counter_lock:
+                    self.upload_counter += 1
+                    # Unique trailing bytes, so uploads aren't deduplicated by content hash
+                    body = upload_photo + f'{time.time_ns()}-{self.upload_counter}'.encode()
+                body, content_type = encode_multipart_formdata({
+                    'photo': ('bench.jpg', body, 'image/jpeg'),
+                    'photo_taken_at': timezone.now().isoformat(),
+                })
+                response = session.post(
+                    self.url('keyphoto/new/'),
+                    headers={**account['headers'], 'Content-Type': content_type},
+                    data=ThrottledBody(body, self.client_bytes_per_second) if self.client_bytes_per_second else body,
+                )
+            else:
+                if not account['key_photo_ids']:
+                    return {'scenario': scenario, 'latency': 0.0, 'ok': False, 'queries': None, 'bytes': 0}
+                key_photo_id = rng.choice(account['key_photo_ids'])
+                response = session.get(
+                    self.url(f'keyphoto/{key_photo_id}/download/'), headers=account['headers'], stream=True
+                )
+            body_size = self.read_body(response)
+        except requests.RequestException:
+            return {'scenario': scenario, 'latency': time.perf_counter() - started, 'ok': False, 'queries': None, 'bytes': 0}
+        match = SERVER_TIMING_DB.search(response.headers.get('Server-Timing', ''))
+        return {
+            'scenario': scenario,
+            'latency': time.perf_counter() - started,
+            'ok': response.status_code < 400,
+            'queries': int(match.group(1)) if match else (0 if 'Server-Timing' in response.headers else None),
+            'bytes': body_size,
+        }
+
+    def read_body(self, response):
+        if not self.client_bytes_per_second:
+            return len(response.content)
+        body_size = 0
+        chunk_size = 64 * 1024
+        for chunk in response.iter_content(chunk_size):
+            body_size += len(chunk)
+            time.sleep(len(chunk) / self.client_bytes_per_second)
+        return body_size
+
+    @staticmethod
+    def summarize(samples, elapsed):
+        results = {}
+        for scenario in SCENARIOS + ('all',):
+            selected = [s for s in samples if scenario == 'all' or s['scenario'] == scenario]
+            if not selected:
+                continue
+            latencies = np.array([s['latency'] for s in selected if s['ok']]) * 1000
+            queries = [s['queries'] for s in selected if s['queries'] is not None]
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0, 0, 0)
+            results[scenario] = {
+                'requests': len(selected),
+                'errors': sum(1 for s in selected if not s['ok']),
+                'rps': round(len(selected) / elapsed, 2),
+                'p50_ms': round(float(p50), 1),
+                'p95_ms': round(float(p95), 1),
+                'p99_ms': round(float(p99), 1),
+                'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+                'bytes_per_request': round(sum(s['bytes'] for s in selected) / len(selected)),
+            }
+        return results
+
+    def print_results(self, results):
+        self.stdout.write(
+            f"{'scenario':<10}{'requests':>9}{'errors':>8}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+            f"{'queries':>9}{'bytes':>10}"
+        )
+        for scenario, r in results.items():
+            queries = '-' if r['queries_per_request'] is None else r['queries_per_request']
+            self.stdout.write(
+                f"{scenario:<10}{r['requests']:>9}{r['errors']:>8}{r['rps']:>9}{r['p50_ms']:>9}{r['p95_ms']:>9}"
+                f"{r['p99_ms']:>9}{queries:>9}{r['bytes_per_request']:>10}"
+            )
+
+    def compare(self, results, baseline, tolerance):
+        regressions = []
+        for scenario, current in results.items():
+            previous = baseline.get(scenario)
+            if not previous:
+                continue
+            checks = [
+                ('p95_ms', current['p95_ms'] > previous['p95_ms'] * (1 + tolerance)),
+                ('rps', current['rps'] < previous['rps'] * (1 - tolerance)),
+            ]
+            if current['queries_per_request'] is not None and previous.get('queries_per_request') is not None:
+                checks.append((
+                    'queries_per_request',
+                    current['queries_per_request'] > previous['queries_per_request'] * (1 + tolerance)
+                ))
+            for metric, regressed in checks:
+                if regressed:
+                    regressions.append((scenario, metric))
+                    self.stdout.write(self.style.ERROR(
+                        f'{scenario}: {metric} {previous[metric]} -> {current[metric]}'
+                    ))
+        return regressions
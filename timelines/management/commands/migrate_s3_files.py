@@ -1,9 +1,15 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+from timelines import versioning
 from timelines.models import KeyPhoto
-import boto3
+from timelines.storage import delete_objects, get_s3_client
 from django.conf import settings
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import json
 import os
+import time
 
 User = get_user_model()
 
@@ -17,86 +23,179 @@ class Command(BaseCommand):
             action='store_true',
             help='Show what would be done without actually doing it',
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of threads copying objects in parallel',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Rows copied, updated and deleted together before the checkpoint moves on',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default='migrate_s3_files.checkpoint',
+            help='File recording progress, used by --resume',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Continue after the last checkpointed batch',
+        )
 
     def handle(self, *args, **options):
         dry_run = options['dry_run']
-        
+        self.checkpoint_path = options['checkpoint']
+
         if dry_run:
             self.stdout.write(self.style.WARNING('DRY RUN MODE - No files will be moved'))
-        
+
         # Get S3 client
-        s3_client = boto3.client('s3', region_name=settings.AWS_REGION)
-        bucket_name = 'testguru-v2'
-        
-        # Get all KeyPhoto records
-        key_photos = KeyPhoto.objects.all()
-        
-        self.stdout.write(f'Found {key_photos.count()} KeyPhoto records to process')
-        
-        moved_count = 0
-        error_count = 0
-        
-        for key_photo in key_photos:
-            try:
-                old_s3_path = key_photo.s3_path
-                
-                # Check if the file is already in the new structure
-                if old_s3_path.startswith('users/'):
-                    self.stdout.write(f'Skipping {old_s3_path} - already in new structure')
-                    continue
-                
-                # Generate new S3 path
-                user_id = key_photo.user.id
-                username = key_photo.user.username
-                filename = key_photo.filename
-                new_s3_path = f"users/{user_id}/{username}/keyphotos/{filename}"
-                
-                if dry_run:
-                    self.stdout.write(f'Would move: {old_s3_path} -> {new_s3_path}')
-                    continue
-                
-                # Check if source file exists
-                try:
-                    s3_client.head_object(Bucket=bucket_name, Key=old_s3_path)
-                except Exception as e:
-                    self.stdout.write(
-                        self.style.ERROR(f'Source file not found: {old_s3_path} - {e}')
-                    )
-                    error_count += 1
-                    continue
-                
-                # Copy file to new location
-                copy_source = {'Bucket': bucket_name, 'Key': old_s3_path}
-                s3_client.copy_object(
-                    CopySource=copy_source,
-                    Bucket=bucket_name,
-                    Key=new_s3_path
-                )
-                
-                # Delete old file
-                s3_client.delete_object(Bucket=bucket_name, Key=old_s3_path)
-                
-                # Update database record
-                key_photo.s3_path = new_s3_path
-                key_photo.save()
-                
-                moved_count += 1
-                self.stdout.write(f'Moved: {old_s3_path} -> {new_s3_path}')
-                
-            except Exception as e:
-                self.stdout.write(
-                    self.style.ERROR(f'Error processing {key_photo.id}: {e}')
-                )
-                error_count += 1
-        
+        self.s3_client = get_s3_client()
+        self.bucket_name = settings.AWS_STORAGE_BUCKET_NAME
+
+        checkpoint = {'last_id': 0, 'pending_deletes': []}
+        if options['resume'] and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+            self.stdout.write(f"Resuming after KeyPhoto id={checkpoint['last_id']}")
+            # Objects already copied and saved in the database, but not yet deleted
+            if checkpoint['pending_deletes'] and not dry_run:
+                self.delete_old_objects(checkpoint['pending_deletes'])
+                checkpoint['pending_deletes'] = []
+                self.write_checkpoint(checkpoint)
+
+        # KeyPhoto records still in the old structure
+        key_photos = (
+            KeyPhoto.objects
+            .select_related('user')
+            .filter(id__gt=checkpoint['last_id'])
+            .exclude(s3_path__startswith='users/')
+            .order_by('id')
+        )
+        total = key_photos.count()
+
+        self.stdout.write(f'Found {total} KeyPhoto records to process')
+
+        self.moved_count = 0
+        self.error_count = 0
+        processed = 0
+        started_at = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            batch = []
+            for key_photo in key_photos.iterator(chunk_size=options['batch_size']):
+                batch.append(key_photo)
+                if len(batch) >= options['batch_size']:
+                    self.process_batch(batch, pool, dry_run, checkpoint)
+                    processed += len(batch)
+                    self.report_progress(processed, total, started_at)
+                    batch = []
+            if batch:
+                self.process_batch(batch, pool, dry_run, checkpoint)
+                processed += len(batch)
+                self.report_progress(processed, total, started_at)
+
+        if not dry_run and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
         # Summary
         if dry_run:
             self.stdout.write(
-                self.style.SUCCESS(f'DRY RUN COMPLETE - Would move {moved_count} files')
+                self.style.SUCCESS(
+                    f'DRY RUN COMPLETE - Would move {self.moved_count} files, {self.error_count} errors'
+                )
             )
         else:
             self.stdout.write(
                 self.style.SUCCESS(
-                    f'Migration complete! Moved {moved_count} files, {error_count} errors'
+                    f'Migration complete! Moved {self.moved_count} files, {self.error_count} errors'
                 )
             )
+
+    @staticmethod
+    def new_s3_path(key_photo):
+        user_id = key_photo.user.id
+        username = key_photo.user.username
+        filename = key_photo.filename
+        return f"users/{user_id}/{username}/keyphotos/{filename}"
+
+    def copy_object(self, key_photo):
+        """Copies one object to its new key, returns an error message or None"""
+        old_s3_path = key_photo.s3_path
+        try:
+            self.s3_client.copy_object(
+                CopySource={'Bucket': self.bucket_name, 'Key': old_s3_path},
+                Bucket=self.bucket_name,
+                Key=self.new_s3_path(key_photo)
+            )
+        except Exception as e:
+            return f'Error copying {old_s3_path} (KeyPhoto {key_photo.id}): {e}'
+        return None
+
+    def process_batch(self, batch, pool, dry_run, checkpoint):
+        # Rows without a user have no folder to move to, they stay where they are
+        key_photos = []
+        for key_photo in batch:
+            if key_photo.user is None:
+                self.stdout.write(self.style.ERROR(f'KeyPhoto {key_photo.id} has no user: {key_photo.s3_path}'))
+                self.error_count += 1
+            else:
+                key_photos.append(key_photo)
+
+        if dry_run:
+            for key_photo in key_photos:
+                self.stdout.write(f'Would move: {key_photo.s3_path} -> {self.new_s3_path(key_photo)}')
+                self.moved_count += 1
+            return
+
+        # 1. Copy objects in parallel
+        errors = list(pool.map(self.copy_object, key_photos))
+
+        # 2. Point the database rows at the copies
+        moved = []
+        old_s3_paths = []
+        now = timezone.now()
+        for key_photo, error in zip(key_photos, errors):
+            if error:
+                self.stdout.write(self.style.ERROR(error))
+                self.error_count += 1
+                continue
+            old_s3_paths.append(key_photo.s3_path)
+            key_photo.s3_path = self.new_s3_path(key_photo)
+            key_photo.updated = now
+            moved.append(key_photo)
+        KeyPhoto.objects.bulk_update(moved, ['s3_path', 'updated'])
+        for user_id in {key_photo.user_id for key_photo in moved}:
+            versioning.bump_collection_version(user_id, versioning.KEYPHOTOS)
+
+        # 3. Remember what still has to be deleted, then delete the originals
+        checkpoint['last_id'] = batch[-1].id
+        checkpoint['pending_deletes'] = old_s3_paths
+        self.write_checkpoint(checkpoint)
+        self.delete_old_objects(old_s3_paths)
+        checkpoint['pending_deletes'] = []
+        self.write_checkpoint(checkpoint)
+
+        self.moved_count += len(moved)
+
+    def delete_old_objects(self, s3_paths):
+        for key, message in delete_objects(s3_paths):
+            self.stdout.write(self.style.ERROR(f'Error deleting {key}: {message}'))
+            self.error_count += 1
+
+    def write_checkpoint(self, checkpoint):
+        # Write to a temp file and rename so a crash never leaves a half-written checkpoint
+        tmp_path = f'{self.checkpoint_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def report_progress(self, processed, total, started_at):
+        elapsed = time.monotonic() - started_at
+        rate = processed / elapsed if elapsed else 0
+        eta = timedelta(seconds=int((total - processed) / rate)) if rate else '?'
+        self.stdout.write(f'{processed}/{total} processed, {rate:.1f} files/s, ETA {eta}')
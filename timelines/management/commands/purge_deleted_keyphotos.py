@@ -0,0 +1,114 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from timelines.models import KeyPhoto
+from timelines.storage import DELETE_BATCH_SIZE, delete_objects
+from datetime import timedelta
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        'Hard-delete KeyPhotos soft-deleted longer than the retention window, together with their S3 '
+        'objects. Rows go only after their objects, so an interrupted run continues when run again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show what would be purged without deleting anything',
+        )
+        parser.add_argument(
+            '--retention-days',
+            type=int,
+            default=settings.KEYPHOTO_DELETED_RETENTION_DAYS,
+            help='Purge photos soft-deleted more than this many days ago (default: KEYPHOTO_DELETED_RETENTION_DAYS)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DELETE_BATCH_SIZE,
+            help=f'Rows purged together; their objects are deleted {DELETE_BATCH_SIZE} keys per S3 call',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        if dry_run:
+            self.stdout.write(self.style.WARNING('DRY RUN MODE - Nothing will be deleted'))
+
+        # Soft deletes save the row, so `updated` is when it was deleted
+        cutoff = timezone.now() - timedelta(days=options['retention_days'])
+        queryset = KeyPhoto.objects.filter(is_deleted=True, updated__lt=cutoff).order_by('id')
+        total = queryset.count()
+        self.stdout.write(f"Found {total} KeyPhotos deleted more than {options['retention_days']} days ago")
+
+        self.purged_count = 0
+        self.object_count = 0
+        self.purged_bytes = 0
+        self.error_count = 0
+        processed = 0
+        started_at = time.monotonic()
+
+        last_id = 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            self.process_batch(batch, dry_run)
+            processed += len(batch)
+            self.report_progress(processed, total, started_at)
+
+        size = f'{self.purged_bytes / 1024 / 1024:.1f} MB'
+        if dry_run:
+            self.stdout.write(self.style.SUCCESS(
+                f'DRY RUN COMPLETE - Would purge {self.purged_count} KeyPhotos, '
+                f'{self.object_count} objects, {size}'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Purge complete! Purged {self.purged_count} KeyPhotos, {self.object_count} objects, '
+                f'{size}, {self.error_count} errors'
+            ))
+
+    def process_batch(self, batch, dry_run):
+        s3_paths = {}
+        for key_photo in batch:
+            for s3_path in key_photo.get_s3_paths():
+                s3_paths[s3_path] = key_photo
+        # Never delete an object a row outside the batch still points at
+        shared = set(
+            KeyPhoto.objects
+            .filter(s3_path__in=s3_paths)
+            .exclude(id__in=[key_photo.id for key_photo in batch])
+            .values_list('s3_path', flat=True)
+        )
+        s3_paths = {s3_path: key_photo for s3_path, key_photo in s3_paths.items() if s3_path not in shared}
+
+        failed = set()
+        if not dry_run:
+            for key, message in delete_objects(s3_paths):
+                self.stdout.write(self.style.ERROR(f'Error deleting {key}: {message}'))
+                self.error_count += 1
+                failed.add(s3_paths[key].id)
+            # Photos whose objects could not all be deleted are kept for the next run
+            KeyPhoto.objects.filter(id__in=[key_photo.id for key_photo in batch if key_photo.id not in failed]).delete()
+
+        for key_photo in batch:
+            if key_photo.id in failed:
+                continue
+            self.purged_count += 1
+            self.purged_bytes += (key_photo.file_size or 0) + sum(
+                derivative.get('file_size') or 0 for derivative in key_photo.derivatives.values()
+            )
+        self.object_count += sum(1 for key_photo in s3_paths.values() if key_photo.id not in failed)
+
+    def report_progress(self, processed, total, started_at):
+        elapsed = time.monotonic() - started_at
+        rate = processed / elapsed if elapsed else 0
+        object_rate = self.object_count / elapsed if elapsed else 0
+        eta = timedelta(seconds=int((total - processed) / rate)) if rate else '?'
+        self.stdout.write(
+            f'{processed}/{total} processed, {rate:.1f} photos/s, {object_rate:.1f} objects/s, ETA {eta}'
+        )
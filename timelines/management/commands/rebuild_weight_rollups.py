@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from timelines.rollups import rebuild_weight_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute all weight rollups (day/week/month) from KeyPhoto rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            dest='user_ids',
+            help='Only rebuild rollups of this user id (can be repeated)',
+        )
+
+    def handle(self, *args, **options):
+        written = rebuild_weight_rollups(options['user_ids'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} weight rollups'))
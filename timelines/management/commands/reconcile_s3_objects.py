@@ -0,0 +1,230 @@
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from timelines.models import KeyPhoto, Timelapse
+from timelines.storage import DELETE_BATCH_SIZE, delete_objects, get_s3_client
+from datetime import timedelta
+import itertools
+import json
+import os
+import time
+
+# Seconds between progress lines
+REPORT_INTERVAL = 10
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare S3 objects under users/ with KeyPhoto and Timelapse rows: delete objects no row '
+        'points at (orphans), abort incomplete multipart uploads and report rows whose object is missing'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report orphans and incomplete uploads, without deleting them',
+        )
+        parser.add_argument(
+            '--prefix',
+            default='users/',
+            help='Key prefix to reconcile, one folder below it at a time',
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=settings.KEYPHOTO_ORPHAN_MIN_AGE,
+            help=(
+                'Seconds an object or multipart upload must exist before it counts as an orphan '
+                '(default: KEYPHOTO_ORPHAN_MIN_AGE)'
+            ),
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default='reconcile_s3_objects.checkpoint',
+            help='File recording the last reconciled folder, used by --resume',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Continue after the last checkpointed folder',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        self.checkpoint_path = options['checkpoint']
+        if dry_run:
+            self.stdout.write(self.style.WARNING('DRY RUN MODE - No objects will be deleted'))
+
+        self.s3_client = get_s3_client()
+        self.bucket_name = settings.AWS_STORAGE_BUCKET_NAME
+        self.orphan_before = timezone.now() - timedelta(seconds=options['min_age'])
+        self.dry_run = dry_run
+
+        checkpoint = {'after': ''}
+        if options['resume'] and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+            self.stdout.write(f"Resuming after {checkpoint['after']}")
+
+        self.scanned_count = 0
+        self.scanned_bytes = 0
+        self.orphan_count = 0
+        self.orphan_bytes = 0
+        self.missing_count = 0
+        self.error_count = 0
+        self.aborted_count = 0
+        self.orphans = []
+        started_at = self.reported_at = time.monotonic()
+
+        # One folder per user: only one folder's keys are held in memory at a time
+        folders, loose_objects = self.list_folders(options['prefix'])
+        self.stdout.write(f'Found {len(folders)} folders under {options["prefix"]}')
+        if not checkpoint['after']:
+            self.reconcile(loose_objects, self.expected_keys(s3_path__in=[obj['Key'] for obj in loose_objects]))
+
+        for done, folder in enumerate(folders, 1):
+            if folder <= checkpoint['after']:
+                continue
+            self.reconcile(self.list_objects(folder), self.expected_keys(s3_path__startswith=folder))
+            self.flush_orphans()
+            checkpoint['after'] = folder
+            if not dry_run:
+                self.write_checkpoint(checkpoint)
+            if time.monotonic() - self.reported_at >= REPORT_INTERVAL:
+                self.report_progress(done, len(folders), started_at)
+
+        # Rows in folders that have no objects at all
+        self.report_missing_folders(options['prefix'], set(folders), {obj['Key'] for obj in loose_objects})
+        self.report_progress(len(folders), len(folders), started_at)
+        self.abort_incomplete_uploads(options['prefix'])
+
+        if not dry_run and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+        summary = (
+            f'{self.scanned_count} objects scanned, {self.orphan_count} orphans '
+            f'({self.orphan_bytes / 1024 / 1024:.1f} MB), {self.aborted_count} incomplete uploads, '
+            f'{self.missing_count} missing objects'
+        )
+        if dry_run:
+            self.stdout.write(self.style.SUCCESS(f'DRY RUN COMPLETE - {summary}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Reconcile complete! {summary}, {self.error_count} errors'))
+
+    def list_folders(self, prefix):
+        """Sorted folders directly below `prefix`, and objects directly in it"""
+        folders = []
+        loose_objects = []
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix, Delimiter='/'):
+            folders.extend(common_prefix['Prefix'] for common_prefix in page.get('CommonPrefixes', []))
+            loose_objects.extend(page.get('Contents', []))
+        return sorted(folders), loose_objects
+
+    def list_objects(self, folder):
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=folder):
+            yield from page.get('Contents', [])
+
+    @staticmethod
+    def expected_keys(**lookup):
+        """{key: whether the object must exist} of the rows matching an s3_path lookup"""
+        keys = {}
+        key_photos = KeyPhoto.objects.filter(**lookup).values_list('s3_path', 'derivatives', 'status')
+        for s3_path, derivatives, status in key_photos.iterator():
+            keys.update(dict.fromkeys(KeyPhoto.s3_paths_for(s3_path, derivatives), True))
+            # Pending uploads get their object later, failed ones may never have one
+            keys[s3_path] = status == KeyPhoto.STATUS_READY
+        for s3_path in Timelapse.objects.filter(**lookup).exclude(s3_path='').values_list('s3_path', flat=True):
+            keys[s3_path] = True
+        return keys
+
+    def reconcile(self, objects, expected):
+        for obj in objects:
+            self.scanned_count += 1
+            self.scanned_bytes += obj['Size']
+            if expected.pop(obj['Key'], None) is not None:
+                continue
+            # Direct uploads only get their row once the client completes them
+            if obj['LastModified'] >= self.orphan_before:
+                continue
+            self.stdout.write(f"{'Would delete' if self.dry_run else 'Deleting'} orphan: {obj['Key']}")
+            self.orphan_count += 1
+            self.orphan_bytes += obj['Size']
+            self.orphans.append(obj['Key'])
+            if len(self.orphans) >= DELETE_BATCH_SIZE:
+                self.flush_orphans()
+
+        for key, required in expected.items():
+            if required:
+                self.stdout.write(self.style.WARNING(f'Missing object: {key}'))
+                self.missing_count += 1
+
+    def flush_orphans(self):
+        if self.orphans and not self.dry_run:
+            for key, message in delete_objects(self.orphans):
+                self.stdout.write(self.style.ERROR(f'Error deleting {key}: {message}'))
+                self.error_count += 1
+        self.orphans = []
+
+    def abort_incomplete_uploads(self, prefix):
+        """Aborts multipart uploads the client never completed, whose parts S3 keeps (and bills) until then"""
+        paginator = self.s3_client.get_paginator('list_multipart_uploads')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for upload in page.get('Uploads', []):
+                # Uploads stay completable for as long as their upload token
+                if upload['Initiated'] >= self.orphan_before:
+                    continue
+                self.stdout.write(
+                    f"{'Would abort' if self.dry_run else 'Aborting'} incomplete upload: {upload['Key']}"
+                )
+                self.aborted_count += 1
+                if self.dry_run:
+                    continue
+                try:
+                    self.s3_client.abort_multipart_upload(
+                        Bucket=self.bucket_name, Key=upload['Key'], UploadId=upload['UploadId']
+                    )
+                except ClientError as e:
+                    self.stdout.write(self.style.ERROR(f"Error aborting upload of {upload['Key']}: {e}"))
+                    self.error_count += 1
+
+    def report_missing_folders(self, prefix, folders, loose_keys):
+        """Reports rows whose object would be in a folder, or directly in `prefix`, that S3 doesn't have"""
+        def missing(s3_path):
+            folder, sep, _ = s3_path[len(prefix):].partition('/')
+            return f'{prefix}{folder}/' not in folders if sep else s3_path not in loose_keys
+
+        key_photos = (
+            KeyPhoto.objects.filter(s3_path__startswith=prefix, status=KeyPhoto.STATUS_READY)
+            .values_list('s3_path', 'derivatives')
+        )
+        timelapses = Timelapse.objects.filter(s3_path__startswith=prefix).values_list('s3_path', flat=True)
+        rows = itertools.chain(
+            ((s3_path, KeyPhoto.s3_paths_for(s3_path, derivatives)) for s3_path, derivatives in key_photos.iterator()),
+            ((s3_path, [s3_path]) for s3_path in timelapses.iterator()),
+        )
+        for s3_path, keys in rows:
+            if missing(s3_path):
+                for key in keys:
+                    self.stdout.write(self.style.WARNING(f'Missing object: {key}'))
+                    self.missing_count += 1
+
+    def write_checkpoint(self, checkpoint):
+        # Write to a temp file and rename so a crash never leaves a half-written checkpoint
+        tmp_path = f'{self.checkpoint_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def report_progress(self, done, total, started_at):
+        self.reported_at = time.monotonic()
+        elapsed = self.reported_at - started_at
+        rate = self.scanned_count / elapsed if elapsed else 0
+        self.stdout.write(
+            f'{done}/{total} folders, {self.scanned_count} objects '
+            f'({self.scanned_bytes / 1024 / 1024:.1f} MB), {rate:.1f} objects/s, '
+            f'{self.orphan_count} orphans, {self.missing_count} missing'
+        )
@@ -0,0 +1,143 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from botocore.exceptions import ClientError
+from PIL import Image
+from timelines import versioning
+from timelines.models import KeyPhoto, Timeline, TimelineKeyPhoto
+from timelines.rollups import rebuild_weight_rollups
+from timelines.storage import get_s3_client
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import io
+import random
+import uuid
+
+User = get_user_model()
+
+# Email domain of the users this command creates; it never touches other users
+SEED_EMAIL_DOMAIN = 'seed-benchmark.invalid'
+
+
+class Command(BaseCommand):
+    help = 'Create benchmark users with KeyPhotos (and their S3 objects) and Timelines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help='Number of users')
+        parser.add_argument('--photos', type=int, default=200, help='KeyPhotos per user')
+        parser.add_argument('--timelines', type=int, default=5, help='Timelines per user')
+        parser.add_argument('--prefix', default='bench', help='Usernames are <prefix><n>')
+        parser.add_argument('--password', default='benchpass123', help='Password of every benchmark user')
+        parser.add_argument('--photo-size', type=int, default=1024, help='Longest side of the seeded JPEGs')
+        parser.add_argument('--workers', type=int, default=16, help='Parallel S3 uploads')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed, for reproducible data')
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Seed even with DEBUG off, e.g. into a dedicated benchmark database',
+        )
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError('Refusing to seed with DEBUG off; pass --force if this is a benchmark database')
+        usernames = [f"{options['prefix']}{n}" for n in range(options['users'])]
+        foreign = (
+            User.objects.filter(username__in=usernames)
+            .exclude(email__endswith=f'@{SEED_EMAIL_DOMAIN}')
+            .values_list('username', flat=True)
+        )
+        if foreign:
+            raise CommandError(
+                f"Users {', '.join(sorted(foreign))} were not created by seed_benchmark, choose another --prefix"
+            )
+
+        rng = random.Random(options['seed'])
+        s3_client = get_s3_client()
+        bucket_name = settings.AWS_STORAGE_BUCKET_NAME
+        self.ensure_bucket(s3_client, bucket_name)
+        body = self.photo_bytes(options['photo_size'])
+
+        users = []
+        for username in usernames:
+            user, _ = User.objects.get_or_create(
+                username=username, defaults={'email': f'{username}@{SEED_EMAIL_DOMAIN}'}
+            )
+            user.set_password(options['password'])
+            user.save()
+            users.append(user)
+        # Re-seeding replaces earlier benchmark data, of seeded users only
+        KeyPhoto.objects.filter(user__in=users).delete()
+        Timeline.objects.filter(user__in=users).delete()
+
+        started = timezone.now() - timedelta(days=options['photos'])
+        key_photos = []
+        for user in users:
+            for i in range(options['photos']):
+                filename = f'{uuid.uuid4()}.jpg'
+                key_photos.append(KeyPhoto(
+                    user=user,
+                    filename=filename,
+                    s3_path=f'users/{user.username}/keyphotos/{filename}',
+                    photo_taken_at=started + timedelta(days=i, minutes=rng.randint(0, 600)),
+                    weight_centigrams=rng.randint(6000, 9000),
+                    file_size=len(body),
+                ))
+
+        def upload(key_photo):
+            s3_client.put_object(Bucket=bucket_name, Key=key_photo.s3_path, Body=body, ContentType='image/jpeg')
+
+        self.stdout.write(f'Uploading {len(key_photos)} objects to {bucket_name}')
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            list(pool.map(upload, key_photos))
+        key_photos = KeyPhoto.objects.bulk_create(key_photos, batch_size=1000)
+
+        timelines = Timeline.objects.bulk_create([
+            Timeline(user=user, name=f'Timeline {i}')
+            for user in users
+            for i in range(options['timelines'])
+        ], batch_size=1000)
+        timelines_by_user = {}
+        for timeline in timelines:
+            timelines_by_user.setdefault(timeline.user_id, []).append(timeline)
+        memberships = []
+        for position, key_photo in enumerate(key_photos):
+            user_timelines = timelines_by_user.get(key_photo.user_id)
+            if user_timelines:
+                memberships.append(TimelineKeyPhoto(
+                    timeline=user_timelines[position % len(user_timelines)],
+                    key_photo=key_photo,
+                    position=position,
+                    photo_taken_at=key_photo.photo_taken_at,
+                ))
+        TimelineKeyPhoto.objects.bulk_create(memberships, batch_size=1000)
+        rebuild_weight_rollups([user.id for user in users])
+        # bulk_create skips the signals that normally invalidate cached list ETags
+        for user in users:
+            versioning.bump_collection_version(user.id, versioning.KEYPHOTOS)
+            versioning.bump_collection_version(user.id, versioning.TIMELINES)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(users)} users ({options["prefix"]}0..), {len(key_photos)} KeyPhotos, '
+            f'{len(timelines)} Timelines'
+        ))
+
+    @staticmethod
+    def ensure_bucket(s3_client, bucket_name):
+        try:
+            s3_client.head_bucket(Bucket=bucket_name)
+        except ClientError:
+            if settings.AWS_REGION == 'us-east-1':
+                s3_client.create_bucket(Bucket=bucket_name)
+            else:
+                s3_client.create_bucket(
+                    Bucket=bucket_name,
+                    CreateBucketConfiguration={'LocationConstraint': settings.AWS_REGION}
+                )
+
+    @staticmethod
+    def photo_bytes(size):
+        image = Image.effect_noise((size, size * 4 // 3), 64).convert('RGB')
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=85)
+        return output.getvalue()
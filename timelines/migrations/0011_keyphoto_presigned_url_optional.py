@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 16:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timelines', '0010_keyphoto_user_timeline_user_alter_keyphoto_filename_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='keyphoto',
+            name='presigned_url',
+            field=models.URLField(blank=True, default='', max_length=500),
+        ),
+    ]
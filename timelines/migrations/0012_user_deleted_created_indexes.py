@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-10-18 16:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timelines', '0011_keyphoto_presigned_url_optional'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='keyphoto',
+            index=models.Index(fields=['user', 'is_deleted', 'created'], name='keyphoto_user_deleted_created'),
+        ),
+        migrations.AddIndex(
+            model_name='timeline',
+            index=models.Index(fields=['user', 'is_deleted', 'created'], name='timeline_user_deleted_created'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 16:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timelines', '0012_user_deleted_created_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='keyphoto',
+            name='derivatives',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
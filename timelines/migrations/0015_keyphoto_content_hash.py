@@ -0,0 +1,22 @@
+# Generated by Django 4.2 on 2026-10-18 16:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timelines', '0014_keyphoto_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='keyphoto',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='keyphoto',
+            index=models.Index(fields=['user', 'content_hash'], name='keyphoto_user_content_hash'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2 on 2026-10-18 16:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('timelines', '0015_keyphoto_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeightRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('week', 'Week'), ('month', 'Month')], max_length=5)),
+                ('period_start', models.DateField()),
+                ('count', models.IntegerField()),
+                ('sum_centigrams', models.BigIntegerField()),
+                ('min_centigrams', models.IntegerField()),
+                ('max_centigrams', models.IntegerField()),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='weight_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'period', 'period_start')},
+            },
+        ),
+    ]
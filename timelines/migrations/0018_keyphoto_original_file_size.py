@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 16:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timelines', '0017_sync_indexes_tombstone'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='keyphoto',
+            name='original_file_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
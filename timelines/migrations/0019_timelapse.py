@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2026-10-18 16:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('timelines', '0018_keyphoto_original_file_size'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Timelapse',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('input_hash', models.CharField(max_length=64)),
+                ('format', models.CharField(choices=[('webp', 'Animated WebP'), ('mp4', 'MP4')], max_length=4)),
+                ('key_photo_ids', models.JSONField(default=list)),
+                ('photos_rendered', models.IntegerField(default=0)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('rendering', 'Rendering'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('s3_path', models.CharField(blank=True, default='', max_length=500)),
+                ('file_size', models.BigIntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timelapses', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'input_hash')},
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2 on 2026-10-18 16:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timelines', '0019_timelapse'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineKeyPhoto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.IntegerField()),
+                ('photo_taken_at', models.DateTimeField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('key_photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_memberships', to='timelines.keyphoto')),
+                ('timeline', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='timelines.timeline')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='timeline',
+            name='key_photos',
+            field=models.ManyToManyField(blank=True, related_name='timelines', through='timelines.TimelineKeyPhoto', to='timelines.keyphoto'),
+        ),
+        migrations.AddIndex(
+            model_name='timelinekeyphoto',
+            index=models.Index(fields=['timeline', 'position'], name='membership_timeline_position'),
+        ),
+        migrations.AddIndex(
+            model_name='timelinekeyphoto',
+            index=models.Index(fields=['timeline', 'photo_taken_at'], name='membership_timeline_taken'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='timelinekeyphoto',
+            unique_together={('timeline', 'key_photo')},
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2 on 2026-10-18 17:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timelines', '0020_timelinekeyphoto'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='keyphoto',
+            name='s3_path',
+            field=models.CharField(db_index=True, max_length=500),
+        ),
+        migrations.AlterField(
+            model_name='timelapse',
+            name='s3_path',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=500),
+        ),
+        migrations.AddIndex(
+            model_name='keyphoto',
+            index=models.Index(condition=models.Q(('is_deleted', True)), fields=['updated'], name='keyphoto_deleted_updated'),
+        ),
+    ]
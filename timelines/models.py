@@ -9,6 +9,7 @@ class Timeline(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timelines')
     name = models.CharField(max_length=100)
     # settings = models.JSONField()
+    key_photos = models.ManyToManyField('KeyPhoto', through='TimelineKeyPhoto', related_name='timelines', blank=True)
 
     updated = models.DateTimeField(auto_now=True)
     created = models.DateTimeField(auto_now_add=True)
@@ -19,6 +20,10 @@ class Timeline(models.Model):
 
     class Meta:
         unique_together = ['user', 'name']
+        indexes = [
+            models.Index(fields=['user', 'is_deleted', 'created'], name='timeline_user_deleted_created'),
+            models.Index(fields=['user', 'updated', 'id'], name='timeline_user_updated_id'),
+        ]
 
 
 class TimelineType(models.Model):
@@ -30,15 +35,30 @@ class TimelineType(models.Model):
 
 class KeyPhoto(models.Model):
     """Model for storing key photos with weight data"""
+
+    # Upload state: async uploads stay pending until a worker has stored the object in S3
+    STATUS_PENDING = 'pending'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_READY, 'Ready'),
+        (STATUS_FAILED, 'Failed'),
+    ]
     
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='key_photos', null=True, blank=True)
     filename = models.CharField(max_length=255)
-    s3_path = models.CharField(max_length=500)
-    presigned_url = models.URLField(max_length=500)  # Temporary file link
+    s3_path = models.CharField(max_length=500, db_index=True)  # reconcile_s3_objects reads it by prefix
+    presigned_url = models.URLField(max_length=500, blank=True, default='')  # Unused, urls are signed on demand
     uploaded_at = models.DateTimeField(auto_now_add=True)
     photo_taken_at = models.DateTimeField()
     weight_centigrams = models.IntegerField()
     file_size = models.BigIntegerField(null=True, blank=True)
+    original_file_size = models.BigIntegerField(null=True, blank=True)  # as uploaded, before normalisation
+    content_hash = models.CharField(max_length=64, blank=True, default='')  # hex SHA-256 of the uploaded bytes
+    # Resized copies by longest side, e.g. {"512": {"s3_path": ..., "width": ..., "height": ..., "file_size": ...}}
+    derivatives = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_READY)
     is_deleted = models.BooleanField(default=False)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
@@ -54,11 +74,189 @@ class KeyPhoto(models.Model):
     def weight_kg(self):
         return self.weight_centigrams / 1000
     
+    @classmethod
+    def find_duplicate(cls, user, content_hash):
+        """The user's live KeyPhoto with the same content, if any"""
+        if not content_hash:
+            return None
+        return (
+            cls.objects
+            .filter(user=user, content_hash=content_hash, is_deleted=False)
+            .exclude(status=cls.STATUS_FAILED)
+            .order_by('id')
+            .first()
+        )
+
+    def get_s3_path(self, size=None):
+        """S3 key of the requested derivative size, falling back to the original"""
+        return self.s3_path_for_size(self.s3_path, self.derivatives, size)
+
+    @staticmethod
+    def s3_path_for_size(s3_path, derivatives, size=None):
+        """get_s3_path for column values, e.g. rows of .values()"""
+        derivative = derivatives.get(str(size)) if size else None
+        return derivative['s3_path'] if derivative else s3_path
+
+    def get_s3_paths(self):
+        """S3 keys of the original and every derivative"""
+        return self.s3_paths_for(self.s3_path, self.derivatives)
+
+    @staticmethod
+    def s3_paths_for(s3_path, derivatives):
+        """get_s3_paths for column values"""
+        return [s3_path, *(derivative['s3_path'] for derivative in derivatives.values())]
+
     @classmethod
     def generate_random_weight(cls):
         return random.randint(700, 850)
 
     class Meta:
         unique_together = ['user', 'filename']
+        indexes = [
+            models.Index(fields=['user', 'is_deleted', 'created'], name='keyphoto_user_deleted_created'),
+            models.Index(fields=['user', 'content_hash'], name='keyphoto_user_content_hash'),
+            models.Index(fields=['user', 'updated', 'id'], name='keyphoto_user_updated_id'),
+            # Soft-deleted rows waiting for purge_deleted_keyphotos
+            models.Index(fields=['updated'], condition=models.Q(is_deleted=True), name='keyphoto_deleted_updated'),
+        ]
+
+
+
+
+class WeightRollup(models.Model):
+    """
+    Pre-aggregated KeyPhoto weights per user and calendar period, kept up to
+    date by timelines.rollups whenever a KeyPhoto changes.
+    """
+
+    PERIOD_DAY = 'day'
+    PERIOD_WEEK = 'week'
+    PERIOD_MONTH = 'month'
+    PERIOD_CHOICES = [
+        (PERIOD_DAY, 'Day'),
+        (PERIOD_WEEK, 'Week'),
+        (PERIOD_MONTH, 'Month'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='weight_rollups')
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    count = models.IntegerField()
+    sum_centigrams = models.BigIntegerField()
+    min_centigrams = models.IntegerField()
+    max_centigrams = models.IntegerField()
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.period} {self.period_start}"
+
+    @property
+    def avg_centigrams(self):
+        return self.sum_centigrams / self.count
+
+    class Meta:
+        unique_together = ['user', 'period', 'period_start']
+
+
+class TimelineKeyPhoto(models.Model):
+    """
+    Membership of a KeyPhoto in a Timeline. photo_taken_at is copied from the
+    KeyPhoto (and kept in sync by timelines.signals) so a date window of one
+    timeline is a range scan on this table's index.
+    """
+
+    timeline = models.ForeignKey(Timeline, on_delete=models.CASCADE, related_name='memberships')
+    key_photo = models.ForeignKey(KeyPhoto, on_delete=models.CASCADE, related_name='timeline_memberships')
+    position = models.IntegerField()
+    photo_taken_at = models.DateTimeField()
+    created = models.DateTimeField(auto_now_add=True)
 
+    def __str__(self):
+        return f"{self.timeline} - #{self.position} KeyPhoto {self.key_photo_id}"
+
+    class Meta:
+        unique_together = ['timeline', 'key_photo']
+        indexes = [
+            models.Index(fields=['timeline', 'position'], name='membership_timeline_position'),
+            models.Index(fields=['timeline', 'photo_taken_at'], name='membership_timeline_taken'),
+        ]
+
+
+class Timelapse(models.Model):
+    """
+    Rendered progress video of a user's KeyPhotos. Renders are keyed by a hash
+    of the input photos and options, so asking again for the same set returns
+    the existing render.
+    """
+
+    STATUS_PENDING = 'pending'
+    STATUS_RENDERING = 'rendering'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RENDERING, 'Rendering'),
+        (STATUS_READY, 'Ready'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    FORMAT_WEBP = 'webp'
+    FORMAT_MP4 = 'mp4'
+    FORMAT_CHOICES = [
+        (FORMAT_WEBP, 'Animated WebP'),
+        (FORMAT_MP4, 'MP4'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timelapses')
+    input_hash = models.CharField(max_length=64)  # hex SHA-256 of the photo set and render options
+    format = models.CharField(max_length=4, choices=FORMAT_CHOICES)
+    key_photo_ids = models.JSONField(default=list)  # in frame order
+    photos_rendered = models.IntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    s3_path = models.CharField(max_length=500, blank=True, default='', db_index=True)
+    file_size = models.BigIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} - Timelapse {self.id} ({self.status})"
 
+    @property
+    def progress(self):
+        """Share of photos rendered, 0.0 - 1.0"""
+        if self.status == self.STATUS_READY:
+            return 1.0
+        if not self.key_photo_ids:
+            return 0.0
+        return self.photos_rendered / len(self.key_photo_ids)
+
+    class Meta:
+        unique_together = ['user', 'input_hash']
+
+
+class Tombstone(models.Model):
+    """
+    Record of a hard-deleted KeyPhoto or Timeline, so the sync/ feed can tell
+    clients about rows that no longer exist.
+    """
+
+    KIND_KEYPHOTO = 'keyphoto'
+    KIND_TIMELINE = 'timeline'
+    KIND_CHOICES = [
+        (KIND_KEYPHOTO, 'KeyPhoto'),
+        (KIND_TIMELINE, 'Timeline'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tombstones')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user.username} - deleted {self.kind} {self.object_id}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created', 'id'], name='tombstone_user_created_id'),
+        ]
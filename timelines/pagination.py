@@ -0,0 +1,13 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedCursorPagination(CursorPagination):
+    """
+    Keyset pagination over (-created, id) for a user's history.
+
+    Unlike page numbers, each page is a range scan from the cursor position,
+    so the cost of a page does not grow with the size of the history.
+    """
+    ordering = ('-created', 'id')
+    page_size_query_param = 'page_size'
+    max_page_size = 200
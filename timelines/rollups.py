@@ -0,0 +1,189 @@
+"""
+Incremental maintenance of WeightRollup rows.
+
+When a KeyPhoto changes only the day it belongs to is re-aggregated from raw
+rows; the week and month containing that day are then re-aggregated from the
+(at most 31) day rollups, so the cost of an update doesn't depend on how long
+the user's history is.
+
+Refreshes run once the transaction that changed the photos commits, so they
+read committed rows, and take a lock on the user row, so two refreshes of one
+user's rollups never interleave.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from timelines.models import KeyPhoto, WeightRollup
+
+# A refresh that loses a race inserting the same rollup row is simply run again
+REFRESH_ATTEMPTS = 3
+
+
+def local_date(value):
+    """Calendar day of a datetime in the current time zone"""
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return timezone.localtime(value).date()
+
+
+def local_day_start(day):
+    """Aware datetime of midnight starting `day` in the current time zone"""
+    return timezone.make_aware(datetime.combine(day, time.min), timezone.get_current_timezone())
+
+
+def period_start(day, period):
+    if period == WeightRollup.PERIOD_WEEK:
+        return day - timedelta(days=day.weekday())
+    if period == WeightRollup.PERIOD_MONTH:
+        return day.replace(day=1)
+    return day
+
+
+def period_end(start, period):
+    """First day after the period beginning at `start`"""
+    if period == WeightRollup.PERIOD_WEEK:
+        return start + timedelta(days=7)
+    if period == WeightRollup.PERIOD_MONTH:
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def rollup_source(user_id):
+    """KeyPhotos that count towards a user's weight rollups"""
+    return (
+        KeyPhoto.objects
+        .filter(user_id=user_id, is_deleted=False)
+        .exclude(status=KeyPhoto.STATUS_FAILED)
+    )
+
+
+def _save_rollup(user_id, period, start, stats):
+    if not stats['count']:
+        WeightRollup.objects.filter(user_id=user_id, period=period, period_start=start).delete()
+        return
+    WeightRollup.objects.update_or_create(
+        user_id=user_id,
+        period=period,
+        period_start=start,
+        defaults={
+            'count': stats['count'],
+            'sum_centigrams': stats['sum_centigrams'],
+            'min_centigrams': stats['min_centigrams'],
+            'max_centigrams': stats['max_centigrams'],
+        },
+    )
+
+
+def _refresh_day(user_id, day):
+    start = local_day_start(day)
+    end = local_day_start(day + timedelta(days=1))
+    stats = rollup_source(user_id).filter(
+        photo_taken_at__gte=start,
+        photo_taken_at__lt=end,
+    ).aggregate(
+        count=Count('id'),
+        sum_centigrams=Sum('weight_centigrams'),
+        min_centigrams=Min('weight_centigrams'),
+        max_centigrams=Max('weight_centigrams'),
+    )
+    _save_rollup(user_id, WeightRollup.PERIOD_DAY, day, stats)
+
+
+def _refresh_from_days(user_id, period, start):
+    stats = WeightRollup.objects.filter(
+        user_id=user_id,
+        period=WeightRollup.PERIOD_DAY,
+        period_start__gte=start,
+        period_start__lt=period_end(start, period),
+    ).aggregate(
+        count=Sum('count'),
+        sum_centigrams=Sum('sum_centigrams'),
+        min_centigrams=Min('min_centigrams'),
+        max_centigrams=Max('max_centigrams'),
+    )
+    _save_rollup(user_id, period, start, stats)
+
+
+def refresh_weight_rollups(user_id, days):
+    """Brings the day, week and month rollups covering `days` up to date"""
+    days = set(days)
+    for attempt in range(1, REFRESH_ATTEMPTS + 1):
+        try:
+            with transaction.atomic():
+                # Serializes refreshes of the same user's rollups
+                list(get_user_model().objects.select_for_update().filter(pk=user_id).values_list('pk'))
+                for day in days:
+                    _refresh_day(user_id, day)
+                for period in (WeightRollup.PERIOD_WEEK, WeightRollup.PERIOD_MONTH):
+                    for start in {period_start(day, period) for day in days}:
+                        _refresh_from_days(user_id, period, start)
+            return
+        except IntegrityError:
+            if attempt == REFRESH_ATTEMPTS:
+                raise
+
+
+def refresh_rollup_days(days):
+    """Refreshes rollups for a set of (user_id, day) pairs once the current transaction commits"""
+    by_user = {}
+    for user_id, day in days:
+        by_user.setdefault(user_id, set()).add(day)
+    if not by_user:
+        return
+
+    def refresh():
+        for user_id, user_days in by_user.items():
+            refresh_weight_rollups(user_id, user_days)
+
+    # A failed refresh is logged, not raised at whoever committed; rebuild_weight_rollups repairs it
+    transaction.on_commit(refresh, robust=True)
+
+
+def rebuild_weight_rollups(user_ids=None):
+    """
+    Recomputes all rollups from scratch with one grouped query over KeyPhoto.
+    Returns the number of rollup rows written.
+    """
+    key_photos = KeyPhoto.objects.filter(is_deleted=False, user__isnull=False).exclude(status=KeyPhoto.STATUS_FAILED)
+    rollups = WeightRollup.objects.all()
+    if user_ids is not None:
+        key_photos = key_photos.filter(user_id__in=user_ids)
+        rollups = rollups.filter(user_id__in=user_ids)
+
+    day_stats = (
+        key_photos
+        .annotate(day=TruncDate('photo_taken_at'))
+        .values('user_id', 'day')
+        .annotate(
+            count=Count('id'),
+            sum_centigrams=Sum('weight_centigrams'),
+            min_centigrams=Min('weight_centigrams'),
+            max_centigrams=Max('weight_centigrams'),
+        )
+        .order_by()
+    )
+
+    buckets = defaultdict(lambda: {'count': 0, 'sum_centigrams': 0, 'min_centigrams': None, 'max_centigrams': None})
+    for row in day_stats:
+        for period in (WeightRollup.PERIOD_DAY, WeightRollup.PERIOD_WEEK, WeightRollup.PERIOD_MONTH):
+            bucket = buckets[(row['user_id'], period, period_start(row['day'], period))]
+            bucket['count'] += row['count']
+            bucket['sum_centigrams'] += row['sum_centigrams']
+            if bucket['min_centigrams'] is None or row['min_centigrams'] < bucket['min_centigrams']:
+                bucket['min_centigrams'] = row['min_centigrams']
+            if bucket['max_centigrams'] is None or row['max_centigrams'] > bucket['max_centigrams']:
+                bucket['max_centigrams'] = row['max_centigrams']
+
+    with transaction.atomic():
+        rollups.delete()
+        WeightRollup.objects.bulk_create([
+            WeightRollup(user_id=user_id, period=period, period_start=start, **stats)
+            for (user_id, period, start), stats in buckets.items()
+        ], batch_size=1000)
+    return len(buckets)
@@ -1,6 +1,9 @@
 from rest_framework import serializers
-from .models import TimelineType, Timeline, KeyPhoto
+from .models import TimelineType, Timeline, KeyPhoto, WeightRollup, Timelapse
 from datetime import datetime
+from django.conf import settings
+from django.db import models
+from .storage import get_presigned_url, get_presigned_urls
 
 class TimelineTypeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -8,10 +11,22 @@ class TimelineTypeSerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
 
 
-class NewTimelineSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """Accepts a `fields` argument to serialize only a subset of the fields"""
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+
+class NewTimelineSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Timeline
-        fields = ['name']
+        fields = ['id', 'user', 'name', 'created', 'updated', 'is_deleted']
+        read_only_fields = ['id', 'user', 'created', 'updated', 'is_deleted']
 
     def create(self, validated_data):
         # Automatically add the current user
@@ -20,31 +35,175 @@ class NewTimelineSerializer(serializers.ModelSerializer):
         return timeline
 
 
-class KeyPhotoSerializer(serializers.ModelSerializer):
+class KeyPhotoListSerializer(serializers.ListSerializer):
+    """Signs (or fetches from cache) the presigned urls of the whole list at once"""
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        iterable = list(iterable)
+        if 'presigned_url' in self.child.fields:
+            size = self.child.context.get('size')
+            self.child.presigned_urls = get_presigned_urls([obj.get_s3_path(size) for obj in iterable])
+        return super().to_representation(iterable)
+
+
+class KeyPhotoSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for KeyPhoto model"""
     
     # Fields for creation (from POST request)
     photo_taken_at = serializers.DateTimeField()
     weight_centigrams = serializers.IntegerField(required=False)  # Optional field
+
+    # Generated at serialization time, never stored. Points at the derivative
+    # chosen with context['size'] when it exists, otherwise at the original.
+    presigned_url = serializers.SerializerMethodField()
     
     class Meta:
         model = KeyPhoto
+        list_serializer_class = KeyPhotoListSerializer
         fields = [
             'id', 'user', 'filename', 's3_path', 'presigned_url', 'uploaded_at', 'photo_taken_at',
-            'weight_centigrams', 'file_size', 'created', 'updated', 'is_deleted'
+            'weight_centigrams', 'file_size', 'original_file_size', 'content_hash', 'derivatives', 'status',
+            'created', 'updated', 'is_deleted'
         ]
         read_only_fields = [
-            'id', 'user', 'uploaded_at', 'created', 'updated'
+            'id', 'user', 'uploaded_at', 'original_file_size', 'derivatives', 'status', 'created', 'updated'
         ]
     
+    def get_presigned_url(self, obj):
+        s3_path = obj.get_s3_path(self.context.get('size'))
+        presigned_urls = getattr(self, 'presigned_urls', None) or {}
+        if s3_path in presigned_urls:
+            return presigned_urls[s3_path]
+        return get_presigned_url(s3_path)
+
     def create(self, validated_data):
         """Create a new KeyPhoto object"""
         # Automatically add the current user
         validated_data['user'] = self.context['request'].user
+        if 'status' in self.context:
+            validated_data['status'] = self.context['status']
         
         # If weight is not provided, generate a random one
         if 'weight_centigrams' not in validated_data:
             validated_data['weight_centigrams'] = KeyPhoto.generate_random_weight()
         
         # Other fields will be filled in the view
-        return KeyPhoto.objects.create(**validated_data)
\ No newline at end of file
+        return KeyPhoto.objects.create(**validated_data)
+
+class KeyPhotoUploadInitiateSerializer(serializers.Serializer):
+    """Input for starting a direct-to-S3 KeyPhoto upload"""
+
+    filename = serializers.CharField(max_length=255)
+    content_type = serializers.CharField(max_length=100)
+    file_size = serializers.IntegerField(min_value=1)
+    # Optional hex SHA-256 of the file, lets the server answer "already have it"
+    content_hash = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False)
+
+    def validate_content_hash(self, value):
+        return value.lower()
+
+    def validate_content_type(self, value):
+        if not value.startswith('image/'):
+            raise serializers.ValidationError("File must be an image")
+        return value
+
+    def validate_file_size(self, value):
+        if value > settings.KEYPHOTO_MAX_UPLOAD_SIZE:
+            raise serializers.ValidationError(
+                f"File is too large (max {settings.KEYPHOTO_MAX_UPLOAD_SIZE} bytes)"
+            )
+        return value
+
+
+class UploadedPartSerializer(serializers.Serializer):
+    part_number = serializers.IntegerField(min_value=1, max_value=10000)
+    etag = serializers.CharField(max_length=100)
+
+
+class KeyPhotoUploadCompleteSerializer(serializers.Serializer):
+    """Input for finishing a direct-to-S3 KeyPhoto upload"""
+
+    upload_token = serializers.CharField()
+    photo_taken_at = serializers.DateTimeField()
+    weight_centigrams = serializers.IntegerField(required=False)
+    parts = UploadedPartSerializer(many=True, required=False)
+
+
+class WeightAnalyticsQuerySerializer(serializers.Serializer):
+    """Query parameters of the weights/ endpoint"""
+
+    period = serializers.ChoiceField(choices=WeightRollup.PERIOD_CHOICES, default=WeightRollup.PERIOD_DAY)
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    window = serializers.IntegerField(min_value=1, max_value=365, default=7)
+
+    def validate(self, attrs):
+        if attrs.get('start') and attrs.get('end') and attrs['start'] > attrs['end']:
+            raise serializers.ValidationError("start must not be after end")
+        return attrs
+
+
+class TimelineKeyPhotosQuerySerializer(serializers.Serializer):
+    """Query parameters of the timeline/<pk>/keyphotos/ endpoint"""
+
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        if attrs.get('start') and attrs.get('end') and attrs['start'] > attrs['end']:
+            raise serializers.ValidationError("start must not be after end")
+        return attrs
+
+
+class TimelineKeyPhotoIdsSerializer(serializers.Serializer):
+    """KeyPhoto ids for bulk add/remove/reorder on a Timeline"""
+
+    key_photo_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.TIMELINE_BULK_MAX_KEYPHOTOS,
+    )
+
+    def validate_key_photo_ids(self, value):
+        if len(set(value)) != len(value):
+            raise serializers.ValidationError("Ids must be unique")
+        return value
+
+
+class TimelapseRequestSerializer(serializers.Serializer):
+    """Input for rendering a timelapse"""
+
+    format = serializers.ChoiceField(choices=Timelapse.FORMAT_CHOICES, required=False)
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        if attrs.get('start') and attrs.get('end') and attrs['start'] > attrs['end']:
+            raise serializers.ValidationError("start must not be after end")
+        attrs.setdefault('format', settings.TIMELAPSE_FORMAT)
+        return attrs
+
+
+class TimelapseSerializer(serializers.ModelSerializer):
+    """Serializer for Timelapse model, url is only set once the render is ready"""
+
+    photo_count = serializers.SerializerMethodField()
+    progress = serializers.FloatField(read_only=True)
+    url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Timelapse
+        fields = [
+            'id', 'format', 'status', 'photo_count', 'photos_rendered', 'progress', 'url', 'file_size',
+            'error', 'created', 'updated'
+        ]
+        read_only_fields = fields
+
+    def get_photo_count(self, obj):
+        return len(obj.key_photo_ids)
+
+    def get_url(self, obj):
+        if obj.status != Timelapse.STATUS_READY:
+            return None
+        return get_presigned_url(obj.s3_path)
@@ -0,0 +1,80 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from timelines import versioning
+from timelines.models import KeyPhoto, Timeline, TimelineKeyPhoto, Tombstone
+from timelines.rollups import local_date, refresh_rollup_days
+
+# Saves that don't touch these fields can't change any weight rollup
+ROLLUP_FIELDS = {'user', 'photo_taken_at', 'weight_centigrams', 'is_deleted', 'status'}
+
+
+def _affects_rollups(update_fields):
+    return update_fields is None or bool(ROLLUP_FIELDS & set(update_fields))
+
+
+@receiver(pre_save, sender=KeyPhoto)
+def remember_rollup_day(sender, instance, raw, update_fields, **kwargs):
+    """Keeps the (user, day) the photo counted towards before this save"""
+    instance._previous_rollup_day = None
+    if raw or instance.pk is None or not _affects_rollups(update_fields):
+        return
+    previous = KeyPhoto.objects.filter(pk=instance.pk).values('user_id', 'photo_taken_at').first()
+    if previous and previous['user_id']:
+        instance._previous_rollup_day = (previous['user_id'], local_date(previous['photo_taken_at']))
+
+
+@receiver(post_save, sender=KeyPhoto)
+def update_rollups_on_save(sender, instance, raw, update_fields, **kwargs):
+    if raw or not _affects_rollups(update_fields):
+        return
+    days = set()
+    if instance.user_id:
+        days.add((instance.user_id, local_date(instance.photo_taken_at)))
+    if instance._previous_rollup_day:
+        days.add(instance._previous_rollup_day)
+    refresh_rollup_days(days)
+
+
+@receiver(post_delete, sender=KeyPhoto)
+def update_rollups_on_delete(sender, instance, **kwargs):
+    if instance.user_id:
+        refresh_rollup_days({(instance.user_id, local_date(instance.photo_taken_at))})
+
+
+@receiver(post_save, sender=KeyPhoto)
+def sync_membership_dates(sender, instance, raw, created, update_fields, **kwargs):
+    """Keeps the copy of photo_taken_at on TimelineKeyPhoto rows current"""
+    if raw or created or (update_fields is not None and 'photo_taken_at' not in update_fields):
+        return
+    TimelineKeyPhoto.objects.filter(key_photo=instance).exclude(
+        photo_taken_at=instance.photo_taken_at
+    ).update(photo_taken_at=instance.photo_taken_at)
+
+
+@receiver(post_save, sender=KeyPhoto)
+@receiver(post_delete, sender=KeyPhoto)
+def bump_keyphotos_version(sender, instance, **kwargs):
+    versioning.bump_collection_version(instance.user_id, versioning.KEYPHOTOS)
+
+
+@receiver(post_save, sender=Timeline)
+@receiver(post_delete, sender=Timeline)
+def bump_timelines_version(sender, instance, **kwargs):
+    versioning.bump_collection_version(instance.user_id, versioning.TIMELINES)
+
+
+def _deleted_directly(origin, sender):
+    """False when the row goes away as part of deleting something else, e.g. its user"""
+    origin_model = getattr(origin, 'model', None) or type(origin)
+    return origin is None or origin_model is sender
+
+
+@receiver(post_delete, sender=KeyPhoto)
+@receiver(post_delete, sender=Timeline)
+def record_tombstone(sender, instance, origin=None, **kwargs):
+    """Lets sync/ clients learn about hard deletes"""
+    if not instance.user_id or not _deleted_directly(origin, sender):
+        return
+    kind = Tombstone.KIND_KEYPHOTO if sender is KeyPhoto else Tombstone.KIND_TIMELINE
+    Tombstone.objects.create(user_id=instance.user_id, kind=kind, object_id=instance.pk)
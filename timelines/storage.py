@@ -0,0 +1,212 @@
+"""
+Shared S3 client for the timelines app.
+
+boto3 clients are thread-safe, but building one costs tens of milliseconds
+and every new client opens its own connection pool (and TLS handshakes).
+All S3 call sites go through get_s3_client(), which builds a single client
+per process with a connection pool tuned from settings.
+
+Presigned GET urls are generated on demand and kept in Django's cache a bit
+shorter than the signature lifetime, so list endpoints don't re-sign (or
+store) a url per photo.
+"""
+import hashlib
+import threading
+
+import boto3
+from botocore.config import Config
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from gymguru.instrumentation import instrument_s3_client, timed
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _build_client():
+    config = Config(
+        region_name=settings.AWS_REGION,
+        max_pool_connections=settings.AWS_S3_MAX_POOL_CONNECTIONS,
+        connect_timeout=settings.AWS_S3_CONNECT_TIMEOUT,
+        read_timeout=settings.AWS_S3_READ_TIMEOUT,
+        tcp_keepalive=settings.AWS_S3_TCP_KEEPALIVE,
+        retries={
+            'mode': settings.AWS_S3_RETRY_MODE,
+            'max_attempts': settings.AWS_S3_MAX_ATTEMPTS,
+        },
+    )
+    # boto3.client() uses the shared default session, which is not thread-safe
+    session = boto3.session.Session(
+        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        region_name=settings.AWS_REGION,
+    )
+    client = session.client('s3', endpoint_url=settings.AWS_S3_ENDPOINT_URL, config=config)
+    return instrument_s3_client(client)
+
+
+def get_s3_client():
+    """Return the process-wide S3 client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build_client()
+    return _client
+
+
+def reset_s3_client():
+    """Drop the cached client so the next call builds a new one"""
+    global _client
+    with _client_lock:
+        _client = None
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(sender, setting, **kwargs):
+    if setting.startswith('AWS_'):
+        reset_s3_client()
+
+
+def pool_stats():
+    """
+    Connection pool counters of the shared client.
+
+    A healthy pool under load shows requests growing much faster than
+    connections_created, i.e. connections are being reused.
+    """
+    stats = {
+        'client_created': _client is not None,
+        'max_pool_connections': settings.AWS_S3_MAX_POOL_CONNECTIONS,
+        'pools': 0,
+        'connections_created': 0,
+        'requests': 0,
+    }
+    if _client is None:
+        return stats
+
+    http_session = getattr(_client._endpoint, 'http_session', None)
+    managers = [getattr(http_session, '_manager', None)]
+    managers += list(getattr(http_session, '_proxy_managers', {}).values())
+    for manager in managers:
+        if manager is None:
+            continue
+        for key in list(manager.pools.keys()):
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            stats['pools'] += 1
+            stats['connections_created'] += pool.num_connections
+            stats['requests'] += pool.num_requests
+
+    if stats['requests']:
+        stats['reuse_ratio'] = round(1 - stats['connections_created'] / stats['requests'], 3)
+    return stats
+
+
+def _presigned_url_cache_key(s3_path):
+    digest = hashlib.sha1(f'{settings.AWS_STORAGE_BUCKET_NAME}/{s3_path}'.encode()).hexdigest()
+    return f'keyphoto-url:{digest}'
+
+
+def _presigned_url_cache_timeout():
+    # Expire cache entries before the signature itself so clients never get a dead link
+    return max(settings.KEYPHOTO_PRESIGNED_URL_EXPIRES - settings.KEYPHOTO_PRESIGNED_URL_CACHE_MARGIN, 1)
+
+
+def _sign_get_url(s3_path):
+    with timed('sign'):
+        return get_s3_client().generate_presigned_url(
+            'get_object',
+            Params={'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Key': s3_path},
+            ExpiresIn=settings.KEYPHOTO_PRESIGNED_URL_EXPIRES
+        )
+
+
+def get_presigned_url(s3_path):
+    """Presigned GET url for an object, served from cache while still valid"""
+    return get_presigned_urls([s3_path])[s3_path]
+
+
+def get_presigned_urls(s3_paths):
+    """
+    Presigned GET urls for many objects at once: one cache round trip for
+    the whole batch, signing only the paths that are missing.
+    """
+    keys = {_presigned_url_cache_key(s3_path): s3_path for s3_path in s3_paths}
+    cached = cache.get_many(keys.keys())
+    urls = {keys[key]: url for key, url in cached.items()}
+
+    missing = {}
+    for key, s3_path in keys.items():
+        if s3_path not in urls:
+            urls[s3_path] = missing[key] = _sign_get_url(s3_path)
+    if missing:
+        cache.set_many(missing, timeout=_presigned_url_cache_timeout())
+    return urls
+
+
+def object_metadata_cache_key(s3_path):
+    digest = hashlib.sha1(f'{settings.AWS_STORAGE_BUCKET_NAME}/{s3_path}'.encode()).hexdigest()
+    return f'keyphoto-meta:{digest}'
+
+
+def get_object_metadata(s3_path):
+    """
+    ETag, Last-Modified, size and content type of an object.
+
+    KeyPhoto objects are written once under a unique name, so the HEAD
+    result is cached and revalidations can be answered without S3.
+    Raises ClientError if the object does not exist.
+    """
+    key = object_metadata_cache_key(s3_path)
+    metadata = cache.get(key)
+    if metadata is None:
+        head = get_s3_client().head_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=s3_path)
+        metadata = {
+            'etag': head['ETag'],
+            'last_modified': int(head['LastModified'].timestamp()),
+            'content_length': head['ContentLength'],
+            'content_type': head.get('ContentType'),
+        }
+        cache.set(key, metadata, timeout=settings.KEYPHOTO_METADATA_CACHE_TIMEOUT)
+    return metadata
+
+
+# S3 DeleteObjects accepts at most 1000 keys per call
+DELETE_BATCH_SIZE = 1000
+
+
+def delete_objects(s3_paths):
+    """
+    Deletes objects in DeleteObjects batches. Missing keys count as deleted;
+    returns (key, message) of the keys S3 refused to delete.
+    """
+    s3_paths = list(s3_paths)
+    errors = []
+    for i in range(0, len(s3_paths), DELETE_BATCH_SIZE):
+        response = get_s3_client().delete_objects(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+            Delete={
+                'Objects': [{'Key': key} for key in s3_paths[i:i + DELETE_BATCH_SIZE]],
+                'Quiet': True,
+            }
+        )
+        errors.extend((error['Key'], error.get('Message')) for error in response.get('Errors', []))
+    return errors
+
+
+def sha256_file(fileobj, chunk_size=1024 * 1024):
+    """
+    Hex SHA-256 of a Django File (or any file object), read in chunks so
+    large uploads are never loaded into memory. Rewinds the file afterwards.
+    """
+    digest = hashlib.sha256()
+    chunks = fileobj.chunks(chunk_size) if hasattr(fileobj, 'chunks') else iter(lambda: fileobj.read(chunk_size), b'')
+    for chunk in chunks:
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
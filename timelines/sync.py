@@ -0,0 +1,100 @@
+"""
+Change feed behind the sync/ endpoint.
+
+Each collection is read as a keyset scan over (user, updated, id) starting
+after the position stored in the client's token, so a sync costs as much as
+the number of changes since the last one rather than the size of the
+library. Hard deletes are read the same way from Tombstone rows.
+"""
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+from django.utils import timezone
+
+from timelines.models import KeyPhoto, Timeline, Tombstone
+
+SYNC_TOKEN_SALT = 'timelines.sync'
+
+KEYPHOTOS = 'keyphotos'
+TIMELINES = 'timelines'
+TOMBSTONES = 'tombstones'
+
+# Position before every row: (ordering field value, id)
+START = [None, 0]
+
+
+def decode_token(token):
+    """Cursor per collection from a sync token, raises signing.BadSignature if invalid"""
+    if not token:
+        return {KEYPHOTOS: START, TIMELINES: START, TOMBSTONES: START}
+    cursors = signing.loads(token, salt=SYNC_TOKEN_SALT)
+    try:
+        return {
+            name: [datetime.fromisoformat(cursors[name][0]) if cursors[name][0] else None, int(cursors[name][1])]
+            for name in (KEYPHOTOS, TIMELINES, TOMBSTONES)
+        }
+    except (KeyError, IndexError, TypeError, ValueError):
+        raise signing.BadSignature('Malformed sync token')
+
+
+def encode_token(cursors):
+    return signing.dumps(
+        {name: [value.isoformat() if value else None, last_id] for name, (value, last_id) in cursors.items()},
+        salt=SYNC_TOKEN_SALT,
+    )
+
+
+def _changes_after(queryset, field, cursor, limit):
+    """
+    Up to `limit` rows ordered by (field, id) after `cursor`.
+    Returns (rows, new cursor, has_more).
+    """
+    value, last_id = cursor
+    if value is not None:
+        queryset = queryset.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': last_id}))
+    rows = list(queryset.order_by(field, 'id')[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if rows:
+        cursor = [getattr(rows[-1], field), rows[-1].id]
+    if not has_more:
+        # `updated` is set before commit, so a slow transaction can commit a
+        # row older than one already returned. Never move the cursor past
+        # the settle window; rows inside it are sent again next time.
+        settled = timezone.now() - timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+        if cursor[0] is not None and cursor[0] > settled:
+            cursor = [settled, 0]
+    return rows, cursor, has_more
+
+
+def changes_since(user, token):
+    """
+    KeyPhotos and Timelines (soft-deleted ones included) changed after the
+    token, plus ids of hard-deleted ones. Changes inside the settle window may
+    be delivered more than once.
+    """
+    cursors = decode_token(token)
+    limit = settings.SYNC_PAGE_SIZE
+
+    key_photos, cursors[KEYPHOTOS], more_key_photos = _changes_after(
+        KeyPhoto.objects.filter(user=user), 'updated', cursors[KEYPHOTOS], limit
+    )
+    timelines, cursors[TIMELINES], more_timelines = _changes_after(
+        Timeline.objects.filter(user=user), 'updated', cursors[TIMELINES], limit
+    )
+    tombstones, cursors[TOMBSTONES], more_tombstones = _changes_after(
+        Tombstone.objects.filter(user=user), 'created', cursors[TOMBSTONES], limit
+    )
+
+    return {
+        'key_photos': key_photos,
+        'timelines': timelines,
+        'deleted': {
+            KEYPHOTOS: [t.object_id for t in tombstones if t.kind == Tombstone.KIND_KEYPHOTO],
+            TIMELINES: [t.object_id for t in tombstones if t.kind == Tombstone.KIND_TIMELINE],
+        },
+        'next': encode_token(cursors),
+        'has_more': more_key_photos or more_timelines or more_tombstones,
+    }
@@ -0,0 +1,238 @@
+import io
+import logging
+import os
+import shutil
+import tempfile
+
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import BotoCoreError, ClientError
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from timelines.ingest import normalize_image, with_extension
+from timelines.models import KeyPhoto, Timelapse
+from timelines.storage import get_s3_client
+from timelines.timelapse import CONTENT_TYPES, write_timelapse
+
+logger = logging.getLogger(__name__)
+
+# Originals up to this size are kept in memory, larger ones spill to disk
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+DERIVATIVE_CONTENT_TYPES = {
+    'WEBP': 'image/webp',
+    'JPEG': 'image/jpeg',
+}
+
+
+def schedule_derivatives(key_photo):
+    """Queue derivative generation once the KeyPhoto row is committed"""
+    transaction.on_commit(lambda: generate_keyphoto_derivatives.delay(key_photo.id))
+
+
+def derivative_s3_path(s3_path, size, image_format):
+    extension = 'jpg' if image_format == 'JPEG' else image_format.lower()
+    return f"{os.path.splitext(s3_path)[0]}_{size}.{extension}"
+
+
+def encode_image(image, image_format, quality):
+    """Encodes a PIL image to bytes in the given format"""
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    output = io.BytesIO()
+    image.save(output, format=image_format, quality=quality)
+    return output.getvalue()
+
+
+@shared_task(
+    autoretry_for=(ClientError,),
+    retry_backoff=True,
+    retry_kwargs={'max_retries': 5},
+)
+def generate_keyphoto_derivatives(key_photo_id, force=False):
+    """
+    Produces resized copies of a KeyPhoto for every KEYPHOTO_DERIVATIVE_SIZES
+    entry and stores them next to the original in S3.
+    """
+    try:
+        key_photo = KeyPhoto.objects.get(pk=key_photo_id)
+    except KeyPhoto.DoesNotExist:
+        return None
+    if key_photo.is_deleted:
+        return None
+
+    sizes = sorted(settings.KEYPHOTO_DERIVATIVE_SIZES, reverse=True)
+    if not force and all(str(size) in key_photo.derivatives for size in sizes):
+        return key_photo.derivatives
+
+    s3_client = get_s3_client()
+    bucket_name = settings.AWS_STORAGE_BUCKET_NAME
+    image_format = settings.KEYPHOTO_DERIVATIVE_FORMAT
+    quality = settings.KEYPHOTO_DERIVATIVE_QUALITY
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as original:
+        s3_client.download_fileobj(bucket_name, key_photo.s3_path, original)
+        original.seek(0)
+        try:
+            image = Image.open(original)
+            # Lets the JPEG decoder skip detail we are about to throw away
+            image.draft('RGB', (sizes[0], sizes[0]))
+            image = ImageOps.exif_transpose(image)
+        except UnidentifiedImageError:
+            logger.warning('KeyPhoto %s is not a readable image, skipping derivatives', key_photo_id)
+            return None
+
+        # Largest first, so every smaller size is resized from the previous one
+        derivatives = {}
+        for size in sizes:
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            data = encode_image(image, image_format, quality)
+            s3_path = derivative_s3_path(key_photo.s3_path, size, image_format)
+            s3_client.put_object(
+                Bucket=bucket_name,
+                Key=s3_path,
+                Body=data,
+                ContentType=DERIVATIVE_CONTENT_TYPES[image_format]
+            )
+            derivatives[str(size)] = {
+                's3_path': s3_path,
+                'width': image.width,
+                'height': image.height,
+                'file_size': len(data),
+            }
+
+    key_photo.derivatives = derivatives
+    key_photo.save(update_fields=['derivatives', 'updated'])
+    return derivatives
+
+
+def spool_upload(uploaded_file, filename):
+    """
+    Moves an uploaded file into KEYPHOTO_UPLOAD_SPOOL_DIR and returns its path.
+    Large uploads already sit in a temp file and are moved without copying.
+    """
+    spool_dir = settings.KEYPHOTO_UPLOAD_SPOOL_DIR
+    os.makedirs(spool_dir, exist_ok=True)
+    spool_path = os.path.join(spool_dir, filename)
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        shutil.move(uploaded_file.temporary_file_path(), spool_path)
+    else:
+        with open(spool_path, 'wb') as destination:
+            for chunk in uploaded_file.chunks():
+                destination.write(chunk)
+    return spool_path
+
+
+@shared_task(bind=True, max_retries=None)
+def upload_keyphoto_to_s3(self, key_photo_id, spool_path, content_type):
+    """
+    Normalizes a spooled upload and pushes it to S3, then marks the KeyPhoto ready.
+    Retries with exponential backoff and marks it failed when out of retries.
+    """
+    try:
+        key_photo = KeyPhoto.objects.get(pk=key_photo_id)
+    except KeyPhoto.DoesNotExist:
+        _remove_spooled_file(spool_path)
+        return None
+
+    update_fields = ['status', 'updated']
+    try:
+        with open(spool_path, 'rb') as original:
+            normalized = normalize_image(original)
+            upload_file = original
+            if normalized is not None:
+                upload_file, content_type = normalized.file, normalized.content_type
+                key_photo.original_file_size = key_photo.file_size
+                key_photo.file_size = normalized.size
+                key_photo.filename = with_extension(key_photo.filename, normalized.extension)
+                key_photo.s3_path = with_extension(key_photo.s3_path, normalized.extension)
+                update_fields += ['original_file_size', 'file_size', 'filename', 's3_path']
+            with upload_file:
+                get_s3_client().upload_fileobj(
+                    upload_file,
+                    settings.AWS_STORAGE_BUCKET_NAME,
+                    key_photo.s3_path,
+                    ExtraArgs={'ContentType': content_type}
+                )
+    except (ClientError, BotoCoreError, S3UploadFailedError) as e:
+        if self.request.retries >= settings.KEYPHOTO_UPLOAD_MAX_RETRIES:
+            logger.error('Giving up uploading KeyPhoto %s to S3: %s', key_photo_id, e)
+            _fail_spooled_upload(key_photo, spool_path)
+            raise
+        raise self.retry(exc=e, countdown=min(2 ** self.request.retries, 300))
+    except Exception:
+        # Not worth retrying, but the photo mustn't stay pending with its file spooled forever
+        logger.exception('Failed to upload KeyPhoto %s', key_photo_id)
+        _fail_spooled_upload(key_photo, spool_path)
+        raise
+
+    key_photo.status = KeyPhoto.STATUS_READY
+    key_photo.save(update_fields=update_fields)
+    _remove_spooled_file(spool_path)
+    generate_keyphoto_derivatives.delay(key_photo_id)
+    return key_photo.status
+
+
+def _fail_spooled_upload(key_photo, spool_path):
+    key_photo.status = KeyPhoto.STATUS_FAILED
+    key_photo.save(update_fields=['status', 'updated'])
+    _remove_spooled_file(spool_path)
+
+
+def _remove_spooled_file(spool_path):
+    try:
+        os.remove(spool_path)
+    except FileNotFoundError:
+        pass
+
+
+@shared_task
+def render_keyphoto_timelapse(timelapse_id):
+    """
+    Renders a Timelapse and stores it in S3, updating photos_rendered as it
+    goes so the client can show progress.
+    """
+    try:
+        timelapse = Timelapse.objects.select_related('user').get(pk=timelapse_id)
+    except Timelapse.DoesNotExist:
+        return None
+    if timelapse.status == Timelapse.STATUS_READY:
+        return timelapse.s3_path
+
+    rows = Timelapse.objects.filter(pk=timelapse_id)
+    rows.update(status=Timelapse.STATUS_RENDERING, photos_rendered=0, error='')
+    key_photos_by_id = KeyPhoto.objects.in_bulk(timelapse.key_photo_ids)
+    key_photos = [key_photos_by_id[pk] for pk in timelapse.key_photo_ids if pk in key_photos_by_id]
+    # About 50 progress writes per render, whatever its length
+    progress_step = max(len(key_photos) // 50, 1)
+
+    def on_progress(done):
+        if done % progress_step == 0:
+            rows.update(photos_rendered=done)
+
+    s3_path = f"users/{timelapse.user.username}/timelapses/{timelapse.input_hash}.{timelapse.format}"
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, f'timelapse.{timelapse.format}')
+            write_timelapse(key_photos, path, timelapse.format, on_progress)
+            file_size = os.path.getsize(path)
+            get_s3_client().upload_file(
+                path,
+                settings.AWS_STORAGE_BUCKET_NAME,
+                s3_path,
+                ExtraArgs={'ContentType': CONTENT_TYPES[timelapse.format]}
+            )
+    except Exception as e:
+        logger.exception('Rendering Timelapse %s failed', timelapse_id)
+        rows.update(status=Timelapse.STATUS_FAILED, error=str(e))
+        raise
+
+    rows.update(
+        status=Timelapse.STATUS_READY,
+        s3_path=s3_path,
+        file_size=file_size,
+        photos_rendered=len(timelapse.key_photo_ids),
+    )
+    return s3_path
@@ -3,11 +3,35 @@ from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
-from .models import Timeline, KeyPhoto, TimelineType
-from datetime import datetime
+from .models import Timeline, KeyPhoto, TimelineType, WeightRollup, Tombstone, Timelapse, TimelineKeyPhoto
+from . import storage
+from .tasks import generate_keyphoto_derivatives
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+from unittest import mock
+from datetime import datetime, timedelta
+from decimal import Decimal
 import tempfile
 import os
 
+import io
+import shutil
+import unittest
+import json
+import uuid
+
+import boto3
+import requests
+from PIL import Image
+from moto import mock_aws
+
+from gymguru.renderers import ORJSONRenderer
+
 User = get_user_model()
 
 
@@ -70,9 +94,10 @@ class UserIsolationTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         
         # Should only see user1's timeline
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['name'], 'My Weight Journey')
-        self.assertEqual(response.data[0]['user'], self.user1.id)
+        results = response.data['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['name'], 'My Weight Journey')
+        self.assertEqual(results[0]['user'], self.user1.id)
     
     def test_user_can_only_see_own_keyphotos(self):
         """Test that users can only see their own keyphotos"""
@@ -84,9 +109,10 @@ class UserIsolationTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         
         # Should only see user1's keyphoto
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['filename'], 'test_photo1.jpg')
-        self.assertEqual(response.data[0]['user'], self.user1.id)
+        results = response.data['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['filename'], 'test_photo1.jpg')
+        self.assertEqual(results[0]['user'], self.user1.id)
     
     def test_user_cannot_access_other_user_timeline(self):
         """Test that users cannot access other users' timelines"""
@@ -222,3 +248,2415 @@ class ModelTestCase(TestCase):
         weight = KeyPhoto.generate_random_weight()
         self.assertGreaterEqual(weight, 700)
         self.assertLessEqual(weight, 850)
+
+
+@override_settings(
+    AWS_REGION='us-east-1',
+    AWS_S3_ENDPOINT_URL=None,
+    AWS_STORAGE_BUCKET_NAME='test-bucket',
+    KEYPHOTO_MULTIPART_THRESHOLD=1024 * 1024,
+    KEYPHOTO_MULTIPART_PART_SIZE=5 * 1024 * 1024,
+)
+@mock_aws
+class KeyPhotoDirectUploadTestCase(APITestCase):
+    """Test case for the presigned direct-to-S3 upload flow"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='uploader',
+            email='uploader@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket='test-bucket')
+
+    def initiate(self, file_size, content_type='image/jpeg'):
+        return self.client.post(reverse('keyphoto-upload-initiate'), {
+            'filename': 'IMG_0001.jpg',
+            'content_type': content_type,
+            'file_size': file_size,
+        }, format='json')
+
+    def test_single_put_upload(self):
+        """Test that a small photo goes through one presigned PUT"""
+        body = b'\xff\xd8' + b'x' * 1024
+        response = self.initiate(len(body))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(response.data['multipart'])
+        self.assertTrue(response.data['s3_path'].startswith('users/uploader/keyphotos/'))
+
+        put = requests.put(response.data['url'], data=body, headers=response.data['headers'])
+        self.assertEqual(put.status_code, 200)
+
+        response = self.client.post(reverse('keyphoto-upload-complete'), {
+            'upload_token': response.data['upload_token'],
+            'photo_taken_at': '2025-01-01T10:00:00Z',
+            'weight_centigrams': 7800,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        key_photo = KeyPhoto.objects.get(user=self.user)
+        self.assertEqual(key_photo.file_size, len(body))
+        self.assertEqual(key_photo.weight_centigrams, 7800)
+
+    def test_multipart_upload(self):
+        """Test that a large photo is split into presigned multipart parts"""
+        part_size = 5 * 1024 * 1024
+        body = b'y' * (part_size + 100)
+        response = self.initiate(len(body))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(response.data['multipart'])
+        self.assertEqual(len(response.data['parts']), 2)
+
+        parts = []
+        for part in response.data['parts']:
+            offset = (part['part_number'] - 1) * part_size
+            put = requests.put(part['url'], data=body[offset:offset + part_size])
+            self.assertEqual(put.status_code, 200)
+            parts.append({'part_number': part['part_number'], 'etag': put.headers['ETag']})
+
+        response = self.client.post(reverse('keyphoto-upload-complete'), {
+            'upload_token': response.data['upload_token'],
+            'photo_taken_at': '2025-01-01T10:00:00Z',
+            'parts': parts,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(KeyPhoto.objects.get(user=self.user).file_size, len(body))
+
+    def test_failed_multipart_complete_aborts_upload(self):
+        """Test that a multipart upload that can't be completed is aborted, not left to S3"""
+        response = self.initiate(6 * 1024 * 1024)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(reverse('keyphoto-upload-complete'), {
+            'upload_token': response.data['upload_token'],
+            'photo_taken_at': '2025-01-01T10:00:00Z',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertNotIn('Uploads', self.s3.list_multipart_uploads(Bucket='test-bucket'))
+
+    def test_complete_without_object_fails(self):
+        """Test that completing before the object exists creates no record"""
+        response = self.initiate(1024)
+        response = self.client.post(reverse('keyphoto-upload-complete'), {
+            'upload_token': response.data['upload_token'],
+            'photo_taken_at': '2025-01-01T10:00:00Z',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(KeyPhoto.objects.exists())
+
+    def test_upload_token_is_bound_to_user(self):
+        """Test that another user cannot complete someone else's upload"""
+        response = self.initiate(1024)
+        other = User.objects.create_user(username='other', password='testpass123')
+        self.client.force_authenticate(user=other)
+        response = self.client.post(reverse('keyphoto-upload-complete'), {
+            'upload_token': response.data['upload_token'],
+            'photo_taken_at': '2025-01-01T10:00:00Z',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_initiate_rejects_non_images(self):
+        """Test that only images can be uploaded"""
+        response = self.initiate(1024, content_type='application/pdf')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class StorageClientTestCase(TestCase):
+    """Test case for the shared S3 client service"""
+
+    def setUp(self):
+        storage.reset_s3_client()
+
+    def test_client_is_shared(self):
+        """Test that every call site gets the same client instance"""
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            clients = list(pool.map(lambda _: storage.get_s3_client(), range(32)))
+        self.assertTrue(all(client is clients[0] for client in clients))
+
+    @override_settings(AWS_S3_MAX_POOL_CONNECTIONS=7, AWS_S3_RETRY_MODE='standard')
+    def test_client_uses_pool_settings(self):
+        """Test that the connection pool is configured from settings"""
+        client = storage.get_s3_client()
+        self.assertEqual(client.meta.config.max_pool_connections, 7)
+        self.assertEqual(client.meta.config.retries['mode'], 'standard')
+
+    def test_client_rebuilt_when_settings_change(self):
+        """Test that overriding AWS settings drops the cached client"""
+        client = storage.get_s3_client()
+        with override_settings(AWS_S3_ENDPOINT_URL='http://localhost:9000'):
+            other = storage.get_s3_client()
+            self.assertIsNot(client, other)
+            self.assertEqual(other.meta.endpoint_url, 'http://localhost:9000')
+
+    @override_settings(AWS_STORAGE_BUCKET_NAME='test-bucket')
+    def test_delete_objects_batches(self):
+        """Test that deletes are split into DeleteObjects calls of at most DELETE_BATCH_SIZE keys"""
+        client = storage.get_s3_client()
+        keys = [f'users/x/{i}.jpg' for i in range(storage.DELETE_BATCH_SIZE * 2 + 1)]
+        response = {'Errors': [{'Key': 'users/x/0.jpg', 'Message': 'Access Denied'}]}
+        with mock.patch.object(client, 'delete_objects', return_value=response) as delete_objects:
+            errors = storage.delete_objects(iter(keys))
+        self.assertEqual(
+            [len(call.kwargs['Delete']['Objects']) for call in delete_objects.call_args_list],
+            [storage.DELETE_BATCH_SIZE, storage.DELETE_BATCH_SIZE, 1]
+        )
+        self.assertEqual(len(errors), 3)
+
+    def test_pool_stats(self):
+        """Test that pool stats are reported before and after client creation"""
+        self.assertFalse(storage.pool_stats()['client_created'])
+        storage.get_s3_client()
+        stats = storage.pool_stats()
+        self.assertTrue(stats['client_created'])
+        self.assertEqual(stats['connections_created'], 0)
+
+
+class PresignedUrlCacheTestCase(APITestCase):
+    """Test case for presigned urls generated at serialization time"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='lister',
+            email='lister@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        for i in range(5):
+            KeyPhoto.objects.create(
+                user=self.user,
+                filename=f'photo{i}.jpg',
+                s3_path=f'users/lister/keyphotos/photo{i}.jpg',
+                photo_taken_at=datetime.now(),
+                weight_centigrams=750
+            )
+
+    def test_list_signs_each_url_once(self):
+        """Test that repeated listings are served from the url cache"""
+        with mock.patch.object(storage, '_sign_get_url', side_effect=lambda path: f'https://signed/{path}') as sign:
+            response = self.client.get(reverse('user-keyphotos'))
+            self.assertEqual(sign.call_count, 5)
+            first = response.data['results'][0]
+            self.assertEqual(first['presigned_url'], f"https://signed/{first['s3_path']}")
+
+            with self.assertNumQueries(1):
+                self.client.get(reverse('user-keyphotos'))
+            self.assertEqual(sign.call_count, 5)
+
+    def test_expired_urls_are_resigned(self):
+        """Test that a url is signed again once its cache entry is gone"""
+        with mock.patch.object(storage, '_sign_get_url', return_value='https://signed/url') as sign:
+            storage.get_presigned_url('users/lister/keyphotos/photo0.jpg')
+            cache.clear()
+            storage.get_presigned_url('users/lister/keyphotos/photo0.jpg')
+            self.assertEqual(sign.call_count, 2)
+
+    @override_settings(KEYPHOTO_PRESIGNED_URL_EXPIRES=600, KEYPHOTO_PRESIGNED_URL_CACHE_MARGIN=60)
+    def test_cache_entry_outlived_by_signature(self):
+        """Test that cached urls expire before the signature does"""
+        self.assertEqual(storage._presigned_url_cache_timeout(), 540)
+
+
+class UserListPaginationTestCase(APITestCase):
+    """Test case for cursor pagination and sparse fieldsets on list endpoints"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='pager',
+            email='pager@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        for i in range(25):
+            KeyPhoto.objects.create(
+                user=self.user,
+                filename=f'photo{i}.jpg',
+                s3_path=f'users/pager/keyphotos/photo{i}.jpg',
+                photo_taken_at=datetime.now(),
+                weight_centigrams=700 + i
+            )
+            Timeline.objects.create(user=self.user, name=f'Timeline {i}')
+
+    def collect(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [item['id'] for item in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def test_keyphotos_are_paged_by_cursor(self):
+        """Test that following next links returns every photo exactly once, newest first"""
+        ids = self.collect(reverse('user-keyphotos') + '?page_size=10&fields=id')
+        expected = list(
+            KeyPhoto.objects.filter(user=self.user).order_by('-created', 'id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+
+    def test_timelines_are_paged_by_cursor(self):
+        """Test that timelines are paginated with the default page size"""
+        response = self.client.get(reverse('user-timelines'))
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertEqual(len(self.collect(reverse('user-timelines'))), 25)
+
+    def test_sparse_fieldset(self):
+        """Test that fields= limits the serialized fields and skips url signing"""
+        with mock.patch.object(storage, '_sign_get_url') as sign:
+            response = self.client.get(
+                reverse('user-keyphotos') + '?fields=id,photo_taken_at,weight_centigrams'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            set(response.data['results'][0]),
+            {'id', 'photo_taken_at', 'weight_centigrams'}
+        )
+        sign.assert_not_called()
+
+    def test_unknown_field_is_rejected(self):
+        """Test that asking for a field the serializer doesn't have is a 400"""
+        response = self.client.get(reverse('user-keyphotos') + '?fields=id,password')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class UserListConditionalGetTestCase(APITestCase):
+    """Test case for ETag based 304 responses on list endpoints"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='poller',
+            email='poller@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.key_photo = KeyPhoto.objects.create(
+            user=self.user,
+            filename='photo.jpg',
+            s3_path='users/poller/keyphotos/photo.jpg',
+            photo_taken_at=datetime.now(),
+            weight_centigrams=7000
+        )
+        Timeline.objects.create(user=self.user, name='Cut')
+
+    def test_unchanged_list_is_not_modified_without_queries(self):
+        """Test that a poll with the current ETag gets a 304 without touching the database"""
+        url = reverse('user-keyphotos') + '?fields=id,weight_centigrams'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get(reverse('user-keyphotos') + '?fields=id', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_write_changes_etag(self):
+        """Test that saving or deleting a KeyPhoto invalidates the list ETag"""
+        url = reverse('user-keyphotos') + '?fields=id'
+        etag = self.client.get(url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.key_photo.weight_centigrams = 6900
+            self.key_photo.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.key_photo.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [])
+
+    def test_timelines_etag(self):
+        """Test that timelines have their own version, untouched by KeyPhoto writes"""
+        url = reverse('user-timelines')
+        etag = self.client.get(url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.key_photo.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Timeline.objects.create(user=self.user, name='Bulk')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_etags_are_per_user(self):
+        """Test that another user's ETag never matches"""
+        url = reverse('user-timelines')
+        etag = self.client.get(url)['ETag']
+        other = User.objects.create_user(username='other', email='other@test.com', password='testpass123')
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+
+class FastListSerializationTestCase(APITestCase):
+    """Test case for the .values() list serialization and the orjson renderer"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='fastlister',
+            email='fastlister@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        base = timezone.now().replace(microsecond=123456)
+        for i in range(7):
+            KeyPhoto.objects.create(
+                user=self.user,
+                filename=f'фото\u2028{i}.jpg',
+                s3_path=f'users/fastlister/keyphotos/photo{i}.jpg',
+                photo_taken_at=base - timedelta(days=i, microseconds=i),
+                weight_centigrams=7000 + i,
+                file_size=None if i % 2 else 1000 + i,
+                content_hash='ab' * 32 if i % 3 else '',
+                derivatives={'512': {'s3_path': f'users/fastlister/keyphotos/photo{i}_512.webp', 'width': 512}}
+                if i % 2 else {},
+                status=KeyPhoto.STATUS_PENDING if i == 3 else KeyPhoto.STATUS_READY,
+            )
+            Timeline.objects.create(user=self.user, name=f'Тайм\u2029лайн "{i}"')
+        KeyPhoto.objects.create(
+            user=self.user,
+            filename='deleted.jpg',
+            s3_path='users/fastlister/keyphotos/deleted.jpg',
+            photo_taken_at=base,
+            weight_centigrams=7000,
+            is_deleted=True
+        )
+
+    def get_both(self, url):
+        """The fast and the ModelSerializer response, each rendered by its own renderer"""
+        with mock.patch.object(storage, '_sign_get_url', side_effect=lambda path: f'https://signed/{path}'):
+            fast = self.client.get(url)
+            with override_settings(FAST_LIST_SERIALIZATION=False):
+                slow = self.client.get(url)
+        self.assertEqual(fast.status_code, status.HTTP_200_OK)
+        self.assertEqual(slow.status_code, status.HTTP_200_OK)
+        return fast, slow
+
+    def assert_identical(self, url):
+        fast, slow = self.get_both(url)
+        self.assertEqual(fast.content, JSONRenderer().render(slow.data))
+        self.assertEqual(slow.content, fast.content)
+        return fast
+
+    def test_keyphotos_are_byte_identical(self):
+        """Test that every field subset, size and page renders exactly like KeyPhotoSerializer"""
+        response = self.assert_identical(reverse('user-keyphotos'))
+        self.assertEqual(len(response.data['results']), 7)
+        self.assertIn(b'\\u2028', response.content)
+        for query in ['?size=512', '?fields=id,presigned_url&size=512', '?fields=status,derivatives,user',
+                      '?fields=photo_taken_at,file_size,created', '?page_size=3']:
+            self.assert_identical(reverse('user-keyphotos') + query)
+
+    def test_timelines_are_byte_identical(self):
+        """Test that timelines render exactly like NewTimelineSerializer"""
+        self.assert_identical(reverse('user-timelines'))
+        self.assert_identical(reverse('user-timelines') + '?fields=name,updated&page_size=2')
+
+    def test_pages_follow_the_same_cursor(self):
+        """Test that next links of the fast path lead through the same pages"""
+        url = reverse('user-keyphotos') + '?page_size=3&fields=id'
+        pages = 0
+        while url:
+            fast, slow = self.get_both(url)
+            self.assertEqual(fast.content, slow.content)
+            url = fast.data['next']
+            pages += 1
+        self.assertEqual(pages, 3)
+
+    def test_one_query_and_no_model_instances(self):
+        """Test that the fast path reads .values() rows in a single query"""
+        with mock.patch.object(storage, '_sign_get_url', return_value='https://signed/url'):
+            self.client.get(reverse('user-keyphotos'))
+            with mock.patch.object(KeyPhoto, '__init__', side_effect=AssertionError):
+                with self.assertNumQueries(1):
+                    response = self.client.get(reverse('user-keyphotos') + '?fields=id')
+        self.assertEqual(len(response.data['results']), 7)
+
+    def test_field_subsets_share_one_compiled_entry(self):
+        """Test that reordered or repeated fields= values don't grow the compile cache"""
+        from timelines.fast_serializers import _compile
+        with mock.patch.object(storage, '_sign_get_url', return_value='https://signed/url'):
+            first = self.client.get(reverse('user-keyphotos') + '?fields=id,weight_centigrams')
+            misses = _compile.cache_info().misses
+            for fields in ('weight_centigrams,id', 'id,id,weight_centigrams', 'weight_centigrams,id,id'):
+                response = self.client.get(reverse('user-keyphotos') + f'?fields={fields}')
+                self.assertEqual(response.content, first.content)
+        self.assertEqual(_compile.cache_info().misses, misses)
+
+    def test_renderer_matches_json_renderer(self):
+        """Test that ORJSONRenderer renders the same bytes as DRF's JSONRenderer"""
+        data = {
+            'text': 'ünïcödé \u2028 \u2029 "quoted" \\ \n',
+            'lazy': gettext_lazy('Not found.'),
+            'when': timezone.now(),
+            'naive': datetime(2024, 1, 2, 3, 4, 5, 6789),
+            'day': datetime(2024, 1, 2).date(),
+            'amount': Decimal('12.50'),
+            'uuid': uuid.uuid4(),
+            'nested': [1, 2.5, None, True, {'a': []}],
+            7: 'int key',
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+        self.assertEqual(
+            ORJSONRenderer().render(data, 'application/json; indent=4'),
+            JSONRenderer().render(data, 'application/json; indent=4')
+        )
+
+    def test_benchmark_command(self):
+        """Test that benchmark_serialization runs every path and leaves no rows behind"""
+        from django.core.management import call_command
+        out = io.StringIO()
+        call_command('benchmark_serialization', '--rows', '20', '--repeat', '1', stdout=out)
+        self.assertIn('values() + ORJSONRenderer', out.getvalue())
+        self.assertFalse(User.objects.filter(username__startswith='serialization-bench').exists())
+
+
+@override_settings(
+    AWS_REGION='us-east-1',
+    AWS_S3_ENDPOINT_URL=None,
+    AWS_STORAGE_BUCKET_NAME='test-bucket',
+)
+@mock_aws
+class KeyPhotoDownloadTestCase(APITestCase):
+    """Test case for range and conditional requests on the download proxy"""
+
+    body = bytes(range(256)) * 40
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='viewer',
+            email='viewer@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        s3.put_object(
+            Bucket='test-bucket',
+            Key='users/viewer/keyphotos/photo.jpg',
+            Body=self.body,
+            ContentType='image/jpeg'
+        )
+        self.keyphoto = KeyPhoto.objects.create(
+            user=self.user,
+            filename='photo.jpg',
+            s3_path='users/viewer/keyphotos/photo.jpg',
+            photo_taken_at=datetime.now(),
+            weight_centigrams=750
+        )
+        self.url = reverse('keyphoto-download', args=[self.keyphoto.id])
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        cache_override = override_settings(KEYPHOTO_DISK_CACHE_DIR=cache_dir)
+        cache_override.enable()
+        self.addCleanup(cache_override.disable)
+
+        self.s3_calls = []
+        storage.get_s3_client().meta.events.register(
+            'before-call.s3',
+            lambda model, **kwargs: self.s3_calls.append(model.name)
+        )
+
+    def test_full_download(self):
+        """Test that a plain GET streams the whole object with validators"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.body)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+    def test_range_download(self):
+        """Test that a byte range is forwarded to S3 and answered with 206"""
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), self.body[100:200])
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.body)}')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.body[-10:])
+
+    def test_unsatisfiable_range(self):
+        """Test that a range past the end of the object is a 416"""
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.body)}-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+    def test_revalidation_does_not_touch_s3(self):
+        """Test that If-None-Match is answered with 304 from cached metadata"""
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.s3_calls, ['HeadObject', 'GetObject'])
+        self.s3_calls.clear()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.s3_calls, [])
+
+    def test_if_modified_since(self):
+        """Test that If-Modified-Since is honoured"""
+        last_modified = self.client.get(self.url)['Last-Modified']
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+@override_settings(
+    AWS_ACCESS_KEY_ID='testing',
+    AWS_SECRET_ACCESS_KEY='testing',
+    AWS_S3_ENDPOINT_URL=None,
+    AWS_STORAGE_BUCKET_NAME='test-bucket',
+)
+@mock_aws
+class KeyPhotoDownloadCacheTestCase(APITestCase):
+    """Test case for the local disk cache behind the download proxy"""
+
+    body = bytes(range(256)) * 40
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='cached',
+            email='cached@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        for i in range(4):
+            s3.put_object(
+                Bucket='test-bucket',
+                Key=f'users/cached/keyphotos/photo{i}.jpg',
+                Body=self.body,
+                ContentType='image/jpeg'
+            )
+        self.keyphoto = KeyPhoto.objects.create(
+            user=self.user,
+            filename='photo0.jpg',
+            s3_path='users/cached/keyphotos/photo0.jpg',
+            photo_taken_at=datetime.now(),
+            weight_centigrams=750
+        )
+        self.url = reverse('keyphoto-download', args=[self.keyphoto.id])
+
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        cache_override = override_settings(KEYPHOTO_DISK_CACHE_DIR=self.cache_dir)
+        cache_override.enable()
+        self.addCleanup(cache_override.disable)
+
+        self.s3_calls = []
+        storage.get_s3_client().meta.events.register(
+            'before-call.s3',
+            lambda model, **kwargs: self.s3_calls.append(model.name)
+        )
+
+    def cached_files(self):
+        return sorted(name for _, _, names in os.walk(self.cache_dir) for name in names)
+
+    def test_hit_is_served_from_disk(self):
+        """Test that a repeated download is a FileResponse of the local copy, without S3"""
+        from django.http import FileResponse
+        from timelines.disk_cache import get_download_cache
+
+        response = self.client.get(self.url)
+        self.assertEqual(b''.join(response.streaming_content), self.body)
+        self.assertEqual(self.s3_calls, ['HeadObject', 'GetObject'])
+        self.s3_calls.clear()
+
+        response = self.client.get(self.url)
+        self.assertIsInstance(response, FileResponse)
+        self.assertEqual(b''.join(response.streaming_content), self.body)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Content-Length'], str(len(self.body)))
+        self.assertEqual(response['Content-Disposition'], 'inline; filename="photo0.jpg"')
+        self.assertEqual(self.s3_calls, [])
+        # Written under a temporary name then renamed, nothing else is left behind
+        self.assertEqual(len(self.cached_files()), 1)
+
+        stats = get_download_cache().stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['bytes']), (1, 1, len(self.body)))
+
+    def test_range_miss_is_a_ranged_get(self):
+        """Test that a range of an uncached object is fetched as that range, without filling the cache"""
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), self.body[:10])
+        self.assertEqual(self.s3_calls, ['HeadObject', 'GetObject'])
+        self.assertEqual(self.cached_files(), [])
+
+    def test_range_is_served_from_disk(self):
+        """Test that byte ranges of a cached object are read from the local copy"""
+        b''.join(self.client.get(self.url).streaming_content)
+        self.s3_calls.clear()
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), self.body[100:200])
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.body)}')
+        self.assertEqual(self.s3_calls, [])
+
+    def test_concurrent_misses_are_coalesced(self):
+        """Test that concurrent requests for a cold object make a single S3 GET"""
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        from timelines.disk_cache import DownloadCache
+
+        def slow_get(**kwargs):
+            # Keeps the download in flight while the other threads ask for the object
+            time.sleep(0.2)
+
+        events = storage.get_s3_client().meta.events
+        events.register('before-call.s3.GetObject', slow_get)
+        self.addCleanup(events.unregister, 'before-call.s3.GetObject', slow_get)
+        download_cache = DownloadCache(self.cache_dir, 10 * len(self.body), len(self.body))
+
+        def download(_):
+            with download_cache.open('users/cached/keyphotos/photo1.jpg', len(self.body)) as f:
+                return f.read()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            bodies = list(executor.map(download, range(8)))
+
+        self.assertEqual(bodies, [self.body] * 8)
+        self.assertEqual(self.s3_calls.count('GetObject'), 1)
+        stats = download_cache.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'] + stats['coalesced'], 7)
+
+    def test_eviction_keeps_the_budget(self):
+        """Test that the least recently used objects are evicted once the budget is exceeded"""
+        from timelines.disk_cache import DownloadCache
+
+        download_cache = DownloadCache(self.cache_dir, 3.5 * len(self.body), len(self.body))
+        paths = [f'users/cached/keyphotos/photo{i}.jpg' for i in range(4)]
+        for i, s3_path in enumerate(paths[:3]):
+            download_cache.open(s3_path, len(self.body)).close()
+            # mtime is the recency, spread out so the order doesn't depend on timestamp resolution
+            os.utime(download_cache.path(s3_path), (1000 + i, 1000 + i))
+        # photo0 becomes the most recently used
+        download_cache.open(paths[0], len(self.body)).close()
+        download_cache.open(paths[3], len(self.body)).close()
+
+        self.assertFalse(os.path.exists(download_cache.path(paths[1])))
+        for s3_path in (paths[0], paths[2], paths[3]):
+            self.assertTrue(os.path.exists(download_cache.path(s3_path)))
+        stats = download_cache.stats()
+        self.assertEqual((stats['evictions'], stats['evicted_bytes']), (1, len(self.body)))
+        self.assertLessEqual(stats['bytes'], download_cache.max_bytes)
+
+    @override_settings(KEYPHOTO_DISK_CACHE_MAX_OBJECT_SIZE=1024)
+    def test_large_objects_are_streamed(self):
+        """Test that objects over the size limit bypass the cache"""
+        for _ in range(2):
+            response = self.client.get(self.url)
+            self.assertEqual(b''.join(response.streaming_content), self.body)
+        self.assertEqual(self.s3_calls.count('GetObject'), 2)
+        self.assertEqual(self.cached_files(), [])
+
+    def test_stats_view(self):
+        """Test that the cache counters are exposed to admins only"""
+        url = reverse('storage-download-cache')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.get(self.url)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['misses'], 1)
+
+
+def make_jpeg(width=2000, height=1000, color=(200, 80, 40)):
+    output = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(output, format='JPEG')
+    return output.getvalue()
+
+
+@override_settings(
+    AWS_REGION='us-east-1',
+    AWS_S3_ENDPOINT_URL=None,
+    AWS_STORAGE_BUCKET_NAME='test-bucket',
+    KEYPHOTO_DERIVATIVE_SIZES=[128, 512],
+)
+@mock_aws
+class KeyPhotoDerivativesTestCase(APITestCase):
+    """Test case for thumbnail/derivative generation"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='thumbs',
+            email='thumbs@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket='test-bucket')
+        self.s3.put_object(Bucket='test-bucket', Key='users/thumbs/keyphotos/photo.jpg', Body=make_jpeg())
+        self.keyphoto = KeyPhoto.objects.create(
+            user=self.user,
+            filename='photo.jpg',
+            s3_path='users/thumbs/keyphotos/photo.jpg',
+            photo_taken_at=datetime.now(),
+            weight_centigrams=750
+        )
+
+    def test_derivatives_are_generated(self):
+        """Test that every configured size is stored next to the original"""
+        derivatives = generate_keyphoto_derivatives(self.keyphoto.id)
+        self.assertEqual(set(derivatives), {'128', '512'})
+        self.assertEqual(derivatives['512']['s3_path'], 'users/thumbs/keyphotos/photo_512.webp')
+        self.assertEqual((derivatives['512']['width'], derivatives['512']['height']), (512, 256))
+
+        head = self.s3.head_object(Bucket='test-bucket', Key=derivatives['128']['s3_path'])
+        self.assertEqual(head['ContentType'], 'image/webp')
+        self.keyphoto.refresh_from_db()
+        self.assertEqual(self.keyphoto.derivatives, derivatives)
+
+    def test_size_choice_in_serializer(self):
+        """Test that size= selects the derivative url and falls back to the original"""
+        response = self.client.get(reverse('keyphoto-detail', args=[self.keyphoto.id]) + '?size=128')
+        self.assertIn('photo.jpg', response.data['presigned_url'])
+
+        generate_keyphoto_derivatives(self.keyphoto.id)
+        response = self.client.get(reverse('user-keyphotos') + '?size=128')
+        self.assertIn('photo_128.webp', response.data['results'][0]['presigned_url'])
+
+        response = self.client.get(reverse('user-keyphotos') + '?size=77')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_backfill_command(self):
+        """Test that the backfill command only processes photos missing derivatives"""
+        from django.core.management import call_command
+        out = io.StringIO()
+        call_command('generate_keyphoto_derivatives', '--sync', stdout=out)
+        self.assertIn('Generated derivatives for 1 photos', out.getvalue())
+
+        out = io.StringIO()
+        call_command('generate_keyphoto_derivatives', '--sync', stdout=out)
+        self.assertIn('Found 0 KeyPhoto records', out.getvalue())
+
+
+@override_settings(
+    AWS_REGION='us-east-1',
+    AWS_S3_ENDPOINT_URL=None,
+    AWS_STORAGE_BUCKET_NAME='test-bucket',
+    KEYPHOTO_DERIVATIVE_SIZES=[128],
+    KEYPHOTO_UPLOAD_MAX_RETRIES=2,
+)
+@mock_aws
+class KeyPhotoAsyncUploadTestCase(APITestCase):
+    """Test case for uploads offloaded to a Celery worker"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='async',
+            email='async@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket='test-bucket')
+        self.spool_dir = tempfile.mkdtemp()
+        spool_override = override_settings(KEYPHOTO_UPLOAD_SPOOL_DIR=self.spool_dir)
+        spool_override.enable()
+        self.addCleanup(spool_override.disable)
+
+    def upload(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        photo = SimpleUploadedFile('photo.jpg', make_jpeg(), content_type='image/jpeg')
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('keyphoto-upload') + '?async=1', {
+                'photo': photo,
+                'photo_taken_at': '2025-01-01T10:00:00Z',
+            }, format='multipart')
+
+    def test_async_upload(self):
+        """Test that the view returns 202 and the worker makes the photo ready"""
+        response = self.upload()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['key_photo']['status'], KeyPhoto.STATUS_PENDING)
+
+        key_photo = KeyPhoto.objects.get(user=self.user)
+        self.assertEqual(key_photo.status, KeyPhoto.STATUS_READY)
+        self.s3.head_object(Bucket='test-bucket', Key=key_photo.s3_path)
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+        response = self.client.get(reverse('keyphoto-status', args=[key_photo.id]))
+        self.assertEqual(response.data, {'id': key_photo.id, 'status': KeyPhoto.STATUS_READY})
+
+    def test_async_upload_failure(self):
+        """Test that a photo is marked failed once retries are exhausted"""
+        from botocore.exceptions import ClientError
+        error = ClientError({'Error': {'Code': '503', 'Message': 'Slow Down'}}, 'PutObject')
+        with mock.patch.object(storage.get_s3_client(), 'upload_fileobj', side_effect=error) as upload_fileobj:
+            self.upload()
+        self.assertEqual(upload_fileobj.call_count, 3)
+        self.assertEqual(KeyPhoto.objects.get(user=self.user).status, KeyPhoto.STATUS_FAILED)
+
+    def test_missing_broker(self):
+        """Test that tasks never fall back to running inline without a broker"""
+        from django.apps import apps
+        from django.core.exceptions import ImproperlyConfigured
+        config = apps.get_app_config('timelines')
+        with override_settings(CELERY_BROKER_URL=None, CELERY_TASK_ALWAYS_EAGER=False, DEBUG=False):
+            with self.assertRaises(ImproperlyConfigured):
+                config.check_celery_broker()
+        with override_settings(CELERY_BROKER_URL=None, CELERY_TASK_ALWAYS_EAGER=False, DEBUG=True):
+            with self.assertLogs('timelines.apps', 'WARNING'):
+                config.check_celery_broker()
+        with override_settings(CELERY_BROKER_URL='redis://localhost:6379/0', CELERY_TASK_ALWAYS_EAGER=False):
+            config.check_celery_broker()
+
+
+@override_settings(
+    AWS_REGION='us-east-1',
+    AWS_S3_ENDPOINT_URL=None,
+    AWS_STORAGE_BUCKET_NAME='test-bucket',
+)
+@mock_aws
+class MigrateS3FilesCommandTestCase(TestCase):
+    """Test case for the migrate_s3_files management command"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='legacy', password='testpass123')
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket='test-bucket')
+        self.keyphotos = []
+        for i in range(5):
+            self.s3.put_object(Bucket='test-bucket', Key=f'keyphotos/photo{i}.jpg', Body=b'data')
+            self.keyphotos.append(KeyPhoto.objects.create(
+                user=self.user,
+                filename=f'photo{i}.jpg',
+                s3_path=f'keyphotos/photo{i}.jpg',
+                photo_taken_at=datetime.now(),
+                weight_centigrams=750
+            ))
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), 'checkpoint')
+
+    def keys(self):
+        return sorted(obj['Key'] for obj in self.s3.list_objects_v2(Bucket='test-bucket')['Contents'])
+
+    def test_parallel_migration(self):
+        """Test that objects are moved in batches by several workers"""
+        from django.core.management import call_command
+        out = io.StringIO()
+        call_command(
+            'migrate_s3_files', '--workers', '3', '--batch-size', '2',
+            '--checkpoint', self.checkpoint, stdout=out
+        )
+        self.assertIn('Moved 5 files, 0 errors', out.getvalue())
+        self.assertIn('5/5 processed', out.getvalue())
+        self.assertEqual(
+            self.keys(),
+            [f'users/{self.user.id}/legacy/keyphotos/photo{i}.jpg' for i in range(5)]
+        )
+        self.assertFalse(KeyPhoto.objects.exclude(s3_path__startswith='users/').exists())
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_moved_rows_look_changed(self):
+        """Test that moved rows get a new `updated` and their owner's list ETags change"""
+        from django.core.management import call_command
+        from timelines import versioning
+        before = timezone.now()
+        version = versioning.get_collection_version(self.user.id, versioning.KEYPHOTOS)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('migrate_s3_files', '--batch-size', '2', '--checkpoint', self.checkpoint, stdout=io.StringIO())
+        self.assertFalse(KeyPhoto.objects.filter(updated__lt=before).exists())
+        self.assertNotEqual(versioning.get_collection_version(self.user.id, versioning.KEYPHOTOS), version)
+
+    def test_rows_without_user_are_errors(self):
+        """Test that a row without a user is reported and the other rows are still moved"""
+        from django.core.management import call_command
+        self.s3.put_object(Bucket='test-bucket', Key='keyphotos/nobody.jpg', Body=b'data')
+        nobody = KeyPhoto.objects.create(
+            filename='nobody.jpg', s3_path='keyphotos/nobody.jpg', photo_taken_at=datetime.now(), weight_centigrams=750
+        )
+        out = io.StringIO()
+        call_command('migrate_s3_files', '--dry-run', stdout=out)
+        self.assertIn(f'KeyPhoto {nobody.id} has no user', out.getvalue())
+        self.assertIn('Would move 5 files, 1 errors', out.getvalue())
+
+        out = io.StringIO()
+        call_command('migrate_s3_files', '--checkpoint', self.checkpoint, stdout=out)
+        self.assertIn('Moved 5 files, 1 errors', out.getvalue())
+        nobody.refresh_from_db()
+        self.assertEqual(nobody.s3_path, 'keyphotos/nobody.jpg')
+        self.assertIn('keyphotos/nobody.jpg', self.keys())
+
+    def test_resume_from_checkpoint(self):
+        """Test that --resume skips checkpointed rows and finishes pending deletes"""
+        from django.core.management import call_command
+        # Simulate a crash after the first row was saved but before its original was deleted
+        first = self.keyphotos[0]
+        self.s3.copy_object(
+            CopySource={'Bucket': 'test-bucket', 'Key': first.s3_path},
+            Bucket='test-bucket',
+            Key=f'users/{self.user.id}/legacy/keyphotos/photo0.jpg'
+        )
+        KeyPhoto.objects.filter(id=first.id).update(s3_path=f'users/{self.user.id}/legacy/keyphotos/photo0.jpg')
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'last_id': first.id, 'pending_deletes': ['keyphotos/photo0.jpg']}, f)
+
+        out = io.StringIO()
+        call_command('migrate_s3_files', '--resume', '--checkpoint', self.checkpoint, stdout=out)
+        self.assertIn('Found 4 KeyPhoto records', out.getvalue())
+        self.assertTrue(all(key.startswith('users/') for key in self.keys()))
+        self.assertEqual(len(self.keys()), 5)
+
+
+@override_settings(
+    AWS_REGION='us-east-1',
+    AWS_S3_ENDPOINT_URL=None,
+    AWS_STORAGE_BUCKET_NAME='test-bucket',
+)
+@mock_aws
+class S3LifecycleTestCase(APITestCase):
+    """Test case for deleting KeyPhoto objects: hard deletes, purge_deleted_keyphotos, reconcile_s3_objects"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='lifecycle', password='testpass123')
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket='test-bucket')
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), 'checkpoint')
+
+    def create_keyphoto(self, name, upload=True, derivative=False, **kwargs):
+        s3_path = f'users/lifecycle/keyphotos/{name}.jpg'
+        derivatives = {}
+        if derivative:
+            derivatives['128'] = {'s3_path': f'users/lifecycle/keyphotos/{name}_128.webp', 'file_size': 3}
+        for key in [s3_path, *(d['s3_path'] for d in derivatives.values())] if upload else []:
+            self.s3.put_object(Bucket='test-bucket', Key=key, Body=b'data')
+        return KeyPhoto.objects.create(
+            user=self.user,
+            filename=f'{name}.jpg',
+            s3_path=s3_path,
+            derivatives=derivatives,
+            file_size=4,
+            photo_taken_at=timezone.now(),
+            weight_centigrams=750,
+            **kwargs
+        )
+
+    def keys(self):
+        return sorted(obj['Key'] for obj in self.s3.list_objects_v2(Bucket='test-bucket').get('Contents', []))
+
+    def call(self, command, *args):
+        from django.core.management import call_command
+        out = io.StringIO()
+        call_command(command, *args, stdout=out)
+        return out.getvalue()
+
+    def test_hard_delete_removes_objects(self):
+        """Test that DELETE on a KeyPhoto removes its original and derivatives from S3"""
+        kept = self.create_keyphoto('kept')
+        deleted = self.create_keyphoto('deleted', derivative=True)
+        self.client.force_authenticate(user=self.user)
+        response = self.client.delete(reverse('keyphoto-detail', kwargs={'pk': deleted.id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.keys(), [kept.s3_path])
+
+    def soft_deleted(self, name, days_ago, **kwargs):
+        key_photo = self.create_keyphoto(name, is_deleted=True, **kwargs)
+        KeyPhoto.objects.filter(id=key_photo.id).update(updated=timezone.now() - timedelta(days=days_ago))
+        return key_photo
+
+    def test_purge(self):
+        """Test that photos deleted before the retention window are purged with their objects"""
+        expired = [self.soft_deleted(f'expired{i}', 40, derivative=i == 0) for i in range(3)]
+        recent = self.soft_deleted('recent', 1)
+        live = self.create_keyphoto('live')
+
+        out = self.call('purge_deleted_keyphotos', '--batch-size', '2')
+        self.assertIn('Purged 3 KeyPhotos, 4 objects', out)
+        self.assertIn('3/3 processed', out)
+        self.assertEqual(set(KeyPhoto.objects.values_list('id', flat=True)), {recent.id, live.id})
+        self.assertEqual(self.keys(), sorted([recent.s3_path, live.s3_path]))
+        # sync/ clients learn about the purged rows
+        self.assertEqual(
+            set(Tombstone.objects.values_list('object_id', flat=True)), {key_photo.id for key_photo in expired}
+        )
+
+    def test_purge_dry_run(self):
+        """Test that --dry-run reports the photos and objects without deleting them"""
+        self.soft_deleted('expired', 40, derivative=True)
+        out = self.call('purge_deleted_keyphotos', '--dry-run')
+        self.assertIn('Would purge 1 KeyPhotos, 2 objects', out)
+        self.assertEqual(KeyPhoto.objects.count(), 1)
+        self.assertEqual(len(self.keys()), 2)
+
+    def test_purge_keeps_rows_of_failed_deletes(self):
+        """Test that a photo whose object could not be deleted stays for the next run"""
+        failing = self.soft_deleted('failing', 40)
+        purged = self.soft_deleted('purged', 40)
+        with mock.patch(
+            'timelines.management.commands.purge_deleted_keyphotos.delete_objects',
+            return_value=[(failing.s3_path, 'Access Denied')],
+        ):
+            out = self.call('purge_deleted_keyphotos')
+        self.assertIn('Purged 1 KeyPhotos, 1 objects', out)
+        self.assertIn(f'Error deleting {failing.s3_path}: Access Denied', out)
+        self.assertTrue(KeyPhoto.objects.filter(id=failing.id).exists())
+        self.assertFalse(KeyPhoto.objects.filter(id=purged.id).exists())
+
+    def create_reconcile_fixture(self):
+        self.live = self.create_keyphoto('live', derivative=True)
+        self.soft = self.soft_deleted('soft', 1)
+        self.create_keyphoto('gone', upload=False)
+        self.create_keyphoto('pending', upload=False, status=KeyPhoto.STATUS_PENDING)
+        KeyPhoto.objects.create(
+            user=self.user, filename='ghost.jpg', s3_path='users/ghost/keyphotos/ghost.jpg',
+            photo_taken_at=timezone.now(), weight_centigrams=750
+        )
+        Timelapse.objects.create(
+            user=self.user, input_hash='abc', format='webp', status=Timelapse.STATUS_READY,
+            s3_path='users/lifecycle/timelapses/abc.webp'
+        )
+        self.orphans = ['users/lifecycle/keyphotos/orphan.jpg', 'users/other/keyphotos/orphan.jpg']
+        for key in ['users/lifecycle/timelapses/abc.webp', 'users/loose.jpg', *self.orphans]:
+            self.s3.put_object(Bucket='test-bucket', Key=key, Body=b'data')
+        self.referenced = sorted([*self.live.get_s3_paths(), self.soft.s3_path, 'users/lifecycle/timelapses/abc.webp'])
+
+    def test_reconcile(self):
+        """Test that orphans are deleted and rows without objects reported"""
+        self.create_reconcile_fixture()
+        out = self.call('reconcile_s3_objects', '--min-age', '0', '--checkpoint', self.checkpoint)
+
+        self.assertEqual(self.keys(), self.referenced)
+        self.assertIn('7 objects scanned, 3 orphans', out)
+        self.assertIn('Missing object: users/lifecycle/keyphotos/gone.jpg', out)
+        self.assertIn('Missing object: users/ghost/keyphotos/ghost.jpg', out)
+        self.assertIn('2 missing objects, 0 errors', out)
+        self.assertNotIn('pending.jpg', out)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_reconcile_dry_run(self):
+        """Test that --dry-run only reports orphans"""
+        self.create_reconcile_fixture()
+        out = self.call('reconcile_s3_objects', '--dry-run', '--min-age', '0')
+        self.assertIn('Would delete orphan: users/other/keyphotos/orphan.jpg', out)
+        self.assertIn('DRY RUN COMPLETE - 7 objects scanned, 3 orphans', out)
+        self.assertEqual(len(self.keys()), 7)
+
+    def test_reconcile_spares_recent_objects(self):
+        """Test that objects younger than the minimum age (e.g. uploads in flight) are not orphans"""
+        self.create_reconcile_fixture()
+        out = self.call('reconcile_s3_objects', '--checkpoint', self.checkpoint)
+        self.assertIn('0 orphans', out)
+        self.assertEqual(len(self.keys()), 7)
+
+    def test_reconcile_aborts_incomplete_uploads(self):
+        """Test that multipart uploads older than the minimum age are aborted"""
+        self.s3.create_multipart_upload(Bucket='test-bucket', Key='users/lifecycle/keyphotos/big.jpg')
+        out = self.call('reconcile_s3_objects', '--dry-run', '--min-age', '0')
+        self.assertIn('Would abort incomplete upload: users/lifecycle/keyphotos/big.jpg', out)
+        self.assertEqual(len(self.s3.list_multipart_uploads(Bucket='test-bucket')['Uploads']), 1)
+
+        out = self.call('reconcile_s3_objects', '--min-age', '0', '--checkpoint', self.checkpoint)
+        self.assertIn('1 incomplete uploads', out)
+        self.assertNotIn('Uploads', self.s3.list_multipart_uploads(Bucket='test-bucket'))
+
+    def test_reconcile_resume(self):
+        """Test that --resume skips the folders reconciled before"""
+        self.create_reconcile_fixture()
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'after': 'users/lifecycle/'}, f)
+        out = self.call('reconcile_s3_objects', '--resume', '--min-age', '0', '--checkpoint', self.checkpoint)
+        self.assertIn('Resuming after users/lifecycle/', out)
+        self.assertIn('1 objects scanned, 1 orphans', out)
+        self.assertEqual(self.keys(), sorted([*self.referenced, self.orphans[0], 'users/loose.jpg']))
+
+
+@override_settings(
+    AWS_REGION='us-east-1',
+    AWS_S3_ENDPOINT_URL=None,
+    AWS_STORAGE_BUCKET_NAME='test-bucket',
+)
+@mock_aws
+class KeyPhotoBulkUploadTestCase(APITestCase):
+    """Test case for uploading many photos in one request"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='bulk',
+            email='bulk@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket='test-bucket')
+
+    def post(self, photos, metadata):
+        return self.client.post(reverse('keyphoto-bulk-upload'), {
+            'photos': photos,
+            'metadata': json.dumps(metadata),
+        }, format='multipart')
+
+    def test_bulk_upload(self):
+        """Test that every photo is uploaded and inserted with its metadata"""
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        photos = [
+            SimpleUploadedFile(f'photo{i}.jpg', make_jpeg(64, 64, (i * 40, 0, 0)), content_type='image/jpeg')
+            for i in range(4)
+        ]
+        metadata = [
+            {'photo_taken_at': f'2025-01-0{i + 1}T10:00:00Z', 'weight_centigrams': 7000 + i}
+            for i in range(4)
+        ]
+        response = self.post(photos, metadata)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 4)
+        self.assertEqual(
+            [result['key_photo']['weight_centigrams'] for result in response.data['results']],
+            [7000, 7001, 7002, 7003]
+        )
+        for key_photo in KeyPhoto.objects.filter(user=self.user):
+            self.s3.head_object(Bucket='test-bucket', Key=key_photo.s3_path)
+
+    def test_partial_failure(self):
+        """Test that invalid items are reported per item without failing the rest"""
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        photos = [
+            SimpleUploadedFile('photo.jpg', make_jpeg(64, 64), content_type='image/jpeg'),
+            SimpleUploadedFile('notes.txt', b'hello', content_type='text/plain'),
+            SimpleUploadedFile('undated.jpg', make_jpeg(64, 64, (0, 0, 255)), content_type='image/jpeg'),
+        ]
+        metadata = [
+            {'photo_taken_at': '2025-01-01T10:00:00Z'},
+            {'photo_taken_at': '2025-01-01T10:00:00Z'},
+            {},
+        ]
+        response = self.post(photos, metadata)
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['created', 'error', 'error']
+        )
+        self.assertEqual(KeyPhoto.objects.filter(user=self.user).count(), 1)
+
+    def test_upload_errors_are_per_item(self):
+        """Test that a normalization or S3 failure only fails its own item"""
+        from boto3.exceptions import S3UploadFailedError
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        photos = [
+            SimpleUploadedFile(f'photo{i}.jpg', make_jpeg(64, 64, (i * 80, 0, 0)), content_type='image/jpeg')
+            for i in range(3)
+        ]
+        metadata = [{'photo_taken_at': f'2025-01-0{i + 1}T10:00:00Z'} for i in range(3)]
+        real_upload = storage.get_s3_client().upload_fileobj
+
+        def normalize(photo):
+            if photo.name == 'photo1.jpg':
+                raise OSError('broken data stream')
+            return None  # stored as uploaded
+
+        def upload_fileobj(fileobj, bucket, key, **kwargs):
+            if fileobj.name == 'photo2.jpg':
+                raise S3UploadFailedError('Failed to upload: SlowDown')
+            return real_upload(fileobj, bucket, key, **kwargs)
+
+        with mock.patch('timelines.views.normalize_image', side_effect=normalize), \
+                mock.patch.object(storage.get_s3_client(), 'upload_fileobj', side_effect=upload_fileobj):
+            response = self.post(photos, metadata)
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], ['created', 'error', 'error'])
+        self.assertIn('broken data stream', results[1]['error'])
+        self.assertIn('SlowDown', results[2]['error'])
+        self.assertEqual(KeyPhoto.objects.filter(user=self.user).count(), 1)
+
+    def test_insert_failure_deletes_uploads(self):
+        """Test that the uploaded objects are deleted when the rows can't be inserted"""
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.db import DatabaseError
+        photos = [
+            SimpleUploadedFile(f'photo{i}.jpg', make_jpeg(64, 64, (i * 80, 0, 0)), content_type='image/jpeg')
+            for i in range(2)
+        ]
+        metadata = [{'photo_taken_at': f'2025-01-0{i + 1}T10:00:00Z'} for i in range(2)]
+        with mock.patch.object(KeyPhoto.objects, 'bulk_create', side_effect=DatabaseError('deadlock')), \
+                self.assertRaises(DatabaseError):
+            self.post(photos, metadata)
+        self.assertNotIn('Contents', self.s3.list_objects_v2(Bucket='test-bucket'))
+
+    def test_metadata_must_match_photos(self):
+        """Test that a metadata list of the wrong length is rejected"""
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        photo = SimpleUploadedFile('photo.jpg', make_jpeg(64, 64), content_type='image/jpeg')
+        response = self.post([photo], [])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(
+    AWS_REGION='us-east-1',
+    AWS_S3_ENDPOINT_URL=None,
+    AWS_STORAGE_BUCKET_NAME='test-bucket',
+)
+@mock_aws
+class KeyPhotoDeduplicationTestCase(APITestCase):
+    """Test case for content-hash deduplication of uploads"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='dedup',
+            email='dedup@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket='test-bucket')
+        self.body = make_jpeg(64, 64)
+
+    def upload(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        return self.client.post(reverse('keyphoto-upload'), {
+            'photo': SimpleUploadedFile('photo.jpg', self.body, content_type='image/jpeg'),
+            'photo_taken_at': '2025-01-01T10:00:00Z',
+        }, format='multipart')
+
+    def object_count(self):
+        return self.s3.list_objects_v2(Bucket='test-bucket')['KeyCount']
+
+    def test_reupload_returns_existing_photo(self):
+        """Test that uploading the same bytes twice stores them once"""
+        import hashlib
+        first = self.upload()
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(first.data['key_photo']['content_hash'], hashlib.sha256(self.body).hexdigest())
+
+        second = self.upload()
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertTrue(second.data['duplicate'])
+        self.assertEqual(second.data['key_photo']['id'], first.data['key_photo']['id'])
+        self.assertEqual(KeyPhoto.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(self.object_count(), 1)
+
+    def test_deleted_photo_is_not_reused(self):
+        """Test that a soft-deleted photo does not swallow a new upload"""
+        first = self.upload()
+        KeyPhoto.objects.filter(id=first.data['key_photo']['id']).update(is_deleted=True)
+        self.assertEqual(self.upload().status_code, status.HTTP_201_CREATED)
+
+    def test_initiate_with_known_hash(self):
+        """Test that a direct upload is short-circuited when the hash is known"""
+        import hashlib
+        first = self.upload()
+        response = self.client.post(reverse('keyphoto-upload-initiate'), {
+            'filename': 'photo.jpg',
+            'content_type': 'image/jpeg',
+            'file_size': len(self.body),
+            'content_hash': hashlib.sha256(self.body).hexdigest(),
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['duplicate'])
+        self.assertEqual(response.data['key_photo']['id'], first.data['key_photo']['id'])
+        self.assertNotIn('url', response.data)
+
+    def direct_upload(self, body, content_hash):
+        response = self.client.post(reverse('keyphoto-upload-initiate'), {
+            'filename': 'photo.jpg',
+            'content_type': 'image/jpeg',
+            'file_size': len(body),
+            'content_hash': content_hash,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn('x-amz-checksum-sha256', response.data['headers'])
+        put = requests.put(response.data['url'], data=body, headers=response.data['headers'])
+        self.assertEqual(put.status_code, 200)
+        return self.client.post(reverse('keyphoto-upload-complete'), {
+            'upload_token': response.data['upload_token'],
+            'photo_taken_at': '2025-01-01T10:00:00Z',
+        }, format='json')
+
+    def test_direct_upload_hash_is_verified_by_s3(self):
+        """Test that a direct upload keeps the client's hash only when S3's checksum matches it"""
+        import base64
+        import hashlib
+        content_hash = hashlib.sha256(self.body).hexdigest()
+        checksum = base64.b64encode(hashlib.sha256(self.body).digest()).decode()
+        real_head = storage.get_s3_client().head_object
+
+        def head_object(**kwargs):
+            self.assertEqual(kwargs.get('ChecksumMode'), 'ENABLED')
+            return {**real_head(**kwargs), 'ChecksumSHA256': checksum}
+
+        with mock.patch.object(storage.get_s3_client(), 'head_object', side_effect=head_object):
+            response = self.direct_upload(self.body, content_hash)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['key_photo']['content_hash'], content_hash)
+
+    def test_direct_upload_unverified_hash_is_dropped(self):
+        """Test that a hash S3 didn't confirm is not stored, so it can't shadow other uploads"""
+        import hashlib
+        other_body = make_jpeg(32, 32)
+        response = self.direct_upload(other_body, hashlib.sha256(self.body).hexdigest())
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['key_photo']['content_hash'], '')
+        self.assertEqual(self.upload().status_code, status.HTTP_201_CREATED)
+
+    def test_bulk_upload_with_repeated_file(self):
+        """Test that the same file twice in one bulk request is stored once"""
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        photos = [SimpleUploadedFile(f'photo{i}.jpg', self.body, content_type='image/jpeg') for i in range(2)]
+        response = self.client.post(reverse('keyphoto-bulk-upload'), {
+            'photos': photos,
+            'metadata': json.dumps([{'photo_taken_at': '2025-01-01T10:00:00Z'}] * 2),
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([result['status'] for result in response.data['results']], ['created', 'duplicate'])
+        self.assertEqual(
+            response.data['results'][1]['key_photo']['id'],
+            response.data['results'][0]['key_photo']['id']
+        )
+        self.assertEqual(self.object_count(), 1)
+
+
+class WeightRollupTestCase(APITestCase):
+    """Test case for weight rollups and the weights/ endpoint"""
+
+    def setUp(self):
+        from django.utils import timezone
+        self.user = User.objects.create_user(
+            username='weigher',
+            email='weigher@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.photos = []
+        # Two photos on Mon 2025-01-06, one each on the next three days
+        with self.captureOnCommitCallbacks(execute=True):
+            for day, hour, weight in [(6, 8, 8000), (6, 20, 8100), (7, 8, 7950), (8, 8, 7900), (9, 8, 7850)]:
+                self.photos.append(KeyPhoto.objects.create(
+                    user=self.user,
+                    filename=f'photo{day}-{hour}.jpg',
+                    s3_path=f'users/weigher/keyphotos/photo{day}-{hour}.jpg',
+                    photo_taken_at=timezone.make_aware(datetime(2025, 1, day, hour)),
+                    weight_centigrams=weight
+                ))
+
+    def rollup(self, period, day):
+        return WeightRollup.objects.get(user=self.user, period=period, period_start=day)
+
+    def test_rollups_follow_changes(self):
+        """Test that create, update and soft delete keep the rollups current"""
+        from datetime import date
+        day = self.rollup('day', date(2025, 1, 6))
+        self.assertEqual((day.count, day.min_centigrams, day.max_centigrams), (2, 8000, 8100))
+        self.assertEqual(self.rollup('week', date(2025, 1, 6)).count, 5)
+        self.assertEqual(self.rollup('month', date(2025, 1, 1)).sum_centigrams, 39800)
+
+        photo = self.photos[1]
+        photo.weight_centigrams = 8300
+        with self.captureOnCommitCallbacks(execute=True):
+            photo.save()
+        self.assertEqual(self.rollup('day', date(2025, 1, 6)).max_centigrams, 8300)
+
+        photo.is_deleted = True
+        with self.captureOnCommitCallbacks(execute=True):
+            photo.save()
+        self.assertEqual(self.rollup('day', date(2025, 1, 6)).count, 1)
+        self.assertEqual(self.rollup('week', date(2025, 1, 6)).count, 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.photos[0].delete()
+        self.assertFalse(WeightRollup.objects.filter(user=self.user, period='day', period_start=date(2025, 1, 6)).exists())
+
+    def test_refresh_waits_for_commit(self):
+        """Test that rollups are refreshed only once the change commits, retrying a lost insert race"""
+        from datetime import date
+        from django.db import IntegrityError
+        from timelines import rollups
+        photo = self.photos[2]
+        photo.weight_centigrams = 7000
+        with self.captureOnCommitCallbacks() as callbacks:
+            photo.save()
+            self.assertEqual(self.rollup('day', date(2025, 1, 7)).min_centigrams, 7950)
+
+        real_save_rollup = rollups._save_rollup
+        calls = []
+
+        def save_rollup(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise IntegrityError('duplicate key value violates unique constraint')
+            return real_save_rollup(*args)
+
+        with mock.patch.object(rollups, '_save_rollup', side_effect=save_rollup):
+            for callback in callbacks:
+                callback()
+        self.assertEqual(self.rollup('day', date(2025, 1, 7)).min_centigrams, 7000)
+        self.assertEqual(self.rollup('month', date(2025, 1, 1)).min_centigrams, 7000)
+
+    def test_rebuild_matches_incremental(self):
+        """Test that a full rebuild produces the same rollups"""
+        incremental = set(WeightRollup.objects.values_list(
+            'period', 'period_start', 'count', 'sum_centigrams', 'min_centigrams', 'max_centigrams'
+        ))
+        from django.core.management import call_command
+        call_command('rebuild_weight_rollups', stdout=io.StringIO())
+        rebuilt = set(WeightRollup.objects.values_list(
+            'period', 'period_start', 'count', 'sum_centigrams', 'min_centigrams', 'max_centigrams'
+        ))
+        self.assertEqual(incremental, rebuilt)
+
+    def test_weights_endpoint(self):
+        """Test that the endpoint serves aggregates with one query"""
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('weights'), {'period': 'day', 'window': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        points = response.data['points']
+        self.assertEqual([point['avg_centigrams'] for point in points], [8050.0, 7950.0, 7900.0, 7850.0])
+        self.assertEqual([point['moving_avg_centigrams'] for point in points], [8050.0, 8000.0, 7925.0, 7875.0])
+        self.assertLess(response.data['trend']['slope_centigrams_per_day'], 0)
+
+        response = self.client.get(reverse('weights'), {'period': 'day', 'start': '2025-01-08'})
+        self.assertEqual(len(response.data['points']), 2)
+
+    def test_weights_endpoint_validation(self):
+        """Test that bad parameters are rejected"""
+        response = self.client.get(reverse('weights'), {'period': 'year'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class SyncTestCase(APITestCase):
+    """Test case for the sync/ change feed"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='syncer',
+            email='syncer@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.key_photos = [
+            KeyPhoto.objects.create(
+                user=self.user,
+                filename=f'photo{i}.jpg',
+                s3_path=f'users/syncer/keyphotos/photo{i}.jpg',
+                photo_taken_at=datetime.now(),
+                weight_centigrams=7000 + i
+            )
+            for i in range(3)
+        ]
+        self.timeline = Timeline.objects.create(user=self.user, name='Cut')
+
+    def sync(self, since=None):
+        url = reverse('sync') + (f'?since={since}' if since else '')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_full_then_empty_sync(self):
+        """Test that a sync without token returns everything and an unchanged one returns nothing"""
+        data = self.sync()
+        self.assertEqual({item['id'] for item in data['keyphotos']}, {kp.id for kp in self.key_photos})
+        self.assertEqual([item['id'] for item in data['timelines']], [self.timeline.id])
+        self.assertFalse(data['has_more'])
+
+        data = self.sync(data['next'])
+        self.assertEqual(data['keyphotos'], [])
+        self.assertEqual(data['timelines'], [])
+        self.assertEqual(data['deleted'], {'keyphotos': [], 'timelines': []})
+
+    def test_soft_and_hard_deletes(self):
+        """Test that soft deletes come back as rows and hard deletes as tombstones"""
+        token = self.sync()['next']
+        soft, hard = self.key_photos[0], self.key_photos[1]
+        self.client.put(reverse('keyphoto-detail', kwargs={'pk': soft.id}))
+        with mock.patch('timelines.views.delete_objects', return_value=[]):
+            self.client.delete(reverse('keyphoto-detail', kwargs={'pk': hard.id}))
+
+        data = self.sync(token)
+        self.assertEqual([item['id'] for item in data['keyphotos']], [soft.id])
+        self.assertTrue(data['keyphotos'][0]['is_deleted'])
+        self.assertEqual(data['deleted']['keyphotos'], [hard.id])
+
+    def test_other_users_changes_are_not_synced(self):
+        """Test that the feed only contains the current user's rows"""
+        token = self.sync()['next']
+        other = User.objects.create_user(username='other', email='other@test.com', password='testpass123')
+        Timeline.objects.create(user=other, name='Bulk')
+        data = self.sync(token)
+        self.assertEqual(data['timelines'], [])
+
+    @override_settings(SYNC_PAGE_SIZE=2)
+    def test_paging(self):
+        """Test that following next while has_more returns every row once"""
+        data = self.sync()
+        self.assertTrue(data['has_more'])
+        ids = [item['id'] for item in data['keyphotos']]
+        while data['has_more']:
+            data = self.sync(data['next'])
+            ids += [item['id'] for item in data['keyphotos']]
+        self.assertEqual(sorted(ids), sorted(kp.id for kp in self.key_photos))
+
+    def test_user_deletion_leaves_no_tombstones(self):
+        """Test that cascading deletes don't record tombstones"""
+        self.user.delete()
+        self.assertFalse(Tombstone.objects.exists())
+
+    def test_invalid_token(self):
+        """Test that a tampered token is rejected"""
+        response = self.client.get(reverse('sync') + '?since=garbage')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(
+    AWS_REGION='us-east-1',
+    AWS_S3_ENDPOINT_URL=None,
+    AWS_STORAGE_BUCKET_NAME='test-bucket',
+    KEYPHOTO_INGEST_MAX_DIMENSION=800,
+    KEYPHOTO_DERIVATIVE_SIZES=[128],
+)
+@mock_aws
+class KeyPhotoIngestTestCase(APITestCase):
+    """Test case for normalisation of uploaded photos"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='ingest',
+            email='ingest@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket='test-bucket')
+
+    def upload(self, data, name='photo.png', content_type='image/png'):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        photo = SimpleUploadedFile(name, data, content_type=content_type)
+        return self.client.post(reverse('keyphoto-upload'), {
+            'photo': photo,
+            'photo_taken_at': '2025-01-01T10:00:00Z',
+        }, format='multipart')
+
+    def test_upload_is_rotated_downscaled_and_stripped(self):
+        """Test that EXIF orientation is applied, metadata dropped and the photo re-encoded as JPEG"""
+        exif = Image.Exif()
+        exif[0x0112] = 6  # rotate 90 degrees clockwise when displayed
+        exif[0x010F] = 'Phone'
+        output = io.BytesIO()
+        Image.new('RGB', (2000, 1000), (10, 120, 200)).save(output, format='PNG', exif=exif)
+        data = output.getvalue()
+
+        response = self.upload(data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        key_photo = KeyPhoto.objects.get(user=self.user)
+        self.assertTrue(key_photo.s3_path.endswith('.jpg'))
+        self.assertEqual(key_photo.original_file_size, len(data))
+
+        stored = self.s3.get_object(Bucket='test-bucket', Key=key_photo.s3_path)
+        self.assertEqual(stored['ContentType'], 'image/jpeg')
+        body = stored['Body'].read()
+        self.assertEqual(key_photo.file_size, len(body))
+        image = Image.open(io.BytesIO(body))
+        self.assertEqual(image.format, 'JPEG')
+        self.assertEqual(image.size, (400, 800))
+        self.assertEqual(len(image.getexif()), 0)
+
+    def test_undecodable_upload_is_stored_unchanged(self):
+        """Test that an image that can't be decoded is stored as sent"""
+        response = self.upload(b'not really a png')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        key_photo = KeyPhoto.objects.get(user=self.user)
+        self.assertTrue(key_photo.s3_path.endswith('.png'))
+        self.assertEqual(key_photo.file_size, key_photo.original_file_size)
+        stored = self.s3.get_object(Bucket='test-bucket', Key=key_photo.s3_path)
+        self.assertEqual(stored['Body'].read(), b'not really a png')
+
+    def test_normalized_upload_is_stored_unchanged(self):
+        """Test that a metadata-free JPEG within the size limit isn't re-encoded"""
+        data = make_jpeg(640, 480)
+        self.upload(data, name='photo.jpg', content_type='image/jpeg')
+        key_photo = KeyPhoto.objects.get(user=self.user)
+        self.assertEqual(key_photo.file_size, len(data))
+        stored = self.s3.get_object(Bucket='test-bucket', Key=key_photo.s3_path)
+        self.assertEqual(stored['Body'].read(), data)
+
+    def test_larger_output_keeps_the_original(self):
+        """Test that the original is stored when re-encoding wouldn't make it smaller"""
+        output = io.BytesIO()
+        Image.new('RGB', (64, 64), (10, 120, 200)).save(output, format='PNG')
+        data = output.getvalue()
+        with override_settings(KEYPHOTO_INGEST_QUALITY=100):
+            self.upload(data)
+        key_photo = KeyPhoto.objects.get(user=self.user)
+        self.assertTrue(key_photo.s3_path.endswith('.png'))
+        stored = self.s3.get_object(Bucket='test-bucket', Key=key_photo.s3_path)
+        self.assertEqual(stored['Body'].read(), data)
+
+    def test_decoder_crash_is_stored_unchanged(self):
+        """Test that any error while re-encoding falls back to the original"""
+        from timelines.ingest import normalize_image
+        output = io.BytesIO()
+        Image.new('RGB', (3000, 100)).save(output, format='PNG')
+        with mock.patch.object(Image.Image, 'save', side_effect=ValueError('encoder error')), \
+                mock.patch('tempfile.SpooledTemporaryFile.close') as close:
+            self.assertIsNone(normalize_image(output))
+        close.assert_called_once()
+        self.assertEqual(output.tell(), 0)
+
+    def test_spooled_upload_error_marks_failed(self):
+        """Test that an unexpected error in the worker fails the photo and removes its spooled file"""
+        from timelines.tasks import upload_keyphoto_to_s3
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        spool_path = os.path.join(spool_dir, 'photo.jpg')
+        with open(spool_path, 'wb') as f:
+            f.write(make_jpeg())
+        key_photo = KeyPhoto.objects.create(
+            user=self.user, filename='photo.jpg', s3_path=f'users/{self.user.id}/photo.jpg',
+            photo_taken_at=timezone.now(), weight_centigrams=7000, status=KeyPhoto.STATUS_PENDING,
+        )
+        with mock.patch('timelines.tasks.normalize_image', side_effect=RuntimeError('boom')), \
+                self.assertRaises(RuntimeError):
+            upload_keyphoto_to_s3.apply(args=[key_photo.id, spool_path, 'image/jpeg'], throw=True)
+        key_photo.refresh_from_db()
+        self.assertEqual(key_photo.status, KeyPhoto.STATUS_FAILED)
+        self.assertFalse(os.path.exists(spool_path))
+
+    @override_settings(KEYPHOTO_INGEST_ENABLED=False)
+    def test_ingest_can_be_disabled(self):
+        """Test that with ingest disabled the upload is stored byte for byte"""
+        data = make_jpeg()
+        self.upload(data, name='photo.jpg', content_type='image/jpeg')
+        key_photo = KeyPhoto.objects.get(user=self.user)
+        stored = self.s3.get_object(Bucket='test-bucket', Key=key_photo.s3_path)
+        self.assertEqual(stored['Body'].read(), data)
+
+
+@override_settings(
+    AWS_REGION='us-east-1',
+    AWS_S3_ENDPOINT_URL=None,
+    AWS_STORAGE_BUCKET_NAME='test-bucket',
+    TIMELAPSE_FRAME_SIZE=(60, 80),
+    TIMELAPSE_HOLD_FRAMES=2,
+    TIMELAPSE_CROSSFADE_FRAMES=3,
+    TIMELAPSE_RENDER_WORKERS=2,
+    TIMELAPSE_RENDER_EXECUTOR='thread',
+)
+@mock_aws
+class TimelapseTestCase(APITestCase):
+    """Test case for timelapse rendering"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='lapse',
+            email='lapse@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket='test-bucket')
+        for i, color in enumerate([(200, 0, 0), (0, 200, 0), (0, 0, 200)]):
+            self.add_photo(i, color)
+
+    def add_photo(self, i, color):
+        s3_path = f'users/lapse/keyphotos/photo{i}.jpg'
+        self.s3.put_object(Bucket='test-bucket', Key=s3_path, Body=make_jpeg(300, 400, color))
+        return KeyPhoto.objects.create(
+            user=self.user,
+            filename=f'photo{i}.jpg',
+            s3_path=s3_path,
+            photo_taken_at=datetime(2025, 1, 1 + i, 8, 0),
+            weight_centigrams=8000 - i * 50
+        )
+
+    def render(self, data=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('timelapse'), data or {}, format='json')
+
+    def test_render_webp(self):
+        """Test that a render produces an animated WebP with hold and crossfade frames"""
+        response = self.render()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['timelapse']['photo_count'], 3)
+
+        response = self.client.get(reverse('timelapse-detail', args=[response.data['timelapse']['id']]))
+        self.assertEqual(response.data['status'], Timelapse.STATUS_READY)
+        self.assertEqual(response.data['progress'], 1.0)
+        self.assertTrue(response.data['url'])
+
+        timelapse = Timelapse.objects.get(user=self.user)
+        body = self.s3.get_object(Bucket='test-bucket', Key=timelapse.s3_path)['Body'].read()
+        self.assertEqual(timelapse.file_size, len(body))
+        image = Image.open(io.BytesIO(body))
+        self.assertEqual(image.format, 'WEBP')
+        self.assertEqual(image.size, (60, 80))
+        # 3 photos held for 2 frames and 2 transitions of 3 frames at 12 fps; the
+        # encoder merges identical held frames, so compare durations, not frame counts
+        duration = 0
+        for index in range(image.n_frames):
+            image.seek(index)
+            image.load()
+            duration += image.info['duration']
+        self.assertAlmostEqual(duration, (3 * 2 + 2 * 3) * 1000 / 12, delta=image.n_frames)
+
+    def test_webp_writer_spools_frames(self):
+        """Test that held frames are stored once and the frame spool is removed"""
+        from timelines.timelapse import WebPWriter
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'out.webp')
+        writer = WebPWriter(path, (60, 80), 10, 75)
+        red, blue = Image.new('RGB', (60, 80), (255, 0, 0)), Image.new('RGB', (60, 80), (0, 0, 255))
+        for frame in [red, red, red, blue, blue]:
+            writer.add(frame)
+        self.assertEqual(writer.durations, [300, 200])
+        writer.close()
+        self.assertEqual(os.listdir(tmp_dir), ['out.webp'])
+        with Image.open(path) as image:
+            self.assertEqual(image.n_frames, 2)
+
+    def test_same_photos_reuse_render(self):
+        """Test that asking again for the same photos returns the finished render without re-rendering"""
+        first = self.render()
+        with mock.patch('timelines.views.render_keyphoto_timelapse') as task:
+            response = self.render()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], first.data['timelapse']['id'])
+        task.delay.assert_not_called()
+
+        self.add_photo(3, (100, 100, 100))
+        with mock.patch('timelines.views.render_keyphoto_timelapse') as task:
+            response = self.render()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertNotEqual(response.data['timelapse']['id'], first.data['timelapse']['id'])
+        task.delay.assert_called_once()
+
+    def test_date_range_needs_two_photos(self):
+        """Test that a range with fewer than 2 photos is rejected"""
+        response = self.render({'start': '2025-01-03'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(TIMELAPSE_RENDER_EXECUTOR='process')
+    def test_process_pool(self):
+        """Test that frames can be prepared in worker processes"""
+        self.render()
+        self.assertEqual(Timelapse.objects.get(user=self.user).status, Timelapse.STATUS_READY)
+
+    @unittest.skipUnless(shutil.which('ffmpeg'), 'ffmpeg is not installed')
+    def test_render_mp4(self):
+        """Test that mp4 renders are piped through ffmpeg"""
+        self.render({'format': 'mp4'})
+        timelapse = Timelapse.objects.get(user=self.user)
+        self.assertEqual(timelapse.status, Timelapse.STATUS_READY)
+        head = self.s3.head_object(Bucket='test-bucket', Key=timelapse.s3_path)
+        self.assertEqual(head['ContentType'], 'video/mp4')
+
+
+class TimelineKeyPhotosTestCase(APITestCase):
+    """Test case for Timeline membership endpoints"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='member',
+            email='member@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.timeline = Timeline.objects.create(user=self.user, name='Cut')
+        self.key_photos = [
+            KeyPhoto.objects.create(
+                user=self.user,
+                filename=f'photo{i}.jpg',
+                s3_path=f'users/member/keyphotos/photo{i}.jpg',
+                photo_taken_at=timezone.make_aware(datetime(2025, 1, 1 + i, 12, 0)),
+                weight_centigrams=8000 - i
+            )
+            for i in range(5)
+        ]
+        self.url = reverse('timeline-keyphotos', args=[self.timeline.id])
+
+    def ids(self, *indexes):
+        return [self.key_photos[i].id for i in indexes]
+
+    def listed(self, query=''):
+        response = self.client.get(self.url + '?fields=id' + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['id'] for item in response.data['results']]
+
+    def test_add_and_list_in_order(self):
+        """Test that photos are appended in the given order and listed with one query"""
+        response = self.client.post(self.url, {'key_photo_ids': self.ids(3, 0, 1)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(self.url, {'key_photo_ids': self.ids(1, 4)}, format='json')
+        self.assertEqual(response.data, {'added': 1, 'skipped': 1})
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.listed(), self.ids(3, 0, 1, 4))
+
+    def test_date_window(self):
+        """Test that start/end restrict the photos to a range of days"""
+        self.client.post(self.url, {'key_photo_ids': self.ids(0, 1, 2, 3, 4)}, format='json')
+        self.assertEqual(self.listed('&start=2025-01-02&end=2025-01-04'), self.ids(1, 2, 3))
+
+    def test_remove(self):
+        """Test that removing photos deletes memberships but keeps the photos"""
+        self.client.post(self.url, {'key_photo_ids': self.ids(0, 1, 2)}, format='json')
+        response = self.client.delete(self.url, {'key_photo_ids': self.ids(1, 4)}, format='json')
+        self.assertEqual(response.data, {'removed': 1})
+        self.assertEqual(self.listed(), self.ids(0, 2))
+        self.assertEqual(KeyPhoto.objects.filter(user=self.user).count(), 5)
+
+    def test_reorder(self):
+        """Test that listed photos move to the front and the rest keep their order"""
+        self.client.post(self.url, {'key_photo_ids': self.ids(0, 1, 2, 3, 4)}, format='json')
+        order_url = reverse('timeline-keyphotos-order', args=[self.timeline.id])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(order_url, {'key_photo_ids': self.ids(4, 2)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE "timelines_timelinekeyphoto"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(self.listed(), self.ids(4, 2, 0, 1, 3))
+
+        response = self.client.put(order_url, {'key_photo_ids': [999999]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_other_users_photos_and_timelines(self):
+        """Test that another user's photos can't be added and their timelines are 404"""
+        other = User.objects.create_user(username='other', email='other@test.com', password='testpass123')
+        other_photo = KeyPhoto.objects.create(
+            user=other, filename='x.jpg', s3_path='users/other/keyphotos/x.jpg',
+            photo_taken_at=timezone.now(), weight_centigrams=7000
+        )
+        response = self.client.post(self.url, {'key_photo_ids': [other_photo.id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['key_photo_ids'], [other_photo.id])
+
+        other_timeline = Timeline.objects.create(user=other, name='Theirs')
+        response = self.client.get(reverse('timeline-keyphotos', args=[other_timeline.id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_photo_taken_at_is_kept_in_sync(self):
+        """Test that changing a photo's date moves it in date windows"""
+        self.client.post(self.url, {'key_photo_ids': self.ids(0, 1)}, format='json')
+        key_photo = self.key_photos[0]
+        key_photo.photo_taken_at = timezone.make_aware(datetime(2025, 3, 1, 12, 0))
+        key_photo.save()
+        self.assertEqual(
+            TimelineKeyPhoto.objects.get(key_photo=key_photo).photo_taken_at,
+            key_photo.photo_taken_at
+        )
+        self.assertEqual(self.listed('&start=2025-02-01'), self.ids(0))
+
+
+@override_settings(
+    AWS_REGION='us-east-1',
+    AWS_S3_ENDPOINT_URL=None,
+    AWS_STORAGE_BUCKET_NAME='test-bucket',
+    KEYPHOTO_DERIVATIVE_SIZES=[128],
+    SERVER_TIMING_HEADER=True,
+)
+@mock_aws
+class InstrumentationTestCase(APITestCase):
+    """Test case for Server-Timing headers and Prometheus metrics"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='timed',
+            email='timed@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket='test-bucket')
+
+    def server_timing(self, response):
+        return {
+            entry.split(';')[0]: entry
+            for entry in response['Server-Timing'].split(', ')
+        }
+
+    @override_settings(SERVER_TIMING_HEADER=False)
+    def test_header_can_be_turned_off(self):
+        """Test that the timings stay in the metrics when the header is off"""
+        response = self.client.get(reverse('user-keyphotos'))
+        self.assertNotIn('Server-Timing', response)
+
+    def test_list_reports_sql(self):
+        """Test that a list request reports its SQL queries"""
+        response = self.client.get(reverse('user-keyphotos'))
+        timing = self.server_timing(response)
+        self.assertIn('app', timing)
+        self.assertIn('db', timing)
+        self.assertNotIn('s3', timing)
+
+    def test_upload_reports_parse_s3_and_sign(self):
+        """Test that an upload breaks its time down into parsing, S3, signing and SQL"""
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        photo = SimpleUploadedFile('photo.jpg', make_jpeg(), content_type='image/jpeg')
+        response = self.client.post(reverse('keyphoto-upload'), {
+            'photo': photo,
+            'photo_taken_at': '2025-01-01T10:00:00Z',
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        timing = self.server_timing(response)
+        self.assertEqual(set(timing), {'app', 'parse', 'db', 's3', 'sign'})
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_metrics_endpoint(self):
+        """Test that metrics are labelled by URL name and only served with the metrics token"""
+        self.client.get(reverse('user-keyphotos'))
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.content.decode()
+        self.assertIn('gymguru_request_duration_seconds_count{method="GET",status="200",view="user-keyphotos"}', body)
+        self.assertIn('gymguru_request_span_calls_bucket{le="0.0",span="s3",view="user-keyphotos"}', body)
+
+        # Loopback is what every request looks like behind the reverse proxy
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        with override_settings(METRICS_TOKEN=None):
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer None')
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'], DATABASE_REPLICA_MAX_LAG=5)
+class ReplicaRoutingTestCase(TestCase):
+    """Test case for read-replica routing (gymguru.db_router)"""
+
+    def setUp(self):
+        from gymguru.db_router import ReplicaHealth, replica_health
+        cache.clear()
+        replica_health.reset()
+        self.addCleanup(replica_health.reset)
+        self.user = User.objects.create_user(username='reader', password='testpass123')
+        self.other_user = User.objects.create_user(username='other-reader', password='testpass123')
+        # The replica aliases don't exist here, only routing decisions are checked
+        lag = mock.patch.object(ReplicaHealth, 'measure_lag', return_value=0.0)
+        self.measure_lag = lag.start()
+        self.addCleanup(lag.stop)
+
+    def route(self, method, view_class, user=None, write=False):
+        """Runs a request through ReplicaRoutingMiddleware, returns the alias its reads went to"""
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from rest_framework_simplejwt.tokens import AccessToken
+        from gymguru.db_router import ReplicaRouter, ReplicaRoutingMiddleware
+
+        router = ReplicaRouter()
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}'} if user else {}
+        request = getattr(RequestFactory(), method)('/', **headers)
+
+        def view(request):
+            if write:
+                router.db_for_write(KeyPhoto)
+            return HttpResponse(router.db_for_read(KeyPhoto) or 'default')
+        view.view_class = view_class
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request)
+        middleware = ReplicaRoutingMiddleware(get_response)
+        return middleware(request).content.decode()
+
+    def test_safe_reads_go_to_replicas(self):
+        """Test that only safe-method requests to replica_reads views read from a replica"""
+        from gymguru.db_router import ReplicaRouter
+        from timelines import views
+        for view_class in (views.UserKeyPhotosView, views.UserTimelinesView,
+                           views.TimelineTypeView, views.KeyPhotoDetailView):
+            self.assertIn(self.route('get', view_class, self.user), ('replica1', 'replica2'))
+        self.assertEqual(self.route('put', views.KeyPhotoDetailView, self.user), 'default')
+        self.assertEqual(self.route('get', views.KeyPhotoStatusView, self.user), 'default')
+        # Celery tasks, management commands
+        self.assertIsNone(ReplicaRouter().db_for_read(KeyPhoto))
+
+    def test_reads_stick_to_primary_after_a_write(self):
+        """Test that a client reads its own writes for DATABASE_STICKY_SECONDS"""
+        from gymguru.db_router import sticky_cache_key
+        from timelines import views
+        # Reads after a write in the same request
+        self.assertEqual(self.route('get', views.UserKeyPhotosView, self.user, write=True), 'default')
+
+        self.route('post', views.KeyPhotoUploadView, self.user, write=True)
+        self.assertEqual(self.route('get', views.UserKeyPhotosView, self.user), 'default')
+        self.assertIn(self.route('get', views.UserKeyPhotosView, self.other_user), ('replica1', 'replica2'))
+
+        cache.delete(sticky_cache_key(self.user.id))
+        self.assertIn(self.route('get', views.UserKeyPhotosView, self.user), ('replica1', 'replica2'))
+
+    def test_background_changes_stick_to_primary(self):
+        """Test that a collection change outside a request, e.g. a Celery task, keeps its owner on the primary"""
+        from timelines import versioning, views
+        with self.captureOnCommitCallbacks(execute=True):
+            versioning.bump_collection_version(self.user.id, versioning.KEYPHOTOS)
+        self.assertEqual(self.route('get', views.UserKeyPhotosView, self.user), 'default')
+        self.assertIn(self.route('get', views.UserKeyPhotosView, self.other_user), ('replica1', 'replica2'))
+
+    def test_lagging_replicas_are_left_out(self):
+        """Test that replicas behind by more than DATABASE_REPLICA_MAX_LAG, or down, get no reads"""
+        from django.db import OperationalError
+        from gymguru.db_router import replica_health
+        from timelines import views
+        self.measure_lag.side_effect = lambda alias: 30.0 if alias == 'replica1' else 0.0
+        for _ in range(5):
+            self.assertEqual(self.route('get', views.UserKeyPhotosView, self.user), 'replica2')
+        # Checked once per DATABASE_REPLICA_CHECK_INTERVAL, not per request
+        self.assertEqual(self.measure_lag.call_count, 2)
+
+        self.measure_lag.side_effect = OperationalError('connection refused')
+        replica_health.reset()
+        self.assertEqual(self.route('get', views.UserKeyPhotosView, self.user), 'default')
+
+    def test_query_metrics_by_alias(self):
+        """Test that SQL query time is recorded per database alias"""
+        from prometheus_client import REGISTRY
+        sample = 'gymguru_db_query_duration_seconds_count'
+        before = REGISTRY.get_sample_value(sample, {'alias': 'default'}) or 0
+        list(KeyPhoto.objects.all())
+        self.assertEqual(REGISTRY.get_sample_value(sample, {'alias': 'default'}), before + 1)
+
+
+class PrebuiltApiSchemaTestCase(TestCase):
+    """Test case for the OpenAPI schema built by build_api_schema"""
+
+    def setUp(self):
+        self.schema_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.schema_dir)
+        overridden = override_settings(API_SCHEMA_DIR=self.schema_dir)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        self.url = reverse('schema-swagger-ui') + '?format=openapi'
+
+    def build(self):
+        from django.core.management import call_command
+        call_command('build_api_schema', stdout=io.StringIO())
+
+    def test_unbuilt_schema_is_unavailable(self):
+        """Test that the spec is not generated live outside DEBUG"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_schema_is_served_from_artifact(self):
+        """Test that the spec comes from the files, without generating it"""
+        from drf_yasg.generators import OpenAPISchemaGenerator
+        self.build()
+        with mock.patch.object(OpenAPISchemaGenerator, 'get_schema', side_effect=AssertionError):
+            response = self.client.get(self.url)
+            yaml_response = self.client.get(reverse('schema-redoc') + '?format=yaml')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with open(os.path.join(self.schema_dir, 'openapi.json'), 'rb') as f:
+            self.assertEqual(response.content, f.read())
+        self.assertTrue(response['Content-Type'].startswith('application/openapi+json'))
+        self.assertIn('/keyphoto/new/', json.loads(response.content)['paths'])
+        self.assertTrue(yaml_response.content.startswith(b"swagger: '2.0'"))
+        self.assertNotEqual(yaml_response['ETag'], response['ETag'])
+
+    def test_version_file_is_written_last(self):
+        """Test that servers only see a new version once all its files are in place"""
+        from gymguru.schema import build_schema
+        replaced = []
+        os_replace = os.replace
+        with mock.patch('gymguru.schema.os.replace', side_effect=lambda src, dst: (
+            replaced.append(os.path.basename(dst)), os_replace(src, dst)
+        )):
+            build_schema(self.schema_dir)
+        self.assertEqual(replaced[-1], 'openapi.version')
+        self.assertEqual(len(replaced), 5)
+
+    def test_etag_and_gzip(self):
+        """Test that revalidations get a 304 and gzip is used when accepted"""
+        import gzip
+        self.build()
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        plain = self.client.get(self.url)
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response['ETag'], plain['ETag'])
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=plain['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_rebuild_changes_version(self):
+        """Test that a rebuilt schema with different content gets a new ETag"""
+        self.build()
+        etag = self.client.get(self.url)['ETag']
+        with mock.patch('gymguru.schema.API_INFO.description', 'Changed'):
+            self.build()
+        self.assertNotEqual(self.client.get(self.url)['ETag'], etag)
+
+    def test_artifact_matches_live_schema(self):
+        """Test that the prebuilt spec is what DEBUG generates live, minus the host"""
+        self.build()
+        artifact = json.loads(self.client.get(self.url).content)
+        with override_settings(DEBUG=True):
+            live = json.loads(self.client.get(self.url).content)
+        live.pop('host')
+        live.pop('schemes')
+        self.assertEqual(artifact, live)
+
+    def test_ui_pages(self):
+        """Test that swagger/ and redoc/ still render"""
+        self.build()
+        for name in ('schema-swagger-ui', 'schema-redoc'):
+            response = self.client.get(reverse(name), HTTP_ACCEPT='text/html')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertContains(response, 'GymGuru API')
+
+
+@override_settings(
+    AWS_REGION='us-east-1',
+    AWS_S3_ENDPOINT_URL=None,
+    AWS_STORAGE_BUCKET_NAME='test-bucket',
+)
+@mock_aws
+class SeedBenchmarkCommandTestCase(TestCase):
+    """Test case for the seed_benchmark management command"""
+
+    def seed(self, *args):
+        from django.core.management import call_command
+        call_command(
+            'seed_benchmark', '--users', '2', '--photos', '3', '--timelines', '2',
+            '--photo-size', '32', *args, stdout=io.StringIO()
+        )
+
+    def test_seed_is_repeatable(self):
+        """Test that seeding creates the bucket and objects, and re-seeding replaces the data"""
+        self.seed('--force')
+        self.seed('--force')
+        users = User.objects.filter(username__startswith='bench')
+        self.assertEqual(users.count(), 2)
+        self.assertEqual(KeyPhoto.objects.filter(user__in=users).count(), 6)
+        self.assertEqual(Timeline.objects.filter(user__in=users).count(), 4)
+        self.assertEqual(TimelineKeyPhoto.objects.count(), 6)
+        self.assertTrue(users[0].check_password('benchpass123'))
+
+        s3 = boto3.client('s3', region_name='us-east-1')
+        for key_photo in KeyPhoto.objects.all():
+            s3.head_object(Bucket='test-bucket', Key=key_photo.s3_path)
+
+    def test_refuses_without_debug(self):
+        """Test that seeding needs DEBUG or --force"""
+        from django.core.management.base import CommandError
+        with self.assertRaisesMessage(CommandError, '--force'):
+            self.seed()
+        self.assertFalse(User.objects.exists())
+        with override_settings(DEBUG=True):
+            self.seed()
+        self.assertEqual(User.objects.count(), 2)
+
+    def test_leaves_other_users_alone(self):
+        """Test that users the command didn't create are never reset"""
+        from django.core.management.base import CommandError
+        user = User.objects.create_user(username='bench1', email='real@example.com', password='mine')
+        KeyPhoto.objects.create(
+            user=user, filename='mine.jpg', s3_path='users/bench1/keyphotos/mine.jpg',
+            photo_taken_at=timezone.now(), weight_centigrams=7000
+        )
+        with self.assertRaisesMessage(CommandError, 'bench1'):
+            self.seed('--force')
+        user.refresh_from_db()
+        self.assertTrue(user.check_password('mine'))
+        self.assertEqual(KeyPhoto.objects.filter(user=user).count(), 1)
+        self.assertFalse(User.objects.filter(username='bench0').exists())
+
+
+class AsyncViewsTestCase(TestCase):
+    """Test case for the native async upload, download and list views (against a local moto server)"""
+
+    @classmethod
+    def setUpClass(cls):
+        import logging
+        from moto.server import ThreadedMotoServer
+        super().setUpClass()
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        cls.server = ThreadedMotoServer(ip_address='127.0.0.1', port=0, verbose=False)
+        cls.server.start()
+        host, port = cls.server.get_host_and_port()
+        cls.settings_override = override_settings(
+            AWS_REGION='us-east-1',
+            AWS_S3_ENDPOINT_URL=f'http://{host}:{port}',
+            AWS_STORAGE_BUCKET_NAME='async-bucket',
+            AWS_ACCESS_KEY_ID='testing',
+            AWS_SECRET_ACCESS_KEY='testing',
+        )
+        cls.settings_override.enable()
+        cls.s3 = storage.get_s3_client()
+        cls.s3.create_bucket(Bucket='async-bucket')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        from django.test import AsyncRequestFactory
+        from rest_framework_simplejwt.tokens import AccessToken
+        cache.clear()
+        self.user = User.objects.create_user(username='async', password='testpass123')
+        self.other_user = User.objects.create_user(username='other', password='testpass123')
+        self.factory = AsyncRequestFactory()
+        self.auth = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        self.body = bytes(range(256)) * 64
+        self.s3.put_object(Bucket='async-bucket', Key='users/async/keyphotos/photo.jpg', Body=self.body)
+        self.key_photo = KeyPhoto.objects.create(
+            user=self.user,
+            filename='photo.jpg',
+            s3_path='users/async/keyphotos/photo.jpg',
+            photo_taken_at=timezone.now(),
+            weight_centigrams=7500
+        )
+
+    async def download(self, pk, **headers):
+        from .async_views import KeyPhotoDownloadView
+        request = self.factory.get(f'/api/keyphoto/{pk}/download/', headers={**self.auth, **headers})
+        response = await KeyPhotoDownloadView.as_view()(request, pk=pk)
+        content = b''
+        if response.streaming:
+            content = b''.join([chunk async for chunk in response.streaming_content])
+        return response, content
+
+    async def test_download_streams_object(self):
+        """Test full, ranged and conditional downloads"""
+        response, content = await self.download(self.key_photo.pk)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(content, self.body)
+        self.assertEqual(int(response['Content-Length']), len(self.body))
+
+        response, content = await self.download(self.key_photo.pk, Range='bytes=10-19')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(content, self.body[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.body)}')
+
+        response, _ = await self.download(self.key_photo.pk, **{'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    async def test_download_uses_disk_cache(self):
+        """Test that full downloads fill the disk cache and later requests are served from it"""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        with override_settings(KEYPHOTO_DISK_CACHE_DIR=cache_dir):
+            response, content = await self.download(self.key_photo.pk, Range='bytes=10-19')
+            self.assertEqual(content, self.body[10:20])
+            self.assertEqual(os.listdir(cache_dir), [])
+
+            response, content = await self.download(self.key_photo.pk)
+            self.assertEqual(content, self.body)
+            self.s3.delete_object(Bucket='async-bucket', Key=self.key_photo.s3_path)
+
+            response, content = await self.download(self.key_photo.pk)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(content, self.body)
+            response, content = await self.download(self.key_photo.pk, Range='bytes=10-19')
+            self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+            self.assertEqual(content, self.body[10:20])
+            self.assertEqual(response['Content-Length'], '10')
+
+    async def test_download_errors(self):
+        """Test missing credentials, other users' photos and missing objects"""
+        from .async_views import KeyPhotoDownloadView
+        request = self.factory.get(f'/api/keyphoto/{self.key_photo.pk}/download/')
+        response = await KeyPhotoDownloadView.as_view()(request, pk=self.key_photo.pk)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn('Bearer', response['WWW-Authenticate'])
+
+        other = await KeyPhoto.objects.acreate(
+            user=self.other_user, filename='x.jpg', s3_path='users/other/keyphotos/x.jpg',
+            photo_taken_at=timezone.now(), weight_centigrams=7000
+        )
+        response, _ = await self.download(other.pk)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(json.loads(response.content), {'detail': 'Not found.'})
+
+        missing = await KeyPhoto.objects.acreate(
+            user=self.user, filename='gone.jpg', s3_path='users/async/keyphotos/gone.jpg',
+            photo_taken_at=timezone.now(), weight_centigrams=7000
+        )
+        response, _ = await self.download(missing.pk)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_session_authentication(self):
+        """Test that logged-in session users are authenticated like by the DRF views, CSRF check included"""
+        from .async_views import KeyPhotoDownloadView, KeyPhotoUploadView
+        request = self.factory.get(f'/api/keyphoto/{self.key_photo.pk}/download/')
+        request.user = self.user  # set by AuthenticationMiddleware from the session
+        response = await KeyPhotoDownloadView.as_view()(request, pk=self.key_photo.pk)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        request = self.factory.post('/api/keyphoto/new/', {'photo_taken_at': '2025-01-01T10:00:00Z'})
+        request.user = self.user
+        response = await KeyPhotoUploadView.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertIn('CSRF', json.loads(response.content)['detail'])
+
+    async def test_upload(self):
+        """Test that an upload is normalized, stored in S3 and deduplicated on retry"""
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from .async_views import KeyPhotoUploadView
+        photo = make_jpeg()
+
+        async def upload():
+            request = self.factory.post('/api/keyphoto/new/', {
+                'photo': SimpleUploadedFile('photo.jpg', photo, content_type='image/jpeg'),
+                'photo_taken_at': '2025-01-01T10:00:00Z',
+            }, headers=self.auth)
+            response = await KeyPhotoUploadView.as_view()(request)
+            return response, json.loads(response.content)
+
+        with self.captureOnCommitCallbacks(execute=False):
+            response, data = await upload()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        key_photo = await KeyPhoto.objects.aget(pk=data['key_photo']['id'])
+        self.assertEqual(key_photo.user_id, self.user.id)
+        self.assertEqual(key_photo.original_file_size, len(photo))
+        head = self.s3.head_object(Bucket='async-bucket', Key=key_photo.s3_path)
+        self.assertEqual(head['ContentLength'], key_photo.file_size)
+        self.assertEqual(head['ContentType'], 'image/jpeg')
+
+        response, data = await upload()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(data['duplicate'])
+
+    def test_list_matches_sync_view(self):
+        """Test that the async list view answers like the DRF one, including 304s"""
+        from asgiref.sync import async_to_sync
+        from .async_views import UserKeyPhotosView
+        url = reverse('user-keyphotos') + '?fields=id,filename,presigned_url'
+        expected = self.client.get(url, headers=self.auth)
+
+        request = self.factory.get(url, headers=self.auth)
+        response = async_to_sync(UserKeyPhotosView.as_view())(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(response['ETag'], expected['ETag'])
+
+        request = self.factory.get(url, headers={**self.auth, 'If-None-Match': response['ETag']})
+        response = async_to_sync(UserKeyPhotosView.as_view())(request)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_instrumentation_middleware_is_async(self):
+        """Test that the middleware runs natively in an async stack"""
+        from asgiref.sync import async_to_sync, iscoroutinefunction
+        from django.http import HttpResponse as DjangoHttpResponse
+        from gymguru.instrumentation import InstrumentationMiddleware, timed
+
+        async def view(request):
+            with timed('s3'):
+                pass
+            return DjangoHttpResponse(b'ok')
+
+        middleware = InstrumentationMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        with override_settings(SERVER_TIMING_HEADER=True):
+            response = async_to_sync(middleware)(self.factory.get('/'))
+        self.assertIn('s3;dur=', response['Server-Timing'])
@@ -0,0 +1,219 @@
+"""
+Timelapse rendering from a user's KeyPhotos.
+
+Photos stream through a bounded pipeline: a thread pool downloads them from
+S3, a process pool decodes, letterboxes and labels them (timelines.frames)
+and the frames are blended and handed to the encoder one at a time, so
+memory depends on the pool size rather than on the number of photos.
+"""
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from PIL import Image, TiffImagePlugin
+
+from timelines.frames import prepare_frame
+from timelines.models import KeyPhoto, Timelapse
+from timelines.rollups import local_date
+from timelines.storage import get_s3_client
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {
+    Timelapse.FORMAT_WEBP: 'image/webp',
+    Timelapse.FORMAT_MP4: 'video/mp4',
+}
+
+
+def timelapse_source(user, start=None, end=None):
+    """The user's stored, non-deleted KeyPhotos in frame order"""
+    key_photos = KeyPhoto.objects.filter(user=user, is_deleted=False, status=KeyPhoto.STATUS_READY)
+    if start:
+        key_photos = key_photos.filter(photo_taken_at__date__gte=start)
+    if end:
+        key_photos = key_photos.filter(photo_taken_at__date__lte=end)
+    return key_photos.order_by('photo_taken_at', 'id')[:settings.TIMELAPSE_MAX_PHOTOS]
+
+
+def source_s3_path(key_photo):
+    """Smallest stored version of the photo that still covers a whole frame"""
+    needed = max(settings.TIMELAPSE_FRAME_SIZE)
+    for size in sorted(int(size) for size in key_photo.derivatives):
+        if size >= needed:
+            return key_photo.derivatives[str(size)]['s3_path']
+    return key_photo.s3_path
+
+
+def frame_label(key_photo):
+    return f"{local_date(key_photo.photo_taken_at):%Y-%m-%d}  {key_photo.weight_kg:.1f} kg"
+
+
+def render_options(image_format):
+    return {
+        'format': image_format,
+        'frame_size': list(settings.TIMELAPSE_FRAME_SIZE),
+        'fps': settings.TIMELAPSE_FPS,
+        'hold_frames': settings.TIMELAPSE_HOLD_FRAMES,
+        'crossfade_frames': settings.TIMELAPSE_CROSSFADE_FRAMES,
+        'quality': settings.TIMELAPSE_QUALITY,
+    }
+
+
+def timelapse_input_hash(key_photos, image_format):
+    """Identifies a render: same photos, labels and options give the same hash"""
+    payload = {
+        'options': render_options(image_format),
+        'photos': [[key_photo.id, source_s3_path(key_photo), frame_label(key_photo)] for key_photo in key_photos],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+class WebPWriter:
+    """
+    Animated WebP. Pillow's save_all() wants every frame up front, so frames
+    are spooled to a temporary multi-frame TIFF as they are produced and
+    encoded from it at the end; Pillow reads that back one frame at a time,
+    so memory doesn't grow with the number of photos. Repeats of the same
+    frame (holds) are stored once with a longer duration.
+    """
+
+    def __init__(self, path, size, fps, quality):
+        self.path = path
+        self.duration = 1000 / fps
+        self.quality = quality
+        fd, self.spool_path = tempfile.mkstemp(suffix='.tiff', dir=os.path.dirname(path) or None)
+        os.close(fd)
+        self.spool = TiffImagePlugin.AppendingTiffWriter(self.spool_path, new=True)
+        self.durations = []
+        self.last_frame = None
+
+    def add(self, frame):
+        if frame is self.last_frame:
+            self.durations[-1] += self.duration
+            return
+        frame.save(self.spool, format='TIFF', compression='tiff_adobe_deflate')
+        self.spool.newFrame()
+        self.durations.append(self.duration)
+        self.last_frame = frame
+
+    def close(self):
+        self.spool.close()
+        try:
+            with Image.open(self.spool_path) as frames:
+                frames.save(
+                    self.path, format='WEBP', save_all=True, duration=self.durations, loop=0,
+                    background=(0, 0, 0, 255), quality=self.quality,
+                )
+        finally:
+            os.remove(self.spool_path)
+
+    def abort(self):
+        self.spool.close()
+        os.remove(self.spool_path)
+
+
+class MP4Writer:
+    """H.264 MP4 by piping raw frames into ffmpeg"""
+
+    def __init__(self, path, size, fps, quality):
+        width, height = size
+        crf = round((100 - quality) * 0.4 + 12)
+        self.process = subprocess.Popen(
+            [
+                settings.TIMELAPSE_FFMPEG_BINARY, '-y', '-loglevel', 'error',
+                '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+                '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-crf', str(crf), '-movflags', '+faststart',
+                path,
+            ],
+            stdin=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+    def add(self, frame):
+        self.process.stdin.write(frame.tobytes())
+
+    def close(self):
+        self.process.stdin.close()
+        stderr = self.process.stderr.read()
+        if self.process.wait() != 0:
+            raise OSError(f'ffmpeg failed: {stderr.decode(errors="replace").strip()}')
+
+    def abort(self):
+        self.process.kill()
+        self.process.wait()
+
+
+WRITERS = {
+    Timelapse.FORMAT_WEBP: WebPWriter,
+    Timelapse.FORMAT_MP4: MP4Writer,
+}
+
+
+def _bounded_map(executor, fn, argument_tuples, window):
+    """executor.map() that keeps at most `window` calls in flight and yields results in order"""
+    pending = deque()
+    for args in argument_tuples:
+        pending.append(executor.submit(fn, *args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def write_timelapse(key_photos, path, image_format, on_progress=None):
+    """
+    Renders `key_photos` in order to a file at `path`. Calls on_progress(n)
+    after each photo and returns how many photos made it into the video.
+    """
+    size = tuple(settings.TIMELAPSE_FRAME_SIZE)
+    workers = settings.TIMELAPSE_RENDER_WORKERS
+    hold_frames = settings.TIMELAPSE_HOLD_FRAMES
+    crossfade_frames = settings.TIMELAPSE_CROSSFADE_FRAMES
+    s3_client = get_s3_client()
+    bucket_name = settings.AWS_STORAGE_BUCKET_NAME
+
+    def download(key_photo):
+        s3_path = source_s3_path(key_photo)
+        try:
+            data = s3_client.get_object(Bucket=bucket_name, Key=s3_path)['Body'].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                raise
+            logger.warning('Skipping KeyPhoto %s in timelapse, %s is missing', key_photo.id, s3_path)
+            data = None
+        return data, size, frame_label(key_photo)
+
+    executor_class = ProcessPoolExecutor if settings.TIMELAPSE_RENDER_EXECUTOR == 'process' else ThreadPoolExecutor
+    writer = WRITERS[image_format](path, size, settings.TIMELAPSE_FPS, settings.TIMELAPSE_QUALITY)
+    previous = None
+    rendered = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as io_pool, executor_class(max_workers=workers) as cpu_pool:
+            downloads = _bounded_map(io_pool, download, ((key_photo,) for key_photo in key_photos), workers * 2)
+            frames = _bounded_map(cpu_pool, prepare_frame, downloads, workers * 2)
+            for index, data in enumerate(frames, 1):
+                if data is not None:
+                    frame = Image.frombytes('RGB', size, data)
+                    if previous is not None:
+                        for step in range(1, crossfade_frames + 1):
+                            writer.add(Image.blend(previous, frame, step / (crossfade_frames + 1)))
+                    for _ in range(hold_frames):
+                        writer.add(frame)
+                    previous = frame
+                    rendered += 1
+                if on_progress:
+                    on_progress(index)
+        if not rendered:
+            raise ValueError('None of the photos could be decoded')
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    return rendered
@@ -1,6 +1,11 @@
+from django.conf import settings
 from django.urls import include, path
 from . import views
-from .views import TimelineTypeView, NewTimelineView, PhotoUploadView, KeyPhotoUploadView, KeyPhotoDetailView, KeyPhotoDownloadView, UserKeyPhotosView, UserTimelinesView
+from .views import TimelineTypeView, NewTimelineView, PhotoUploadView, KeyPhotoUploadView, KeyPhotoBulkUploadView, KeyPhotoStatusView, KeyPhotoUploadInitiateView, KeyPhotoUploadCompleteView, KeyPhotoDetailView, KeyPhotoDownloadView, UserKeyPhotosView, UserTimelinesView, StoragePoolStatsView, DownloadCacheStatsView, WeightAnalyticsView, SyncView, TimelapseView, TimelapseDetailView, TimelineKeyPhotosView, TimelineKeyPhotosOrderView
+
+# Under ASGI the S3-bound views can be served by their native async versions
+if settings.ASYNC_S3_VIEWS:
+    from .async_views import KeyPhotoUploadView, KeyPhotoDownloadView, UserKeyPhotosView, UserTimelinesView
 
 # URLconf
 urlpatterns = [
@@ -8,8 +13,20 @@ urlpatterns = [
     path('timeline-types/', TimelineTypeView.as_view(), name='timeline-types'),
     path('upload-on-server/', PhotoUploadView.as_view(), name='upload-on-server'),
     path('keyphoto/new/', KeyPhotoUploadView.as_view(), name='keyphoto-upload'),
+    path('keyphoto/bulk/', KeyPhotoBulkUploadView.as_view(), name='keyphoto-bulk-upload'),
+    path('keyphoto/upload/initiate/', KeyPhotoUploadInitiateView.as_view(), name='keyphoto-upload-initiate'),
+    path('keyphoto/upload/complete/', KeyPhotoUploadCompleteView.as_view(), name='keyphoto-upload-complete'),
     path('keyphoto/<int:pk>/', KeyPhotoDetailView.as_view(), name='keyphoto-detail'),
+    path('keyphoto/<int:pk>/status/', KeyPhotoStatusView.as_view(), name='keyphoto-status'),
     path('keyphoto/<int:pk>/download/', KeyPhotoDownloadView.as_view(), name='keyphoto-download'),
+    path('timeline/<int:pk>/keyphotos/', TimelineKeyPhotosView.as_view(), name='timeline-keyphotos'),
+    path('timeline/<int:pk>/keyphotos/order/', TimelineKeyPhotosOrderView.as_view(), name='timeline-keyphotos-order'),
     path('my-keyphotos/', UserKeyPhotosView.as_view(), name='user-keyphotos'),
     path('my-timelines/', UserTimelinesView.as_view(), name='user-timelines'),
+    path('timelapse/', TimelapseView.as_view(), name='timelapse'),
+    path('timelapse/<int:pk>/', TimelapseDetailView.as_view(), name='timelapse-detail'),
+    path('sync/', SyncView.as_view(), name='sync'),
+    path('weights/', WeightAnalyticsView.as_view(), name='weights'),
+    path('storage/stats/', StoragePoolStatsView.as_view(), name='storage-stats'),
+    path('storage/download-cache/', DownloadCacheStatsView.as_view(), name='storage-download-cache'),
 ]
\ No newline at end of file
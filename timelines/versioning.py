@@ -0,0 +1,64 @@
+"""
+Per-user collection versions for cheap conditional GETs.
+
+Every change to a user's KeyPhotos or Timelines replaces a random version
+token in the cache; list endpoints derive their ETag from it, so an
+unchanged poll is answered with 304 after a single cache lookup. If the
+token is evicted a new one is generated, which only costs a full response.
+
+A bump also keeps the owner's reads on the primary for a while (see
+gymguru.db_router), whatever made the change: a page read from a lagging
+replica under the new version's ETag would otherwise stay cached by clients.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from gymguru.db_router import sticky_cache_key
+
+KEYPHOTOS = 'keyphotos'
+TIMELINES = 'timelines'
+
+
+def _version_key(user_id, collection):
+    return f'collection-version:{collection}:{user_id}'
+
+
+def get_collection_version(user_id, collection):
+    key = _version_key(user_id, collection)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(key, version, timeout=None):
+            # Another request initialised it first
+            version = cache.get(key, version)
+    return version
+
+
+def bump_collection_version(user_id, collection):
+    """Invalidates ETags of the collection once the current transaction commits"""
+    if user_id is None:
+        return
+
+    def bump():
+        # Sticky first, so no request sees the new version and still reads from a replica
+        if settings.DATABASE_REPLICAS:
+            cache.set(sticky_cache_key(user_id), True, timeout=settings.DATABASE_STICKY_SECONDS)
+        cache.set(_version_key(user_id, collection), uuid.uuid4().hex, timeout=None)
+
+    transaction.on_commit(bump)
+
+
+def collection_etag(request, collection, includes_presigned_urls=False):
+    """ETag for a list response of `collection` for the current user and query string"""
+    parts = [get_collection_version(request.user.id, collection), request.get_full_path()]
+    if includes_presigned_urls:
+        # Presigned urls expire, so the same list must be re-served before the
+        # urls a client already holds run out (see KEYPHOTO_PRESIGNED_URL_CACHE_MARGIN)
+        window = max(settings.KEYPHOTO_PRESIGNED_URL_CACHE_MARGIN // 2, 1)
+        parts.append(str(int(timezone.now().timestamp()) // window))
+    return hashlib.md5(':'.join(parts).encode()).hexdigest()
@@ -1,23 +1,61 @@
 import os
+import base64
+import json
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from django.shortcuts import render
-from django.http import JsonResponse, HttpResponse, FileResponse, Http404
+from django.http import JsonResponse, HttpResponse, FileResponse, StreamingHttpResponse, Http404
 from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Max, Value, When
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date
+from django.views.decorators.http import condition
 import mimetypes
+from datetime import timedelta
 
 
 from rest_framework import permissions, generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.parsers import FormParser
 from rest_framework.decorators import api_view
 from rest_framework.parsers import JSONParser
+from rest_framework.exceptions import ValidationError
+from rest_framework.reverse import reverse
 
-from timelines.serializers import TimelineTypeSerializer, NewTimelineSerializer, KeyPhotoSerializer
-from timelines.models import TimelineType, KeyPhoto, Timeline
+from timelines.serializers import (
+    TimelineTypeSerializer,
+    NewTimelineSerializer,
+    KeyPhotoSerializer,
+    KeyPhotoUploadInitiateSerializer,
+    KeyPhotoUploadCompleteSerializer,
+    WeightAnalyticsQuerySerializer,
+    TimelapseRequestSerializer,
+    TimelineKeyPhotoIdsSerializer,
+    TimelineKeyPhotosQuerySerializer,
+    TimelapseSerializer,
+)
+from timelines.models import TimelineType, KeyPhoto, Timeline, TimelineKeyPhoto, Timelapse
+from timelines import versioning
+from timelines.analytics import weight_series
+from timelines.disk_cache import get_download_cache
+from timelines.fast_serializers import KeyPhotoValuesSerializer, TimelineValuesSerializer
+from timelines.ingest import normalize_image, with_extension
+from timelines.pagination import CreatedCursorPagination
+from timelines.rollups import local_date, local_day_start, refresh_rollup_days
+from timelines.sync import changes_since
+from timelines.tasks import render_keyphoto_timelapse, schedule_derivatives, spool_upload, upload_keyphoto_to_s3
+from timelines.timelapse import timelapse_input_hash, timelapse_source
+from timelines.storage import delete_objects, get_s3_client, get_object_metadata, get_presigned_url, pool_stats, sha256_file
 
-import boto3
-from botocore.exceptions import ClientError
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import BotoCoreError, ClientError
+
+from auf.authentication import TokenUserReadsMixin
+from gymguru.instrumentation import TimedMultiPartParser, bind_request_stats, timed
 
 # print('AWS_ACCESS_KEY_ID:', os.environ.get('AWS_ACCESS_KEY_ID'))
 # print('AWS_SECRET_ACCESS_KEY:', os.environ.get('AWS_SECRET_ACCESS_KEY'))
@@ -29,6 +67,7 @@ class TimelineTypeView(generics.ListAPIView):
     serializer_class = TimelineTypeSerializer
     permission_classes = [permissions.IsAuthenticated]
     http_method_names = ['get']
+    replica_reads = True
 
 
 class NewTimelineView(APIView):
@@ -51,7 +90,7 @@ class NewTimelineView(APIView):
 
 class PhotoUploadView(APIView):
     permission_classes = [permissions.IsAuthenticated]
-    parser_classes = [MultiPartParser, FormParser]
+    parser_classes = [TimedMultiPartParser, FormParser]
     
     def post(self, request):
         """
@@ -106,10 +145,118 @@ class PhotoUploadView(APIView):
             )
 
 
+UPLOAD_TOKEN_SALT = 'timelines.keyphoto-upload'
+
+
+def _get_requested_size(request):
+    """Validated `size` query parameter (a derivative size or 'original'), or None"""
+    size = request.GET.get('size')
+    if not size or size == 'original':
+        return None
+    if not size.isdigit() or int(size) not in settings.KEYPHOTO_DERIVATIVE_SIZES:
+        choices = ', '.join(str(choice) for choice in settings.KEYPHOTO_DERIVATIVE_SIZES)
+        raise ValidationError({'size': f'Must be one of: {choices}, original'})
+    return int(size)
+
+
+def _keyphoto_s3_path(user, filename):
+    return f"users/{user.username}/keyphotos/{filename}"
+
+
+def _s3_sha256_checksum(content_hash):
+    """A hex SHA-256 in the base64 form S3 uses for ChecksumSHA256"""
+    return base64.b64encode(bytes.fromhex(content_hash)).decode()
+
+
+def _duplicate_payload(key_photo):
+    """Answer for an upload whose content the user already has"""
+    data = KeyPhotoSerializer(key_photo).data
+    return {
+        'message': 'Photo already uploaded',
+        'duplicate': True,
+        'key_photo': data,
+        'presigned_url': data['presigned_url'],
+        'filename': key_photo.filename
+    }
+
+
+def _duplicate_response(key_photo):
+    return Response(_duplicate_payload(key_photo), status=status.HTTP_200_OK)
+
+
+def _abort_multipart_upload(s3_client, upload):
+    """Frees the parts of a multipart upload that won't be completed; reconcile_s3_objects gets any left over"""
+    try:
+        s3_client.abort_multipart_upload(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+            Key=upload['s3_path'],
+            UploadId=upload['upload_id']
+        )
+    except (BotoCoreError, ClientError):
+        pass
+
+
+def _key_photo_upload_data(unique_filename, s3_path, photo_taken_at, file_size, content_hash, weight_centigrams):
+    """KeyPhotoSerializer input for an uploaded photo"""
+    key_photo_data = {
+        'filename': unique_filename,
+        's3_path': s3_path,
+        'photo_taken_at': photo_taken_at,
+        'file_size': file_size,
+        'content_hash': content_hash,
+    }
+    # Add weight if provided
+    if weight_centigrams:
+        key_photo_data['weight_centigrams'] = int(weight_centigrams)
+    return key_photo_data
+
+
+def _save_uploaded_keyphoto(request, key_photo_data, original_file_size, presigned_url):
+    """Creates the KeyPhoto of a photo already in S3, returns (payload, status)"""
+    serializer = KeyPhotoSerializer(data=key_photo_data, context={'request': request})
+    if not serializer.is_valid():
+        return {'error': 'Validation error', 'details': serializer.errors}, status.HTTP_400_BAD_REQUEST
+    key_photo = serializer.save(original_file_size=original_file_size)
+    schedule_derivatives(key_photo)
+    return {
+        'message': 'Photo uploaded to S3 and saved to database',
+        'key_photo': serializer.data,
+        'presigned_url': presigned_url,
+        'filename': key_photo_data['filename']
+    }, status.HTTP_201_CREATED
+
+
+def _spool_keyphoto_upload(request, photo, key_photo_data):
+    """
+    Creates a pending KeyPhoto and queues the spooled photo for upload,
+    returns (payload, status) before the object is in S3
+    """
+    serializer = KeyPhotoSerializer(
+        data=key_photo_data,
+        context={'request': request, 'status': KeyPhoto.STATUS_PENDING}
+    )
+    if not serializer.is_valid():
+        return {'error': 'Validation error', 'details': serializer.errors}, status.HTTP_400_BAD_REQUEST
+
+    spool_path = spool_upload(photo, key_photo_data['filename'])
+    key_photo = serializer.save()
+    content_type = photo.content_type
+    transaction.on_commit(
+        lambda: upload_keyphoto_to_s3.delay(key_photo.id, spool_path, content_type)
+    )
+
+    return {
+        'message': 'Photo accepted, upload to S3 in progress',
+        'key_photo': serializer.data,
+        'status_url': reverse('keyphoto-status', args=[key_photo.id], request=request),
+        'filename': key_photo_data['filename']
+    }, status.HTTP_202_ACCEPTED
+
+
 class KeyPhotoUploadView(APIView):
     """View for uploading photo to S3 and creating a KeyPhoto record"""
     permission_classes = [permissions.IsAuthenticated]
-    parser_classes = [MultiPartParser, FormParser]
+    parser_classes = [TimedMultiPartParser, FormParser]
     
     def post(self, request):
         """
@@ -119,6 +266,10 @@ class KeyPhotoUploadView(APIView):
         - photo: file image
         - photo_taken_at: date of photo creation (JSON)
         - weight_centigrams: weight in centigrams (optional, JSON)
+
+        With ?async=1 (or `Prefer: respond-async`) the photo is spooled to
+        disk and the record is created as pending; the response is 202 and
+        keyphoto/<pk>/status/ reports when the upload is ready.
         """
         try:
             # 1. Check if the file exists
@@ -161,62 +312,60 @@ class KeyPhotoUploadView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
+            # 3a. Skip the upload if the user already has this exact photo (e.g. a client retry)
+            content_hash = sha256_file(photo)
+            duplicate = KeyPhoto.find_duplicate(request.user, content_hash)
+            if duplicate is not None:
+                return _duplicate_response(duplicate)
+            
             # 4. Generate a unique filename
             file_extension = os.path.splitext(photo.name)[1]
             unique_filename = f"{uuid.uuid4()}{file_extension}"
             
             # 5. S3 settings with user-specific folder structure
-            bucket_name = 'testguru-v2'
+            bucket_name = settings.AWS_STORAGE_BUCKET_NAME
             user_id = request.user.id
             username = request.user.username
             s3_path = f"users/{username}/keyphotos/{unique_filename}"
+
+            # 6a. Async mode: spool to disk and let a Celery worker push it to S3
+            if _wants_async_upload(request):
+                key_photo_data = _key_photo_upload_data(
+                    unique_filename, s3_path, photo_taken_at, file_size, content_hash, weight_centigrams
+                )
+                payload, status_code = _spool_keyphoto_upload(request, photo, key_photo_data)
+                return Response(payload, status=status_code)
             
-            # 6. Upload the file to S3
-            s3_client = boto3.client('s3', region_name=settings.AWS_REGION)
+            # 6. Normalize (orientation, metadata, size) and upload the file to S3
+            s3_client = get_s3_client()
+            upload_file, content_type = photo, photo.content_type
+            original_file_size = file_size
+            normalized = normalize_image(photo)
+            if normalized is not None:
+                upload_file, content_type, file_size = normalized.file, normalized.content_type, normalized.size
+                unique_filename = with_extension(unique_filename, normalized.extension)
+                s3_path = with_extension(s3_path, normalized.extension)
             
             try:
-                s3_client.upload_fileobj(
-                    photo,
-                    bucket_name,
-                    s3_path,
-                    ExtraArgs={'ContentType': photo.content_type}
-                )
+                with upload_file, timed('s3'):
+                    s3_client.upload_fileobj(
+                        upload_file,
+                        bucket_name,
+                        s3_path,
+                        ExtraArgs={'ContentType': content_type}
+                    )
                 
-                # 7. Generate a temporary link (for 1 hour)
-                presigned_url = s3_client.generate_presigned_url(
-                    'get_object',
-                    Params={'Bucket': bucket_name, 'Key': s3_path},
-                    ExpiresIn=3600  # 1 hour
-                )
+                # 7. Generate a temporary link (cached until shortly before it expires)
+                presigned_url = get_presigned_url(s3_path)
                 
                 # 8. Create a record in the database
-                key_photo_data = {
-                    'filename': unique_filename,
-                    's3_path': s3_path,
-                    'presigned_url': presigned_url,
-                    'photo_taken_at': photo_taken_at,
-                    'file_size': file_size,
-                }
-                
-                # Add weight if provided
-                if weight_centigrams:
-                    key_photo_data['weight_centigrams'] = int(weight_centigrams)
-                
-                serializer = KeyPhotoSerializer(data=key_photo_data, context={'request': request})
-                if serializer.is_valid():
-                    key_photo = serializer.save()
-                    
-                    return Response({
-                        'message': 'Photo uploaded to S3 and saved to database',
-                        'key_photo': serializer.data,
-                        'presigned_url': presigned_url,
-                        'filename': unique_filename
-                    }, status=status.HTTP_201_CREATED)
-                else:
-                    return Response(
-                        {'error': 'Validation error', 'details': serializer.errors}, 
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
+                key_photo_data = _key_photo_upload_data(
+                    unique_filename, s3_path, photo_taken_at, file_size, content_hash, weight_centigrams
+                )
+                payload, status_code = _save_uploaded_keyphoto(
+                    request, key_photo_data, original_file_size, presigned_url
+                )
+                return Response(payload, status=status_code)
                     
             except ClientError as e:
                 return Response(
@@ -231,8 +380,443 @@ class KeyPhotoUploadView(APIView):
             )
 
 
+def _wants_async_upload(request):
+    """Async uploads are opt-in with ?async=1 or a `Prefer: respond-async` header"""
+    if request.GET.get('async') in ('1', 'true'):
+        return True
+    return 'respond-async' in request.headers.get('Prefer', '')
+
+
+class KeyPhotoStatusView(APIView):
+    """Upload status of a KeyPhoto (pending / ready / failed)"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        key_photo = KeyPhoto.objects.filter(pk=pk, user=request.user).values('id', 'status').first()
+        if key_photo is None:
+            return Response({'error': f'KeyPhoto with id={pk} not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(key_photo, status=status.HTTP_200_OK)
+
+
+class KeyPhotoBulkUploadView(APIView):
+    """View for uploading many photos to S3 in one request"""
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [TimedMultiPartParser, FormParser]
+
+    def post(self, request):
+        """
+        Uploads several photos to S3 concurrently and creates all KeyPhoto
+        records with a single bulk insert
+
+        Expects multipart/form-data with fields:
+        - photos: image files (repeated)
+        - metadata: JSON list with one {photo_taken_at, weight_centigrams}
+          object per photo, in the same order
+
+        Returns one result per photo (created / duplicate / error); 207 if
+        some of them failed.
+        """
+        photos = request.FILES.getlist('photos')
+        if not photos:
+            return Response({'error': 'No photos in request'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(photos) > settings.KEYPHOTO_BULK_UPLOAD_MAX_FILES:
+            return Response(
+                {'error': f'At most {settings.KEYPHOTO_BULK_UPLOAD_MAX_FILES} photos per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            metadata = json.loads(request.data.get('metadata') or '[]')
+        except ValueError:
+            return Response({'error': 'metadata must be a JSON list'}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(metadata, list) or len(metadata) != len(photos):
+            return Response(
+                {'error': 'metadata must have one entry per photo'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # 1. Validate every item before touching S3, skipping photos the user already has
+        results = [None] * len(photos)
+        pending = []
+        content_hashes = [sha256_file(photo) for photo in photos]
+        existing = {
+            key_photo.content_hash: key_photo
+            for key_photo in KeyPhoto.objects
+            .filter(user=request.user, content_hash__in=content_hashes, is_deleted=False)
+            .exclude(status=KeyPhoto.STATUS_FAILED)
+        }
+        first_index_by_hash = {}
+        for index, (photo, item) in enumerate(zip(photos, metadata)):
+            if not photo.content_type.startswith('image/'):
+                results[index] = {'index': index, 'status': 'error', 'error': 'File must be an image'}
+                continue
+            content_hash = content_hashes[index]
+            if content_hash in existing:
+                results[index] = {
+                    'index': index,
+                    'status': 'duplicate',
+                    'key_photo': KeyPhotoSerializer(existing[content_hash]).data,
+                }
+                continue
+            if content_hash in first_index_by_hash:
+                # Same file twice in one request, filled in once the first copy is created
+                results[index] = {'index': index, 'status': 'duplicate', 'duplicate_of': first_index_by_hash[content_hash]}
+                continue
+            unique_filename = f"{uuid.uuid4()}{os.path.splitext(photo.name)[1]}"
+            key_photo_data = {
+                'filename': unique_filename,
+                's3_path': _keyphoto_s3_path(request.user, unique_filename),
+                'photo_taken_at': item.get('photo_taken_at') if isinstance(item, dict) else None,
+                'file_size': photo.size,
+                'content_hash': content_hash,
+            }
+            if isinstance(item, dict) and item.get('weight_centigrams') is not None:
+                key_photo_data['weight_centigrams'] = item['weight_centigrams']
+            serializer = KeyPhotoSerializer(data=key_photo_data, context={'request': request})
+            if not serializer.is_valid():
+                results[index] = {'index': index, 'status': 'error', 'error': serializer.errors}
+                continue
+            pending.append((index, photo, serializer.validated_data))
+            first_index_by_hash[content_hash] = index
+
+        # 2. Normalize and upload to S3 with bounded parallelism
+        s3_client = get_s3_client()
+        bucket_name = settings.AWS_STORAGE_BUCKET_NAME
+
+        def upload(item):
+            index, photo, validated_data = item
+            upload_file, content_type = photo, photo.content_type
+            validated_data['original_file_size'] = validated_data['file_size']
+            try:
+                normalized = normalize_image(photo)
+            except Exception as e:
+                return f'Error processing photo: {str(e)}'
+            if normalized is not None:
+                upload_file, content_type = normalized.file, normalized.content_type
+                validated_data['file_size'] = normalized.size
+                validated_data['filename'] = with_extension(validated_data['filename'], normalized.extension)
+                validated_data['s3_path'] = with_extension(validated_data['s3_path'], normalized.extension)
+            try:
+                with upload_file, timed('s3'):
+                    s3_client.upload_fileobj(
+                        upload_file,
+                        bucket_name,
+                        validated_data['s3_path'],
+                        ExtraArgs={'ContentType': content_type}
+                    )
+            except (BotoCoreError, ClientError, S3UploadFailedError) as e:
+                return f'Error uploading to S3: {str(e)}'
+            return None
+
+        with ThreadPoolExecutor(max_workers=settings.KEYPHOTO_BULK_UPLOAD_CONCURRENCY) as pool:
+            upload_errors = list(pool.map(bind_request_stats(upload), pending))
+
+        # 3. Insert all uploaded photos at once
+        key_photos = []
+        created_indexes = []
+        for (index, photo, validated_data), error in zip(pending, upload_errors):
+            if error:
+                results[index] = {'index': index, 'status': 'error', 'error': error}
+                continue
+            if 'weight_centigrams' not in validated_data:
+                validated_data['weight_centigrams'] = KeyPhoto.generate_random_weight()
+            key_photos.append(KeyPhoto(user=request.user, **validated_data))
+            created_indexes.append(index)
+        try:
+            key_photos = KeyPhoto.objects.bulk_create(key_photos)
+        except Exception:
+            # No row points at the uploaded objects, don't leave them behind
+            try:
+                delete_objects(key_photo.s3_path for key_photo in key_photos)
+            except (BotoCoreError, ClientError):
+                pass  # left behind as orphans for reconcile_s3_objects
+            raise
+        # bulk_create skips model signals, so update the weight rollups here
+        refresh_rollup_days({(request.user.id, local_date(key_photo.photo_taken_at)) for key_photo in key_photos})
+        if key_photos:
+            versioning.bump_collection_version(request.user.id, versioning.KEYPHOTOS)
+
+        serialized = KeyPhotoSerializer(key_photos, many=True).data
+        for index, key_photo, data in zip(created_indexes, key_photos, serialized):
+            results[index] = {'index': index, 'status': 'created', 'key_photo': data}
+            schedule_derivatives(key_photo)
+        for result in results:
+            if 'duplicate_of' in result:
+                original = results[result.pop('duplicate_of')]
+                if original['status'] == 'created':
+                    result['key_photo'] = original['key_photo']
+                else:
+                    result.update(status='error', error=original['error'])
+
+        failed = sum(1 for result in results if result['status'] == 'error')
+        return Response(
+            {
+                'created': len(key_photos),
+                'duplicates': sum(1 for result in results if result['status'] == 'duplicate'),
+                'failed': failed,
+                'results': results,
+            },
+            status=status.HTTP_207_MULTI_STATUS if failed else status.HTTP_201_CREATED
+        )
+
+
+class KeyPhotoUploadInitiateView(APIView):
+    """
+    First phase of a direct-to-S3 upload: hands out presigned URLs so the
+    photo bytes go straight from the client to the bucket.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        """
+        Expects JSON with fields:
+        - filename: original file name (used for the extension)
+        - content_type: image mime type, must be sent back as Content-Type on PUT
+        - file_size: size in bytes
+        - content_hash: hex SHA-256 of the file (optional); if the user already
+          has a photo with this hash it is returned with 200 and nothing is uploaded.
+          A single PUT must then send it as x-amz-checksum-sha256 (see headers),
+          so S3 rejects bytes that don't match it
+
+        Small files get a single presigned PUT url, files above
+        KEYPHOTO_MULTIPART_THRESHOLD get one presigned url per multipart part.
+        The returned upload_token must be passed to keyphoto/upload/complete/.
+        """
+        serializer = KeyPhotoUploadInitiateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {'error': 'Validation error', 'details': serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        data = serializer.validated_data
+
+        # The client already uploaded this exact photo, no bytes need to move
+        duplicate = KeyPhoto.find_duplicate(request.user, data.get('content_hash'))
+        if duplicate is not None:
+            return _duplicate_response(duplicate)
+
+        file_extension = os.path.splitext(data['filename'])[1]
+        unique_filename = f"{uuid.uuid4()}{file_extension}"
+        s3_path = _keyphoto_s3_path(request.user, unique_filename)
+        bucket_name = settings.AWS_STORAGE_BUCKET_NAME
+        expires_in = settings.KEYPHOTO_UPLOAD_URL_EXPIRES
+
+        s3_client = get_s3_client()
+        response_data = {
+            'filename': unique_filename,
+            's3_path': s3_path,
+            'expires_in': expires_in,
+        }
+        token_data = {
+            'user_id': request.user.id,
+            'filename': unique_filename,
+            's3_path': s3_path,
+            'content_type': data['content_type'],
+            'content_hash': data.get('content_hash', ''),
+            'upload_id': None,
+        }
+
+        try:
+            if data['file_size'] <= settings.KEYPHOTO_MULTIPART_THRESHOLD:
+                params = {
+                    'Bucket': bucket_name,
+                    'Key': s3_path,
+                    'ContentType': data['content_type'],
+                }
+                headers = {'Content-Type': data['content_type']}
+                if data.get('content_hash'):
+                    # S3 verifies the body against it, complete/ reads it back
+                    checksum = _s3_sha256_checksum(data['content_hash'])
+                    params.update(ChecksumAlgorithm='SHA256', ChecksumSHA256=checksum)
+                    headers['x-amz-checksum-sha256'] = checksum
+                response_data['multipart'] = False
+                response_data['method'] = 'PUT'
+                response_data['url'] = s3_client.generate_presigned_url(
+                    'put_object',
+                    Params=params,
+                    ExpiresIn=expires_in
+                )
+                response_data['headers'] = headers
+            else:
+                multipart = s3_client.create_multipart_upload(
+                    Bucket=bucket_name,
+                    Key=s3_path,
+                    ContentType=data['content_type']
+                )
+                upload_id = multipart['UploadId']
+                part_size = settings.KEYPHOTO_MULTIPART_PART_SIZE
+                part_count = -(-data['file_size'] // part_size)
+                token_data['upload_id'] = upload_id
+
+                response_data['multipart'] = True
+                response_data['method'] = 'PUT'
+                response_data['part_size'] = part_size
+                response_data['parts'] = [
+                    {
+                        'part_number': part_number,
+                        'url': s3_client.generate_presigned_url(
+                            'upload_part',
+                            Params={
+                                'Bucket': bucket_name,
+                                'Key': s3_path,
+                                'UploadId': upload_id,
+                                'PartNumber': part_number,
+                            },
+                            ExpiresIn=expires_in
+                        ),
+                    }
+                    for part_number in range(1, part_count + 1)
+                ]
+        except ClientError as e:
+            return Response(
+                {'error': f'Error preparing S3 upload: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        response_data['upload_token'] = signing.dumps(token_data, salt=UPLOAD_TOKEN_SALT)
+        return Response(response_data, status=status.HTTP_201_CREATED)
+
+
+class KeyPhotoUploadCompleteView(APIView):
+    """
+    Second phase of a direct-to-S3 upload: checks the object with HEAD
+    and creates the KeyPhoto record.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        """
+        Expects JSON with fields:
+        - upload_token: token returned by keyphoto/upload/initiate/
+        - photo_taken_at: date of photo creation
+        - weight_centigrams: weight in centigrams (optional)
+        - parts: [{part_number, etag}] (multipart uploads only)
+        """
+        serializer = KeyPhotoUploadCompleteSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {'error': 'Validation error', 'details': serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        data = serializer.validated_data
+
+        try:
+            upload = signing.loads(
+                data['upload_token'],
+                salt=UPLOAD_TOKEN_SALT,
+                max_age=settings.KEYPHOTO_UPLOAD_TOKEN_MAX_AGE
+            )
+        except signing.BadSignature:
+            return Response(
+                {'error': 'Invalid or expired upload token'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if upload['user_id'] != request.user.id:
+            return Response(
+                {'error': 'Invalid or expired upload token'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Completing twice (e.g. a client retry) returns the existing record
+        existing = KeyPhoto.objects.filter(user=request.user, filename=upload['filename']).first()
+        if existing is not None:
+            key_photo = KeyPhotoSerializer(existing).data
+            return Response({
+                'message': 'Photo already saved to database',
+                'key_photo': key_photo,
+                'presigned_url': key_photo['presigned_url'],
+                'filename': existing.filename
+            }, status=status.HTTP_200_OK)
+
+        bucket_name = settings.AWS_STORAGE_BUCKET_NAME
+        s3_path = upload['s3_path']
+        s3_client = get_s3_client()
+
+        if upload['upload_id']:
+            if not data.get('parts'):
+                _abort_multipart_upload(s3_client, upload)
+                return Response(
+                    {'error': 'parts is required for multipart uploads'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            parts = sorted(data['parts'], key=lambda part: part['part_number'])
+            try:
+                s3_client.complete_multipart_upload(
+                    Bucket=bucket_name,
+                    Key=s3_path,
+                    UploadId=upload['upload_id'],
+                    MultipartUpload={'Parts': [
+                        {'PartNumber': part['part_number'], 'ETag': part['etag']}
+                        for part in parts
+                    ]}
+                )
+            except ClientError as e:
+                _abort_multipart_upload(s3_client, upload)
+                return Response(
+                    {'error': f'Error completing multipart upload: {str(e)}'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        try:
+            head = s3_client.head_object(Bucket=bucket_name, Key=s3_path, ChecksumMode='ENABLED')
+        except ClientError as e:
+            return Response(
+                {'error': f'Uploaded object not found in S3: {str(e)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        file_size = head['ContentLength']
+        if file_size > settings.KEYPHOTO_MAX_UPLOAD_SIZE:
+            s3_client.delete_object(Bucket=bucket_name, Key=s3_path)
+            return Response(
+                {'error': 'File is too large'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # The client's hash is only kept once S3 has checked it against the stored bytes
+        # (multipart objects only have a checksum of their part checksums)
+        content_hash = upload.get('content_hash', '')
+        if content_hash and head.get('ChecksumSHA256') != _s3_sha256_checksum(content_hash):
+            content_hash = ''
+
+        # Another upload of the same content finished first, keep only that one
+        duplicate = KeyPhoto.find_duplicate(request.user, content_hash)
+        if duplicate is not None:
+            s3_client.delete_object(Bucket=bucket_name, Key=s3_path)
+            return _duplicate_response(duplicate)
+
+        presigned_url = get_presigned_url(s3_path)
+
+        key_photo_data = {
+            'filename': upload['filename'],
+            's3_path': s3_path,
+            'photo_taken_at': data['photo_taken_at'],
+            'file_size': file_size,
+            'content_hash': content_hash,
+        }
+        if data.get('weight_centigrams') is not None:
+            key_photo_data['weight_centigrams'] = data['weight_centigrams']
+
+        serializer = KeyPhotoSerializer(data=key_photo_data, context={'request': request})
+        if not serializer.is_valid():
+            s3_client.delete_object(Bucket=bucket_name, Key=s3_path)
+            return Response(
+                {'error': 'Validation error', 'details': serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        key_photo = serializer.save()
+        schedule_derivatives(key_photo)
+
+        return Response({
+            'message': 'Photo uploaded to S3 and saved to database',
+            'key_photo': serializer.data,
+            'presigned_url': presigned_url,
+            'filename': upload['filename']
+        }, status=status.HTTP_201_CREATED)
+
+
 class KeyPhotoDetailView(APIView):
     permission_classes = [permissions.IsAuthenticated]
+    replica_reads = True  # GET only, see gymguru.db_router
     def get(self, request, pk):
         """
         Get all fields of KeyPhoto by id (only if owned by current user)
@@ -240,7 +824,7 @@ class KeyPhotoDetailView(APIView):
         try:
             obj = KeyPhoto.objects.get(pk=pk, user=request.user)
             from .serializers import KeyPhotoSerializer
-            serializer = KeyPhotoSerializer(obj)
+            serializer = KeyPhotoSerializer(obj, context={'size': _get_requested_size(request)})
             return Response(serializer.data, status=status.HTTP_200_OK)
         except KeyPhoto.DoesNotExist:
             return Response({'error': f'KeyPhoto with id={pk} not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -259,59 +843,625 @@ class KeyPhotoDetailView(APIView):
 
     def delete(self, request, pk):
         """
-        Hard delete: deletes the record from the database (only if owned by current user)
+        Hard delete: deletes the record from the database and its objects
+        from S3 (only if owned by current user)
         """
         try:
             obj = KeyPhoto.objects.get(pk=pk, user=request.user)
             obj.delete()
+            try:
+                delete_objects(obj.get_s3_paths())
+            except (BotoCoreError, ClientError):
+                pass  # left behind as orphans for reconcile_s3_objects
             return Response({'message': f'KeyPhoto with id={pk} deleted from database'}, status=status.HTTP_200_OK)
         except KeyPhoto.DoesNotExist:
             return Response({'error': f'KeyPhoto with id={pk} not found'}, status=status.HTTP_404_NOT_FOUND)
 
+def _parse_range_header(range_header, size):
+    """
+    Parses a single `bytes=` range into (start, end) inclusive offsets.
+    Returns None when the header should be ignored (absent, malformed or
+    multiple ranges) and raises ValueError when it is unsatisfiable.
+    """
+    if not range_header or not range_header.startswith('bytes='):
+        return None
+    ranges = range_header[len('bytes='):].split(',')
+    if len(ranges) != 1:
+        return None
+    start, sep, end = ranges[0].strip().partition('-')
+    try:
+        start = int(start) if start else None
+        end = int(end) if end else None
+    except ValueError:
+        return None
+    if not sep or (start is None and end is None):
+        return None
+
+    if start is None:
+        # Suffix range: the last `end` bytes
+        if end == 0:
+            raise ValueError('Empty suffix range')
+        return max(size - end, 0), size - 1
+    if end is not None and start > end:
+        return None
+    if start >= size:
+        raise ValueError('Range starts after the end of the object')
+    return start, size - 1 if end is None else min(end, size - 1)
+
+
+def _iter_s3_body(body, chunk_size):
+    try:
+        yield from body.iter_chunks(chunk_size)
+    finally:
+        body.close()
+
+
+def _download_headers(metadata):
+    return {
+        'ETag': metadata['etag'],
+        'Last-Modified': http_date(metadata['last_modified']),
+        'Cache-Control': f'private, max-age={settings.KEYPHOTO_DOWNLOAD_MAX_AGE}',
+        'Accept-Ranges': 'bytes',
+    }
+
+
+def _download_conditional_response(request, metadata, headers):
+    """304/412 answered from cached metadata, without touching S3, or None"""
+    conditional = get_conditional_response(
+        request,
+        etag=metadata['etag'],
+        last_modified=metadata['last_modified'],
+    )
+    if conditional is not None:
+        for header, value in headers.items():
+            conditional[header] = value
+    return conditional
+
+
+def _download_byte_range(request, metadata):
+    """
+    (start, end) of the requested range, or None for the whole object.
+    Raises ValueError when the range can't be satisfied.
+    """
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range != metadata['etag']:
+        return None
+    return _parse_range_header(request.headers.get('Range'), metadata['content_length'])
+
+
+def _range_not_satisfiable(metadata):
+    response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+    response['Content-Range'] = f"bytes */{metadata['content_length']}"
+    return response
+
+
+def _iter_file_range(cached_file, start, end, chunk_size):
+    try:
+        cached_file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = cached_file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        cached_file.close()
+
+
+def _download_response(body, s3_path, metadata, headers, content_length, byte_range,
+                       response_class=StreamingHttpResponse):
+    # Determine content_type by file extension
+    content_type, _ = mimetypes.guess_type(s3_path)
+    if not content_type:
+        content_type = metadata['content_type'] or 'application/octet-stream'
+
+    response = response_class(
+        body,
+        content_type=content_type,
+        status=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+    )
+    for header, value in headers.items():
+        response[header] = value
+    response['Content-Length'] = content_length
+    response['Content-Disposition'] = f'inline; filename="{os.path.basename(s3_path)}"'
+    if byte_range:
+        response['Content-Range'] = f"bytes {byte_range[0]}-{byte_range[1]}/{metadata['content_length']}"
+    return response
+
+
 class KeyPhotoDownloadView(APIView):
+    """
+    Proxies a KeyPhoto from S3 with support for byte ranges (206) and
+    conditional requests (304) based on the object's ETag/Last-Modified.
+    """
     permission_classes = [permissions.IsAuthenticated]
+
     def get(self, request, pk):
         try:
             obj = KeyPhoto.objects.get(pk=pk, user=request.user)
             if obj.is_deleted:
                 return Response({'error': 'Photo deleted'}, status=410)
-            s3 = boto3.client('s3', region_name='ru-central1')
-            s3_response = s3.get_object(Bucket='testguru-v2', Key=obj.s3_path)
-            fileobj = s3_response['Body']
-            # Determine content_type by file extension
-            content_type, _ = mimetypes.guess_type(obj.filename)
-            if not content_type:
-                content_type = 'application/octet-stream'
-            return FileResponse(fileobj, content_type=content_type, filename=obj.filename)
+
+            s3_path = obj.get_s3_path(_get_requested_size(request))
+            try:
+                metadata = get_object_metadata(s3_path)
+            except ClientError as e:
+                if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                    raise Http404()
+                raise
+
+            headers = _download_headers(metadata)
+            conditional = _download_conditional_response(request, metadata, headers)
+            if conditional is not None:
+                return conditional
+
+            try:
+                byte_range = _download_byte_range(request, metadata)
+            except ValueError:
+                return _range_not_satisfiable(metadata)
+
+            # Ranges use the cache only when the object is already in it; a miss is a ranged
+            # GET to S3 rather than a download of the whole object, e.g. for a player's probe
+            cached_file = self.open_cached(s3_path, metadata, fill=not byte_range)
+            if cached_file is not None:
+                if byte_range:
+                    return _download_response(
+                        _iter_file_range(cached_file, *byte_range, settings.KEYPHOTO_DOWNLOAD_CHUNK_SIZE),
+                        s3_path, metadata, headers, byte_range[1] - byte_range[0] + 1, byte_range
+                    )
+                # FileResponse lets the server send the local file with sendfile
+                return _download_response(
+                    cached_file, s3_path, metadata, headers, metadata['content_length'], None,
+                    response_class=FileResponse
+                )
+
+            get_kwargs = {'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Key': s3_path}
+            if byte_range:
+                get_kwargs['Range'] = f'bytes={byte_range[0]}-{byte_range[1]}'
+            s3_response = get_s3_client().get_object(**get_kwargs)
+
+            return _download_response(
+                _iter_s3_body(s3_response['Body'], settings.KEYPHOTO_DOWNLOAD_CHUNK_SIZE),
+                s3_path, metadata, headers, s3_response['ContentLength'], byte_range
+            )
         except KeyPhoto.DoesNotExist:
             raise Http404()
+        except (Http404, ValidationError):
+            raise
         except Exception as e:
             return Response({'error': str(e)}, status=500)
 
+    @staticmethod
+    def open_cached(s3_path, metadata, fill=True):
+        """
+        The object from the local disk cache (downloaded into it on a miss if
+        `fill`), or None to stream it from S3: cache disabled, object too
+        large or not cached, or the cache directory failing.
+        """
+        cache = get_download_cache()
+        if cache is None:
+            return None
+        try:
+            return cache.open(s3_path, metadata['content_length'], fill=fill)
+        except OSError:
+            return None
+
+
+class StoragePoolStatsView(APIView):
+    """Connection pool counters of the shared S3 client in this worker process"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(pool_stats(), status=status.HTTP_200_OK)
+
+
+class DownloadCacheStatsView(APIView):
+    """Hit/miss/eviction counters of the KeyPhoto disk cache in this worker process"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        cache = get_download_cache()
+        if cache is None:
+            return Response({'error': 'Download cache is disabled'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(cache.stats(), status=status.HTTP_200_OK)
+
 
-class UserKeyPhotosView(APIView):
-    """View for getting all KeyPhotos for the current user"""
+class SparseFieldsViewMixin:
+    """
+    Reads a comma-separated `fields` query parameter and passes it to the
+    serializer, e.g. ?fields=id,photo_taken_at,weight_centigrams
+    """
+
+    def get_requested_fields(self):
+        fields = self.request.query_params.get('fields')
+        if not fields:
+            return None
+        fields = list(dict.fromkeys(field.strip() for field in fields.split(',') if field.strip()))
+        unknown = set(fields) - set(self.get_serializer_class().Meta.fields)
+        if unknown:
+            raise ValidationError({'fields': f"Unknown fields: {', '.join(sorted(unknown))}"})
+        return fields
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs['fields'] = self.get_requested_fields()
+        return super().get_serializer(*args, **kwargs)
+
+
+class ValuesListMixin:
+    """
+    Lists with `values_serializer_class` (timelines.fast_serializers) from
+    .values() rows rather than model instances, for the same response.
+    Needs SparseFieldsViewMixin for the `fields` parameter.
+    """
+    values_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        if not settings.FAST_LIST_SERIALIZATION:
+            return super().list(request, *args, **kwargs)
+
+        serializer = self.values_serializer_class(
+            fields=self.get_requested_fields(), context=self.get_serializer_context()
+        )
+        # Cursor pagination reads the position from the ordering columns of the last row
+        ordering = getattr(self.paginator, 'ordering', None) or ()
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        columns = dict.fromkeys(serializer.columns + tuple(field.lstrip('-') for field in ordering))
+        queryset = self.filter_queryset(self.get_queryset()).values(*columns)
+
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(serializer.to_representation(queryset))
+        return self.get_paginated_response(serializer.to_representation(page))
+
+
+def _keyphotos_etag(request, *args, **kwargs):
+    fields = request.GET.get('fields')
+    includes_presigned_urls = not fields or 'presigned_url' in fields
+    return versioning.collection_etag(request, versioning.KEYPHOTOS, includes_presigned_urls)
+
+
+def _timelines_etag(request, *args, **kwargs):
+    return versioning.collection_etag(request, versioning.TIMELINES)
+
+
+class UserKeyPhotosView(TokenUserReadsMixin, SparseFieldsViewMixin, ValuesListMixin, generics.ListAPIView):
+    """View for getting the current user's KeyPhotos, newest first, a page at a time"""
+    serializer_class = KeyPhotoSerializer
+    values_serializer_class = KeyPhotoValuesSerializer
     permission_classes = [permissions.IsAuthenticated]
-    
+    pagination_class = CreatedCursorPagination
+    replica_reads = True
+
+    # Unchanged collections are answered with 304 before any query runs
+    @method_decorator(condition(etag_func=_keyphotos_etag))
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        return KeyPhoto.objects.filter(user_id=self.request.user.id, is_deleted=False)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['size'] = _get_requested_size(self.request)
+        return context
+
+
+class UserTimelinesView(TokenUserReadsMixin, SparseFieldsViewMixin, ValuesListMixin, generics.ListAPIView):
+    """View for getting the current user's Timelines, newest first, a page at a time"""
+    serializer_class = NewTimelineSerializer
+    values_serializer_class = TimelineValuesSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CreatedCursorPagination
+    replica_reads = True
+
+    @method_decorator(condition(etag_func=_timelines_etag))
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        return Timeline.objects.filter(user_id=self.request.user.id, is_deleted=False)
+
+
+def _get_user_timeline(request, pk, for_update=False):
+    timelines = Timeline.objects.filter(pk=pk, user=request.user, is_deleted=False)
+    if for_update:
+        timelines = timelines.select_for_update()
+    return timelines.first()
+
+
+def _timeline_not_found(pk):
+    return Response({'error': f'Timeline with id={pk} not found'}, status=status.HTTP_404_NOT_FOUND)
+
+
+class TimelineKeyPhotosView(SparseFieldsViewMixin, generics.GenericAPIView):
+    """KeyPhotos of one of the current user's Timelines, with bulk add and remove"""
+    serializer_class = KeyPhotoSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['size'] = _get_requested_size(self.request)
+        return context
+
+    def get(self, request, pk):
+        """
+        Query parameters:
+        - start, end: YYYY-MM-DD, inclusive window of photo_taken_at, both optional
+        - fields, size: as for my-keyphotos/
+
+        Photos are returned in timeline order, fetched with a single query.
+        """
+        query = TimelineKeyPhotosQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(
+                {'error': 'Validation error', 'details': query.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        memberships = TimelineKeyPhoto.objects.filter(
+            timeline_id=pk,
+            timeline__user=request.user,
+            timeline__is_deleted=False,
+            key_photo__is_deleted=False,
+        )
+        if query.validated_data.get('start'):
+            memberships = memberships.filter(photo_taken_at__gte=local_day_start(query.validated_data['start']))
+        if query.validated_data.get('end'):
+            end = query.validated_data['end'] + timedelta(days=1)
+            memberships = memberships.filter(photo_taken_at__lt=local_day_start(end))
+        key_photos = [
+            membership.key_photo
+            for membership in memberships.select_related('key_photo').order_by('position', 'id')
+        ]
+        # An empty result doesn't tell a missing timeline from an empty window
+        if not key_photos and _get_user_timeline(request, pk) is None:
+            return _timeline_not_found(pk)
+        return Response({
+            'timeline': pk,
+            'results': self.get_serializer(key_photos, many=True).data,
+        }, status=status.HTTP_200_OK)
+
+    def post(self, request, pk):
+        """
+        Appends KeyPhotos to the timeline in the given order.
+        Expects JSON {"key_photo_ids": [...]}; photos already in it are skipped.
+        """
+        serializer = TimelineKeyPhotoIdsSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {'error': 'Validation error', 'details': serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        key_photo_ids = serializer.validated_data['key_photo_ids']
+
+        with transaction.atomic():
+            # Locking the timeline serialises concurrent appends, so positions don't collide
+            timeline = _get_user_timeline(request, pk, for_update=True)
+            if timeline is None:
+                return _timeline_not_found(pk)
+            taken_at = dict(
+                KeyPhoto.objects
+                .filter(user=request.user, is_deleted=False, id__in=key_photo_ids)
+                .values_list('id', 'photo_taken_at')
+            )
+            unknown = [key_photo_id for key_photo_id in key_photo_ids if key_photo_id not in taken_at]
+            if unknown:
+                return Response(
+                    {'error': 'KeyPhotos not found', 'key_photo_ids': unknown},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            existing = set(
+                timeline.memberships.filter(key_photo_id__in=key_photo_ids).values_list('key_photo_id', flat=True)
+            )
+            last_position = timeline.memberships.aggregate(last=Max('position'))['last']
+            next_position = 0 if last_position is None else last_position + 1
+            memberships = TimelineKeyPhoto.objects.bulk_create([
+                TimelineKeyPhoto(
+                    timeline=timeline,
+                    key_photo_id=key_photo_id,
+                    position=next_position + index,
+                    photo_taken_at=taken_at[key_photo_id],
+                )
+                for index, key_photo_id in enumerate(
+                    key_photo_id for key_photo_id in key_photo_ids if key_photo_id not in existing
+                )
+            ])
+            if memberships:
+                # Lets sync/ clients know the timeline changed
+                timeline.save(update_fields=['updated'])
+
+        return Response(
+            {'added': len(memberships), 'skipped': len(existing)},
+            status=status.HTTP_201_CREATED if memberships else status.HTTP_200_OK
+        )
+
+    def delete(self, request, pk):
+        """
+        Removes KeyPhotos from the timeline (the photos themselves are kept).
+        Expects JSON {"key_photo_ids": [...]}.
+        """
+        serializer = TimelineKeyPhotoIdsSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {'error': 'Validation error', 'details': serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        with transaction.atomic():
+            timeline = _get_user_timeline(request, pk)
+            if timeline is None:
+                return _timeline_not_found(pk)
+            removed, _ = timeline.memberships.filter(
+                key_photo_id__in=serializer.validated_data['key_photo_ids']
+            ).delete()
+            if removed:
+                timeline.save(update_fields=['updated'])
+        return Response({'removed': removed}, status=status.HTTP_200_OK)
+
+
+class TimelineKeyPhotosOrderView(APIView):
+    """Reorders the KeyPhotos of one of the current user's Timelines"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def put(self, request, pk):
+        """
+        Expects JSON {"key_photo_ids": [...]}: these photos move to the front
+        in the given order, the others keep their relative order after them.
+        Done with a single UPDATE whatever the number of photos.
+        """
+        serializer = TimelineKeyPhotoIdsSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {'error': 'Validation error', 'details': serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        key_photo_ids = serializer.validated_data['key_photo_ids']
+
+        with transaction.atomic():
+            timeline = _get_user_timeline(request, pk, for_update=True)
+            if timeline is None:
+                return _timeline_not_found(pk)
+            members = set(
+                timeline.memberships.filter(key_photo_id__in=key_photo_ids).values_list('key_photo_id', flat=True)
+            )
+            unknown = [key_photo_id for key_photo_id in key_photo_ids if key_photo_id not in members]
+            if unknown:
+                return Response(
+                    {'error': 'KeyPhotos are not in this timeline', 'key_photo_ids': unknown},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            timeline.memberships.update(position=Case(
+                *[When(key_photo_id=key_photo_id, then=Value(index)) for index, key_photo_id in enumerate(key_photo_ids)],
+                default=F('position') + len(key_photo_ids),
+                output_field=IntegerField(),
+            ))
+            timeline.save(update_fields=['updated'])
+        return Response({'reordered': len(key_photo_ids)}, status=status.HTTP_200_OK)
+
+
+class WeightAnalyticsView(APIView):
+    """Weight aggregates for the current user, read from precomputed rollups"""
+    permission_classes = [permissions.IsAuthenticated]
+
     def get(self, request):
-        """Get all KeyPhotos for the current user"""
+        """
+        Query parameters:
+        - period: day | week | month (default day)
+        - start, end: YYYY-MM-DD, inclusive, both optional
+        - window: number of points in the moving average (default 7)
+
+        Weights are in centigrams; trend slope is centigrams per day.
+        """
+        serializer = WeightAnalyticsQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(
+                {'error': 'Validation error', 'details': serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        params = serializer.validated_data
+        series = weight_series(
+            request.user,
+            params['period'],
+            start=params.get('start'),
+            end=params.get('end'),
+            window=params['window'],
+        )
+        return Response({
+            'period': params['period'],
+            'start': params.get('start'),
+            'end': params.get('end'),
+            **series,
+        }, status=status.HTTP_200_OK)
+
+
+class TimelapseView(APIView):
+    """Starts rendering a timelapse of the current user's KeyPhotos"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        """
+        Expects JSON with fields (all optional):
+        - format: webp | mp4 (default TIMELAPSE_FORMAT)
+        - start, end: YYYY-MM-DD, inclusive range of photo_taken_at
+
+        Renders of the same photos and options are reused: a finished one is
+        returned with 200, otherwise the response is 202 and the status_url
+        reports progress.
+        """
+        serializer = TimelapseRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {'error': 'Validation error', 'details': serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        params = serializer.validated_data
+        key_photos = list(timelapse_source(request.user, params.get('start'), params.get('end')))
+        if len(key_photos) < 2:
+            return Response(
+                {'error': 'At least 2 photos are needed for a timelapse'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        timelapse, created = Timelapse.objects.get_or_create(
+            user=request.user,
+            input_hash=timelapse_input_hash(key_photos, params['format']),
+            defaults={
+                'format': params['format'],
+                'key_photo_ids': [key_photo.id for key_photo in key_photos],
+            }
+        )
+        if timelapse.status == Timelapse.STATUS_FAILED:
+            timelapse.status = Timelapse.STATUS_PENDING
+            timelapse.photos_rendered = 0
+            timelapse.error = ''
+            timelapse.save(update_fields=['status', 'photos_rendered', 'error', 'updated'])
+            created = True
+        if created:
+            transaction.on_commit(lambda: render_keyphoto_timelapse.delay(timelapse.id))
+
+        if timelapse.status == Timelapse.STATUS_READY:
+            return Response(TimelapseSerializer(timelapse).data, status=status.HTTP_200_OK)
+        return Response({
+            'timelapse': TimelapseSerializer(timelapse).data,
+            'status_url': reverse('timelapse-detail', args=[timelapse.id], request=request),
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class TimelapseDetailView(APIView):
+    """Status, progress and (once ready) download url of a timelapse"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
         try:
-            key_photos = KeyPhoto.objects.filter(user=request.user, is_deleted=False).order_by('-created')
-            serializer = KeyPhotoSerializer(key_photos, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        except Exception as e:
-            return Response({'error': str(e)}, status=500)
+            timelapse = Timelapse.objects.get(pk=pk, user=request.user)
+        except Timelapse.DoesNotExist:
+            return Response({'error': f'Timelapse with id={pk} not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(TimelapseSerializer(timelapse).data, status=status.HTTP_200_OK)
 
 
-class UserTimelinesView(APIView):
-    """View for getting all Timelines for the current user"""
+class SyncView(APIView):
+    """Changes to the current user's KeyPhotos and Timelines since a sync token"""
     permission_classes = [permissions.IsAuthenticated]
-    
+
     def get(self, request):
-        """Get all Timelines for the current user"""
+        """
+        Query parameters:
+        - since: token from the previous response, omit for a full sync
+
+        Soft-deleted rows come back with is_deleted=true, hard-deleted ones
+        as ids under `deleted`. Keep requesting with `next` while `has_more`
+        is true. Clients should upsert, a change may be delivered twice.
+        """
         try:
-            timelines = Timeline.objects.filter(user=request.user, is_deleted=False).order_by('-created')
-            serializer = NewTimelineSerializer(timelines, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        except Exception as e:
-            return Response({'error': str(e)}, status=500)
\ No newline at end of file
+            changes = changes_since(request.user, request.query_params.get('since'))
+        except signing.BadSignature:
+            return Response({'error': 'Invalid sync token'}, status=status.HTTP_400_BAD_REQUEST)
+
+        context = {'request': request, 'size': _get_requested_size(request)}
+        return Response({
+            'keyphotos': KeyPhotoSerializer(changes['key_photos'], many=True, context=context).data,
+            'timelines': NewTimelineSerializer(changes['timelines'], many=True, context=context).data,
+            'deleted': changes['deleted'],
+            'next': changes['next'],
+            'has_more': changes['has_more'],
+        }, status=status.HTTP_200_OK)